@@ -0,0 +1,85 @@
+# pylint: disable=W1201
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+"""
+
+asyncio engine for the size attempts.
+
+All attempts run from one process: each blocking attempt (a Selenium add to cart or an
+HTTP cart request) runs on a worker thread and is awaited with its own timeout. As soon
+as `target` attempts have succeeded, the remaining ones are cancelled. A thread cannot
+be interrupted, so every attempt receives a `threading.Event` that is set when it is
+cancelled or times out, and checks it between steps.
+
+"""
+
+LOGGER = logging.getLogger()
+
+
+class CartAttemptCancelled(Exception):
+    pass
+
+
+async def run_attempt(loop, executor, label, attempt, timeout):
+    stop_event = threading.Event()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, attempt, stop_event), timeout
+        )
+    except asyncio.TimeoutError:
+        raise Exception(f"Attempt for {label} timed out after {timeout:.1f}s")
+    finally:
+        # Set on success too; the attempt has nothing left to do either way
+        stop_event.set()
+
+
+async def run_until_target(attempts, target, task_timeout=None, release_time=None):
+    loop = asyncio.get_running_loop()
+    succeeded = []
+    failed = []
+    # The budget starts counting at the release, not while attempts wait for it
+    timeout = None
+    if task_timeout is not None:
+        timeout = task_timeout + max(0, (release_time or 0) - time.time())
+
+    executor = ThreadPoolExecutor(len(attempts), thread_name_prefix="cart-attempt")
+    try:
+        tasks = {
+            asyncio.ensure_future(run_attempt(loop, executor, label, attempt, timeout)): label
+            for label, attempt in attempts
+        }
+        pending = set(tasks)
+        while pending and len(succeeded) < target:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                label = tasks[task]
+                try:
+                    task.result()
+                    LOGGER.info(f"Cart attempt succeeded: {label}")
+                    succeeded.append(label)
+                except Exception as e:
+                    LOGGER.warning(f"Cart attempt failed: {label}: " + str(e))
+                    metrics.inc("cart_failures_total", size=label)
+                    failed.append(label)
+
+        if pending:
+            LOGGER.info(f"Cart target of {target} reached, cancelling {len(pending)} attempts")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        # Cancelled attempts finish their current step in the background and clean up
+        executor.shutdown(wait=False)
+
+    return succeeded, failed
+
+
+def run(attempts, target, task_timeout=None, release_time=None):
+    return asyncio.run(run_until_target(attempts, target, task_timeout, release_time))
@@ -0,0 +1,1169 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import argparse
+import functools
+import glob
+import json
+import logging
+import multiprocessing as mp
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import async_engine
+import browser_session
+import diagnostics
+import fake_driver
+import instrumentation
+import main
+import metrics
+import queue_logging
+import requests
+import resource_blocking
+import resource_usage
+import retry
+from cart_client import CART_HEADERS, CartClient
+from driver_pool import DriverPool
+from fake_driver import PRODUCT_PATH, FakeDriver, FakeElement
+from locators import Locator
+from mock_server import add_storefront_arguments, storefront_from_args
+from plan import MP_START_METHOD, compile_plan
+from profile_cache import ProfileCache
+from selenium.common.exceptions import ElementClickInterceptedException
+from selenium.webdriver.remote.command import Command
+
+"""
+
+Offline benchmarks for main.py, run against the local mock storefront (mock_server.py).
+
+    python benchmark.py pipeline --driver-type chrome --iterations 10
+
+Each scenario reports p50/p95/p99 wall-clock times per phase.
+
+"""
+
+LOGGER = main.LOGGER
+SCENARIOS = OrderedDict()
+BENCH_USERNAME = "bench@example.com"
+BENCH_PASSWORD = "password"
+BENCH_CVV = "123"
+
+
+def scenario(name, help_text):
+    def register(fn):
+        SCENARIOS[name] = (fn, help_text)
+        return fn
+
+    return register
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return float("nan")
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples):
+    return OrderedDict(
+        (
+            phase,
+            {
+                "n": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "p99": percentile(durations, 99),
+            },
+        )
+        for phase, durations in samples.items()
+    )
+
+
+def print_report(title, summary, failures=None, unit="s"):
+    width = max([32] + [len(phase) + 2 for phase in summary])
+    print()
+    print(title)
+    print(
+        f"{'phase':<{width}}{'n':>5}{f'p50 ({unit})':>12}{f'p95 ({unit})':>12}{f'p99 ({unit})':>12}"
+        f"{'failed':>8}"
+    )
+    for phase, stats in summary.items():
+        failed = (failures or {}).get(phase, 0)
+        print(
+            f"{phase:<{width}}{stats['n']:>5}"
+            f"{stats['p50']:>12.3f}{stats['p95']:>12.3f}{stats['p99']:>12.3f}{failed:>8}"
+        )
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.samples = OrderedDict()
+        self.failures = {}
+
+    @contextmanager
+    def phase(self, name):
+        self.samples.setdefault(name, [])
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.failures[name] = self.failures.get(name, 0) + 1
+            raise
+        self.samples[name].append(time.perf_counter() - start)
+
+    def report(self, title):
+        summary = summarize(self.samples)
+        print_report(title, summary, self.failures)
+        return {"phases": summary, "failures": self.failures}
+
+
+def new_driver(args, resource_policy=None, profile_dir=None):
+    return main.generate_driver(
+        args.webdriver_path,
+        args.driver_type,
+        args.page_load_timeout,
+        headless=not args.headful,
+        resource_policy=resource_policy,
+        profile_dir=profile_dir,
+    )
+
+
+def login_bench_driver(args, storefront, driver):
+    main.login(
+        driver,
+        None,
+        args.num_retries,
+        BENCH_USERNAME,
+        BENCH_PASSWORD,
+        args.page_load_timeout,
+        home_url=storefront.login_url,
+    )
+
+
+def add_bench_size_to_cart(args, storefront, driver):
+    main.add_to_cart(
+        driver,
+        storefront.product_url,
+        None,
+        args.num_retries,
+        args.shoe_gender,
+        args.shoe_size,
+        args.page_load_timeout,
+    )
+
+
+def run_pipeline(args, storefront, timer):
+    storefront.reset()
+    start = time.perf_counter()
+    with timer.phase("generate_driver"):
+        driver = new_driver(args)
+    try:
+        with timer.phase("login"):
+            login_bench_driver(args, storefront, driver)
+        with timer.phase("add_to_cart"):
+            add_bench_size_to_cart(args, storefront, driver)
+        with timer.phase("checkout_cart"):
+            main.checkout_cart(
+                driver,
+                args.num_retries,
+                BENCH_CVV,
+                True,
+                args.page_load_timeout,
+                cart_url=storefront.cart_url,
+            )
+        timer.samples.setdefault("total", []).append(time.perf_counter() - start)
+    except Exception as e:
+        LOGGER.exception("Pipeline iteration failed: " + str(e))
+    finally:
+        driver.quit()
+
+
+@scenario("pipeline", "login -> add_to_cart -> checkout_cart, one browser per iteration")
+def bench_pipeline(args):
+    if args.timeline_dir:
+        instrumentation.enable(args.timeline_dir)
+    main.set_wait_engine(args.wait_engine)
+    timer = PhaseTimer()
+    with storefront_from_args(args) as storefront:
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Pipeline iteration {iteration + 1}/{args.iterations}")
+            run_pipeline(args, storefront, timer)
+        stats = storefront.stats()
+    instrumentation.write_timeline()
+    report = timer.report(f"Pipeline against mock storefront ({args.wait_engine} waits)")
+    report["storefront"] = stats
+    return report
+
+
+WAIT_SPANS = ("wait_and_click", "wait_until_visible", "wait_until_invisible", "wait_and_switch_iframe")
+
+
+@scenario("waits", "pipeline with polling waits vs event-driven waits, per wait step")
+def bench_waits(args):
+    instrumentation.enable(args.timeline_dir or tempfile.mkdtemp(prefix="snkrs-waits-"))
+    steps = OrderedDict()
+    with storefront_from_args(args) as storefront:
+        for engine in main.WAIT_ENGINES:
+            main.set_wait_engine(engine)
+            timer = PhaseTimer()
+            for iteration in range(args.iterations):
+                LOGGER.info(f"Waits iteration {iteration + 1}/{args.iterations} ({engine})")
+                run_pipeline(args, storefront, timer)
+            timer.report(f"Pipeline with {engine} waits")
+            for item in instrumentation.drain():
+                if item["name"] in WAIT_SPANS:
+                    step = f"{item['name']} {item['args'].get('xpath', '')}"
+                    durations = steps.setdefault(step, {}).setdefault(engine, [])
+                    durations.append((item["end_ns"] - item["start_ns"]) / 1e9)
+
+    print()
+    print(f"{'step':<90}{'polling p50':>13}{'event p50':>11}{'saved (ms)':>12}")
+    report = OrderedDict()
+    for step, by_engine in steps.items():
+        polling = percentile(by_engine.get("polling", []), 50)
+        event = percentile(by_engine.get("event", []), 50)
+        report[step] = {"polling_p50": polling, "event_p50": event, "saved": polling - event}
+        print(f"{step[:89]:<90}{polling:>13.3f}{event:>11.3f}{(polling - event) * 1000:>12.1f}")
+    return {"steps": report}
+
+
+@scenario("transitions", "readiness conditions vs the fixed sleeps they replaced")
+def bench_transitions(args):
+    instrumentation.enable(args.timeline_dir or tempfile.mkdtemp(prefix="snkrs-transitions-"))
+    main.set_wait_engine(args.wait_engine)
+    timer = PhaseTimer()
+    with storefront_from_args(args) as storefront:
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Transitions iteration {iteration + 1}/{args.iterations}")
+            run_pipeline(args, storefront, timer)
+    timer.report(f"Pipeline with readiness conditions ({args.wait_engine} waits)")
+
+    durations = OrderedDict()
+    replaced = {}
+    for item in instrumentation.drain():
+        if item["name"] == "transition":
+            condition = item["args"]["condition"]
+            durations.setdefault(condition, []).append((item["end_ns"] - item["start_ns"]) / 1e9)
+            replaced[condition] = item["args"].get("replaced_sleep", 0)
+
+    print()
+    print(f"{'condition':<24}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}{'replaced sleep (s)':>20}")
+    report = OrderedDict()
+    for condition, samples in durations.items():
+        report[condition] = dict(summarize({condition: samples})[condition])
+        report[condition]["replaced_sleep"] = replaced[condition]
+        stats = report[condition]
+        print(
+            f"{condition:<24}{stats['n']:>5}{stats['p50']:>10.3f}{stats['p95']:>10.3f}"
+            f"{replaced[condition]:>20.1f}"
+        )
+    return {"conditions": report}
+
+
+@scenario("pool", "time from release to carted: cold driver per size vs pre-warmed driver pool")
+def bench_pool(args):
+    timer = PhaseTimer()
+    with storefront_from_args(args) as storefront:
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Pool iteration {iteration + 1}/{args.iterations}")
+            with timer.phase("cold: start + login + cart"):
+                driver = new_driver(args)
+                try:
+                    login_bench_driver(args, storefront, driver)
+                    add_bench_size_to_cart(args, storefront, driver)
+                finally:
+                    driver.quit()
+
+            def warm_up(driver):
+                login_bench_driver(args, storefront, driver)
+                driver.get(storefront.product_url)
+
+            with DriverPool(
+                lambda: new_driver(args), size=1, health_check_interval=0, warm_up=warm_up
+            ) as driver_pool:
+                # Wait for the pool to be ready before the simulated release
+                driver_pool.release(driver_pool.acquire())
+                with timer.phase("pooled: acquire + cart"):
+                    driver = driver_pool.acquire()
+                    try:
+                        add_bench_size_to_cart(args, storefront, driver)
+                    finally:
+                        driver_pool.release(driver)
+    return timer.report("Release to carted, cold vs pooled drivers")
+
+
+@scenario("session", "worker time-to-ready: full login vs injected shared session")
+def bench_session(args):
+    timer = PhaseTimer()
+    with storefront_from_args(args) as storefront:
+        main_driver = new_driver(args)
+        try:
+            login_bench_driver(args, storefront, main_driver)
+            session = browser_session.export_session(main_driver)
+            for iteration in range(args.iterations):
+                LOGGER.info(f"Session iteration {iteration + 1}/{args.iterations}")
+                for mode, shared in (("full login", None), ("shared session", session)):
+                    driver = new_driver(args)
+                    try:
+                        with timer.phase(mode):
+                            main.login_or_restore(
+                                driver,
+                                shared,
+                                None,
+                                args.num_retries,
+                                BENCH_USERNAME,
+                                BENCH_PASSWORD,
+                                args.page_load_timeout,
+                                home_url=storefront.login_url,
+                            )
+                    finally:
+                        driver.quit()
+        finally:
+            main_driver.quit()
+    return timer.report("Worker time-to-ready")
+
+
+@scenario("release", "armed release firing skew and release-to-carted time, simulated release")
+def bench_release(args):
+    timer = PhaseTimer()
+    skews = []
+    instrumentation.enable(args.timeline_dir or tempfile.mkdtemp(prefix="snkrs-release-"))
+    with storefront_from_args(args) as storefront:
+        driver = new_driver(args)
+        try:
+            login_bench_driver(args, storefront, driver)
+            for iteration in range(args.iterations):
+                LOGGER.info(f"Release iteration {iteration + 1}/{args.iterations}")
+                storefront.reset()
+                storefront.release_at = time.time() + args.arm_lead_time + 3
+                main.add_to_cart(
+                    driver,
+                    storefront.product_url,
+                    storefront.release_at,
+                    args.num_retries,
+                    args.shoe_gender,
+                    args.shoe_size,
+                    args.page_load_timeout,
+                    arm_lead_time=args.arm_lead_time,
+                )
+                carted_at = time.time()
+                timer.samples.setdefault("release to carted", []).append(
+                    carted_at - storefront.release_at
+                )
+                for item in instrumentation.drain():
+                    if item["name"] == "release_fire":
+                        skews.append(item["args"]["skew_ms"] / 1000)
+        finally:
+            driver.quit()
+    timer.samples["firing skew"] = skews
+    return timer.report("Simulated release against mock storefront")
+
+
+@scenario("http-cart", "HTTP cart request latency with and without connection reuse")
+def bench_http_cart(args):
+    timer = PhaseTimer()
+    connections = {}
+    requests_per_mode = args.iterations * 10
+    with storefront_from_args(args) as storefront:
+        storefront.reset()
+        with CartClient(storefront.cart_api_url) as cart_client:
+            for _ in range(requests_per_mode):
+                with timer.phase("pooled session (keep-alive)"):
+                    cart_client.add_item("bench-product", "bench-sku", args.shoe_size)
+        connections["pooled session (keep-alive)"] = storefront.stats()["connections"]
+
+        storefront.reset()
+        for _ in range(requests_per_mode):
+            with timer.phase("new connection per request"):
+                response = requests.get(
+                    storefront.cart_api_url,
+                    params=CartClient.item_params("bench-product", "bench-sku", args.shoe_size),
+                    headers=CART_HEADERS,
+                )
+                response.raise_for_status()
+        connections["new connection per request"] = storefront.stats()["connections"]
+    report = timer.report("Cart API requests against mock storefront (plain HTTP, no TLS)")
+    print()
+    for mode, count in connections.items():
+        print(f"{mode}: {count} TCP connections for {requests_per_mode} requests")
+    report["connections"] = connections
+    return report
+
+
+@scenario("resources", "bytes transferred and time-to-interactive, resource policy off vs on")
+def bench_resources(args):
+    timer = PhaseTimer()
+    transferred = OrderedDict()
+    with storefront_from_args(args) as storefront:
+        policy = resource_blocking.resolve(
+            {"blocked_hosts": [urlparse(storefront.tracker_url).hostname]}
+        )
+        size_xpath = main.get_size_xpath(args.shoe_gender, args.shoe_size)
+        checkout_xpath = "//button[@data-automation='member-checkout-button']"
+        pages = (
+            ("launch page", storefront.product_url, size_xpath),
+            ("cart page", storefront.cart_url, checkout_xpath),
+        )
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Resources iteration {iteration + 1}/{args.iterations}")
+            for mode, mode_policy in (("policy off", None), ("policy on", policy)):
+                # A fresh browser per mode, so both start with a cold cache
+                driver = new_driver(args, mode_policy)
+                try:
+                    login_bench_driver(args, storefront, driver)
+                    for page, page_url, ready_xpath in pages:
+                        storefront.reset()
+                        with timer.phase(f"{page}, {mode}"):
+                            try:
+                                driver.get(page_url)
+                            except main.TimeoutException:
+                                LOGGER.info("Page load timed out but continuing anyway")
+                            main.wait_until_clickable(
+                                driver, args.page_load_timeout, xpath=ready_xpath
+                            )
+                        transferred.setdefault(f"{page}, {mode}", []).append(
+                            storefront.stats()["bytes_sent"]
+                        )
+                finally:
+                    driver.quit()
+    report = timer.report("Time-to-interactive against mock storefront")
+    print()
+    for phase, sizes in transferred.items():
+        print(f"{phase}: p50 {percentile(sizes, 50) / 1024:.0f} KiB transferred")
+    report["bytes_sent"] = transferred
+    return report
+
+
+@scenario("profile", "time-to-ready from an empty profile vs the warm cached profile")
+def bench_profile(args):
+    timer = PhaseTimer()
+    transferred = OrderedDict()
+    profiles_dir = tempfile.mkdtemp(prefix="snkrs-profiles-")
+    with storefront_from_args(args) as storefront:
+        size_xpath = main.get_size_xpath(args.shoe_gender, args.shoe_size)
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Profile iteration {iteration + 1}/{args.iterations}")
+            # The cold run fills the profile that the warm run starts from
+            for mode in ("cold start", "warm start"):
+                profile_cache = ProfileCache(profiles_dir, BENCH_USERNAME, args.driver_type)
+                if mode == "cold start":
+                    profile_cache.invalidate()
+                profile_cache.prepare()
+                storefront.reset()
+                driver = None
+                try:
+                    with timer.phase(mode):
+                        driver = new_driver(args, profile_dir=profile_cache.path)
+                        if mode == "cold start" or not main.signed_in(
+                            driver, home_url=storefront.login_url
+                        ):
+                            login_bench_driver(args, storefront, driver)
+                        driver.get(storefront.product_url)
+                        main.wait_until_clickable(driver, args.page_load_timeout, xpath=size_xpath)
+                finally:
+                    if driver is not None:
+                        driver.quit()
+                transferred.setdefault(mode, []).append(storefront.stats()["bytes_sent"])
+    report = timer.report("Time-to-ready (driver start + login + launch page interactive)")
+    print()
+    for mode, sizes in transferred.items():
+        print(f"{mode}: p50 {percentile(sizes, 50) / 1024:.0f} KiB transferred")
+    report["bytes_sent"] = transferred
+    return report
+
+
+@scenario("locators", "WebDriver commands and time per phase, xpath vs compiled locators")
+def bench_locators(args):
+    main.set_wait_engine(args.wait_engine)
+    timer = PhaseTimer()
+    commands = OrderedDict()
+    with storefront_from_args(args) as storefront:
+        for locator_engine in main.LOCATOR_ENGINES:
+            main.set_locator_engine(locator_engine)
+            driver = new_driver(args)
+            counter = instrumentation.CommandCounter(driver)
+            try:
+                login_bench_driver(args, storefront, driver)
+                for iteration in range(args.iterations):
+                    LOGGER.info(
+                        f"Locators iteration {iteration + 1}/{args.iterations} ({locator_engine})"
+                    )
+                    storefront.reset()
+                    for phase, run_phase in (
+                        ("add_to_cart", lambda: add_bench_size_to_cart(args, storefront, driver)),
+                        (
+                            "checkout_cart",
+                            lambda: main.checkout_cart(
+                                driver,
+                                args.num_retries,
+                                BENCH_CVV,
+                                True,
+                                args.page_load_timeout,
+                                cart_url=storefront.cart_url,
+                                clear_cookies=False,
+                            ),
+                        ),
+                    ):
+                        name = f"{phase} ({locator_engine})"
+                        before = counter.total()
+                        with timer.phase(name):
+                            run_phase()
+                        commands.setdefault(name, []).append(counter.total() - before)
+            finally:
+                counter.detach()
+                driver.quit()
+    main.set_locator_engine(args.locator_engine)
+    report = timer.report(f"Locator engines against mock storefront ({args.wait_engine} waits)")
+    print()
+    for name, counts in commands.items():
+        print(f"{name}: p50 {percentile(counts, 50):.0f} WebDriver commands")
+    report["commands"] = commands
+    return report
+
+
+def bench_plan(args, storefront, sizes):
+    return compile_plan(
+        {
+            "driver_type": args.driver_type,
+            "webdriver_path": args.webdriver_path,
+            "username": BENCH_USERNAME,
+            "password": BENCH_PASSWORD,
+            "url": storefront.product_url,
+            "cvv": BENCH_CVV,
+            "shoe_list": [{"gender": args.shoe_gender, "size": size} for size in sizes],
+            "num_retries": args.num_retries,
+            "page_load_timeout": args.page_load_timeout,
+            "headless": not args.headful,
+            "home_url": storefront.login_url,
+            "cart_url": storefront.cart_url,
+            "wait_engine": args.wait_engine,
+            "locator_engine": args.locator_engine,
+        }
+    )
+
+
+def import_times(module):
+    # Run in a scratch directory, so importing main does not write purchase.log here
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=tempfile.mkdtemp(prefix="snkrs-importtime-"),
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = OrderedDict()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+@scenario("startup", "import time of main.py and worker start: on-demand vs pre-spawned pool")
+def bench_startup(args):
+    timer = PhaseTimer()
+    for iteration in range(args.iterations):
+        times = import_times("main")
+        timer.samples.setdefault("import main", []).append(times["main"] / 1000)
+    heaviest = sorted(times.items(), key=lambda item: item[1], reverse=True)[1:16]
+
+    sizes = args.sizes.split(",")
+    with storefront_from_args(args) as storefront:
+        plan = bench_plan(args, storefront, sizes)
+        tasks = [()] * len(sizes)
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Startup iteration {iteration + 1}/{args.iterations}")
+            for start_method in mp.get_all_start_methods():
+                plan.mp_start_method = start_method
+                # On demand: the pool is created at release, as the workers are needed
+                with timer.phase(f"{start_method}: on demand"):
+                    worker_pool = main.start_worker_pool(plan)
+                    worker_pool.starmap(os.getpid, tasks)
+                worker_pool.terminate()
+
+                worker_pool = main.start_worker_pool(plan)
+                time.sleep(args.prespawn_wait)  # the login phase
+                with timer.phase(f"{start_method}: pre-spawned"):
+                    worker_pool.starmap(os.getpid, tasks)
+                worker_pool.terminate()
+
+    report = timer.report(f"Startup, {len(sizes)} workers, time to first result from every task")
+    print()
+    print("Slowest imports under main (cumulative ms, last run):")
+    for name, milliseconds in heaviest:
+        print(f"{milliseconds:>10.1f}  {name}")
+    report["imports"] = OrderedDict(heaviest)
+    import_ms = report["phases"]["import main"]["p50"] * 1000
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        print(f"\nREGRESSION: import main took {import_ms:.0f} ms (limit {args.max_import_ms} ms)")
+        report["regression"] = True
+    return report
+
+
+def install_bench_logging(mode, log_file, log_queue):
+    if mode == "queue":
+        queue_logging.install(log_queue)
+        queue_logging.set_worker(mp.current_process().name)
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(queue_logging.TEXT_FORMAT))
+    root.addHandler(handler)
+
+
+def timed_log_calls(calls):
+    queue_logging.set_context(size="M 9", phase="add_to_cart")
+    durations = []
+    for i in range(calls):
+        start = time.perf_counter()
+        LOGGER.info(f"Log call {i} of {calls}")
+        durations.append((time.perf_counter() - start) * 1e6)
+    return durations
+
+
+@scenario("logging", "log call overhead in N workers: direct file handler vs queue and writer")
+def bench_logging(args):
+    samples = OrderedDict()
+    context = mp.get_context(MP_START_METHOD)
+    log_dir = tempfile.mkdtemp(prefix="snkrs-logging-")
+    for workers in map(int, args.log_workers.split(",")):
+        for mode in ("direct", "queue"):
+            name = f"{mode}, {workers} workers"
+            LOGGER.info(f"Logging: {name}")
+            log_file = os.path.join(log_dir, f"{mode}-{workers}.log")
+            log_writer = None
+            if mode == "queue":
+                log_writer = queue_logging.LogWriter(context, log_file, console=False)
+                log_writer.start(install_here=False)
+            log_queue = log_writer.queue if log_writer else None
+            with context.Pool(
+                workers, initializer=install_bench_logging, initargs=(mode, log_file, log_queue)
+            ) as pool:
+                for iteration in range(args.iterations):
+                    results = pool.map(timed_log_calls, [args.log_calls] * workers)
+                    samples.setdefault(name, []).extend(sum(results, []))
+                pool.close()
+                pool.join()
+            if log_writer is not None:
+                # Includes the records still queued when the workers finished
+                start = time.perf_counter()
+                log_writer.stop(timeout=60)
+                LOGGER.info(f"Writer drained in {time.perf_counter() - start:.3f}s")
+
+    summary = summarize(samples)
+    print_report(f"Logging, {args.log_calls} calls per worker, time per call", summary, unit="us")
+    return {"phases": summary, "unit": "us"}
+
+
+@scenario("early-stop", "time to checkout: wait for every cart worker vs stop at the cart target")
+def bench_early_stop(args):
+    timer = PhaseTimer()
+    sizes = args.sizes.split(",")
+    with storefront_from_args(args) as storefront:
+        plan = bench_plan(args, storefront, sizes)
+        # A target of every size is the previous behaviour: checkout waits for the slowest worker
+        modes = OrderedDict(
+            [
+                (f"barrier: all {len(sizes)}", len(sizes)),
+                (f"early stop: {args.cart_target} of {len(sizes)}", args.cart_target),
+            ]
+        )
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Early stop iteration {iteration + 1}/{args.iterations}")
+            for mode, cart_target in modes.items():
+                storefront.reset()
+                stop_event = main.mp_context(plan).Event()
+                worker_pool = main.start_worker_pool(plan, stop_event=stop_event)
+                try:
+                    with timer.phase(mode):
+                        main.run_worker_pool_add_to_cart(
+                            worker_pool,
+                            [(plan, target, None) for target in plan.targets],
+                            cart_target,
+                            stop_event,
+                        )
+                    worker_pool.close()
+                    worker_pool.join()
+                finally:
+                    worker_pool.terminate()
+    return timer.report(
+        "Cart phase until checkout can start, every worker starts a driver and logs in"
+    )
+
+
+CHECKOUT_FAILURES = ("checkout_page", "checkout_spinner", "shipping_submit", "billing_submit")
+
+
+@scenario("checkout", "checkout time with one failure injected at each step: resume vs restart")
+def bench_checkout(args):
+    main.set_wait_engine(args.wait_engine)
+    timer = PhaseTimer()
+    with storefront_from_args(args) as storefront:
+        driver = new_driver(args)
+        try:
+            login_bench_driver(args, storefront, driver)
+            add_bench_size_to_cart(args, storefront, driver)
+            for iteration in range(args.iterations):
+                LOGGER.info(f"Checkout iteration {iteration + 1}/{args.iterations}")
+                for failure in (None,) + CHECKOUT_FAILURES:
+                    for resume in (True, False):
+                        if failure is not None:
+                            storefront.inject_failure(failure)
+                        mode = "resume" if resume else "restart"
+                        try:
+                            with timer.phase(f"{failure or 'no failure'}: {mode}"):
+                                main.checkout_cart(
+                                    driver,
+                                    args.num_retries,
+                                    BENCH_CVV,
+                                    True,
+                                    args.page_load_timeout,
+                                    cart_url=storefront.cart_url,
+                                    clear_cookies=False,
+                                    resume=resume,
+                                )
+                        except Exception as e:
+                            LOGGER.warning(f"Checkout failed with {failure}: " + str(e))
+        finally:
+            driver.quit()
+    return timer.report(
+        f"Checkout with one injected failure, {args.page_load_timeout}s step timeout; "
+        "recovery time is the difference to no failure"
+    )
+
+
+@scenario("metrics", "cart workers and checkout against the mock storefront, scraping /metrics")
+def bench_metrics(args):
+    timer = PhaseTimer()
+    sizes = args.sizes.split(",")
+    with storefront_from_args(args) as storefront:
+        plan = bench_plan(args, storefront, sizes)
+        metrics_server = metrics.MetricsServer(main.mp_context(plan), port=args.metrics_port).start()
+        try:
+            for iteration in range(args.iterations):
+                LOGGER.info(f"Metrics iteration {iteration + 1}/{args.iterations}")
+                storefront.reset()
+                stop_event = main.mp_context(plan).Event()
+                worker_pool = main.start_worker_pool(
+                    plan, stop_event=stop_event, metrics_queue=metrics_server.queue
+                )
+                try:
+                    with timer.phase("cart workers"):
+                        main.run_worker_pool_add_to_cart(
+                            worker_pool,
+                            [(plan, target, None) for target in plan.targets],
+                            len(sizes),
+                            stop_event,
+                        )
+                    worker_pool.close()
+                    worker_pool.join()
+                finally:
+                    worker_pool.terminate()
+                driver = new_driver(args)
+                try:
+                    login_bench_driver(args, storefront, driver)
+                    with timer.phase("checkout"):
+                        main.checkout_cart(
+                            driver,
+                            args.num_retries,
+                            BENCH_CVV,
+                            True,
+                            args.page_load_timeout,
+                            cart_url=storefront.cart_url,
+                        )
+                finally:
+                    driver.quit()
+                with timer.phase("scrape"):
+                    scraped = requests.get(metrics_server.url, timeout=5).text
+        finally:
+            metrics_server.stop()
+
+    report = timer.report("Cart and checkout with the metrics endpoint on")
+    samples = [line for line in scraped.splitlines() if line and not line.startswith("#")]
+    print()
+    for line in samples:
+        if "_bucket{" not in line:
+            print(line)
+    missing = [
+        name
+        for name in ("driver_starts_total", "phase_seconds", "webdriver_commands_total")
+        + ("carted_sizes_total", "checkout_step_seconds", "processes")
+        if not any(line.startswith(metrics.PREFIX + name) for line in samples)
+    ]
+    if missing:
+        print("\nMISSING: " + ", ".join(missing))
+        report["regression"] = True
+    report["metrics"] = samples
+    return report
+
+
+MICRO_URL = fake_driver.BASE_URL + "/helpers"
+MICRO_FAILING_URL = fake_driver.BASE_URL + "/failing"
+MICRO_BUTTON = Locator("button", "button#target", "//button[@id='target']")
+MICRO_FLAKY = Locator("flaky", "button#flaky", "//button[@id='flaky']")
+MICRO_OVERLAY = "//div[@id='overlay']"
+MICRO_FRAME = "//iframe[@id='frame']"
+MICRO_FIELD = "//input[@id='field']"
+
+
+def micro_pages(args):
+    delays = {name: args.micro_delay for name in fake_driver.STOREFRONT_DELAYS}
+    pages = fake_driver.storefront_pages(
+        fake_driver.BASE_URL, args.shoe_gender, args.shoe_size, delays
+    )
+    pages.update(
+        fake_driver.storefront_pages(
+            MICRO_FAILING_URL,
+            args.shoe_gender,
+            args.shoe_size,
+            delays,
+            click_failures={"add_to_bag": 1, "billing_submit": 1},
+        )
+    )
+    pages[MICRO_URL] = [
+        FakeElement("button", MICRO_BUTTON.xpath, locator=MICRO_BUTTON, appear=args.micro_delay),
+        FakeElement(
+            "flaky",
+            MICRO_FLAKY.xpath,
+            locator=MICRO_FLAKY,
+            appear=args.micro_delay,
+            click_failures=1,
+        ),
+        FakeElement("overlay", MICRO_OVERLAY, hide=args.micro_delay),
+        FakeElement("frame", MICRO_FRAME, appear=args.micro_delay),
+        FakeElement("field", MICRO_FIELD),
+    ]
+    return pages
+
+
+def micro_cases(args):
+    timeout = args.page_load_timeout
+
+    def add_to_cart(driver):
+        main.add_to_cart_attempt(driver, args.shoe_gender, args.shoe_size, timeout)
+
+    def checkout(base_url):
+        return lambda driver: main.checkout_cart_attempt(
+            driver, args.num_retries, BENCH_CVV, True, timeout, cart_url=base_url + "/cart"
+        )
+
+    # name: (page loaded before the call, the call, whether the locator engine matters)
+    return OrderedDict(
+        [
+            (
+                "wait_and_click",
+                (MICRO_URL, lambda d: main.wait_and_click(d, timeout, locator=MICRO_BUTTON), True),
+            ),
+            (
+                "wait_and_click, 1 click failure",
+                (MICRO_URL, lambda d: main.wait_and_click(d, timeout, locator=MICRO_FLAKY), True),
+            ),
+            (
+                "wait_until_visible",
+                (
+                    MICRO_URL,
+                    lambda d: main.wait_until_visible(d, timeout, xpath=MICRO_BUTTON.xpath),
+                    False,
+                ),
+            ),
+            (
+                "wait_until_invisible",
+                (
+                    MICRO_URL,
+                    lambda d: main.wait_until_invisible(d, timeout, xpath=MICRO_OVERLAY),
+                    False,
+                ),
+            ),
+            (
+                "wait_and_switch_iframe",
+                (
+                    MICRO_URL,
+                    lambda d: main.wait_and_switch_iframe(d, timeout, xpath=MICRO_FRAME),
+                    False,
+                ),
+            ),
+            (
+                "random_type",
+                (
+                    MICRO_URL,
+                    lambda d: main.random_type(
+                        d.find_element_by_xpath(MICRO_FIELD), BENCH_PASSWORD, 0, 1
+                    ),
+                    False,
+                ),
+            ),
+            ("add_to_cart_attempt", (fake_driver.BASE_URL + PRODUCT_PATH, add_to_cart, True)),
+            (
+                "add_to_cart_attempt, 1 click failure",
+                (MICRO_FAILING_URL + PRODUCT_PATH, add_to_cart, True),
+            ),
+            ("checkout_cart_attempt", (None, checkout(fake_driver.BASE_URL), True)),
+            ("checkout_cart_attempt, 1 click failure", (None, checkout(MICRO_FAILING_URL), True)),
+        ]
+    )
+
+
+def micro_regressions(report, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, stats in report["phases"].items():
+        before = baseline.get("phases", {}).get(name)
+        if before is None:
+            continue
+        # The absolute slack keeps sub-millisecond helpers from failing on scheduler noise
+        if stats["p50"] > before["p50"] * (1 + tolerance) + 5:
+            regressions.append(f"{name}: p50 {before['p50']:.1f} -> {stats['p50']:.1f} ms")
+        commands = percentile(report["commands"][name], 50)
+        commands_before = percentile(baseline.get("commands", {}).get(name, []), 50)
+        if commands > commands_before:
+            regressions.append(f"{name}: {commands_before:.0f} -> {commands:.0f} commands")
+    return regressions
+
+
+@scenario("micro", "wait, click and cart helpers against an in-memory fake driver, no browser")
+def bench_micro(args):
+    pages = micro_pages(args)
+    cases = micro_cases(args)
+    samples = OrderedDict()
+    commands = OrderedDict()
+    for wait_engine in main.WAIT_ENGINES:
+        main.set_wait_engine(wait_engine)
+        for locator_engine in main.LOCATOR_ENGINES:
+            main.set_locator_engine(locator_engine)
+            driver = FakeDriver(pages, command_latency=args.command_latency_ms / 1000)
+            counter = instrumentation.CommandCounter(driver)
+            for case, (url, run_case, uses_locators) in cases.items():
+                if not uses_locators and locator_engine != main.LOCATOR_ENGINES[0]:
+                    continue
+                name = f"{case} ({wait_engine}" + (f", {locator_engine})" if uses_locators else ")")
+                for iteration in range(args.iterations):
+                    if url is not None:
+                        driver.get(url)
+                    # The typing delays are random: the same ones every run
+                    random.seed(iteration)
+                    before = counter.total()
+                    start = time.perf_counter()
+                    run_case(driver)
+                    samples.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+                    commands.setdefault(name, []).append(counter.total() - before)
+            counter.detach()
+    main.set_wait_engine(args.wait_engine)
+    main.set_locator_engine(args.locator_engine)
+
+    summary = summarize(samples)
+    print_report(
+        f"Helpers against the fake driver, elements appear after {args.micro_delay}s, "
+        f"{args.command_latency_ms} ms per command",
+        summary,
+        unit="ms",
+    )
+    print()
+    for name, counts in commands.items():
+        print(f"{name}: p50 {percentile(counts, 50):.0f} WebDriver commands")
+    report = {"phases": summary, "unit": "ms", "commands": commands}
+    if args.baseline:
+        regressions = micro_regressions(report, args.baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        report["regression"] = bool(regressions)
+    return report
+
+
+DIAGNOSED_ATTEMPTS = 5
+
+
+@scenario("diagnostics", "time a failed attempt adds when capturing diagnostics, fake driver")
+def bench_diagnostics(args):
+    directory = tempfile.mkdtemp(prefix="snkrs-diagnostics-")
+    command_latency = args.command_latency_ms / 1000
+    modes = OrderedDict(
+        [
+            ("off", None),
+            (f"on, {args.command_latency_ms} ms per command", {}),
+            (
+                f"on, {args.screenshot_ms} ms screenshot",
+                {Command.SCREENSHOT: args.screenshot_ms / 1000},
+            ),
+        ]
+    )
+    # No backoff, so the whole capture shows up as added time
+    retry_policy = retry.RetryPolicy("diagnosed", DIAGNOSED_ATTEMPTS, backoff=0)
+    samples = OrderedDict()
+    regressions = []
+    for mode, latencies in modes.items():
+        LOGGER.info(f"Diagnostics: {mode}")
+        driver = FakeDriver(micro_pages(args), command_latency, latencies)
+        driver.get(MICRO_URL)
+        if latencies is not None:
+            diagnostics.configure(directory, budget=args.diagnostics_budget)
+        for iteration in range(args.iterations):
+            failures = []
+
+            def attempt(action):
+                if len(failures) < DIAGNOSED_ATTEMPTS - 1:
+                    failures.append(action)
+                    raise ElementClickInterceptedException("covered")
+
+            start = time.perf_counter()
+            retry.run(retry_policy, attempt, on_failure=diagnostics.hook(driver, "diagnosed"))
+            per_failure = (time.perf_counter() - start) * 1000 / len(failures)
+            samples.setdefault(mode, []).append(per_failure)
+        diagnostics.stop()
+        if latencies is not None:
+            # The retry never waits for the reads longer than the budget
+            allowed = args.diagnostics_budget * 1000 + 5
+            p95 = percentile(samples[mode], 95)
+            if p95 > allowed:
+                regressions.append(f"{mode}: p95 {p95:.1f} ms per failure (limit {allowed:.0f} ms)")
+
+    summary = summarize(samples)
+    print_report(
+        f"Time per failed attempt, {args.diagnostics_budget}s capture budget", summary, unit="ms"
+    )
+    captures = len(glob.glob(os.path.join(directory, "*.json")))
+    print(f"\n{captures} captures kept in {directory}")
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    return {"phases": summary, "unit": "ms", "regression": bool(regressions)}
+
+
+@scenario("engines", "multi-size cart phase: mp.Pool workers vs asyncio vs tabs, CPU and RSS")
+def bench_engines(args):
+    timer = PhaseTimer()
+    usage = OrderedDict()
+    sizes = args.sizes.split(",")
+    with storefront_from_args(args) as storefront:
+        plan = bench_plan(args, storefront, sizes)
+        for iteration in range(args.iterations):
+            LOGGER.info(f"Engines iteration {iteration + 1}/{args.iterations}")
+            storefront.reset()
+            mode = f"process: mp.Pool x{len(sizes)}"
+            with resource_usage.UsageSampler() as sampler, timer.phase(mode):
+                with mp.Pool(len(sizes)) as pool:
+                    pool.starmap(main.run_add_to_cart, [(plan, target) for target in plan.targets])
+            usage.setdefault(mode, []).append(sampler.report())
+
+            storefront.reset()
+            mode = f"asyncio: target {args.cart_target} of {len(sizes)}"
+            with resource_usage.UsageSampler() as sampler, timer.phase(mode):
+                with DriverPool(
+                    lambda: new_driver(args),
+                    size=len(sizes),
+                    health_check_interval=0,
+                    warm_up=lambda driver: login_bench_driver(args, storefront, driver),
+                ) as driver_pool:
+                    attempts = [
+                        (
+                            target.label,
+                            functools.partial(
+                                main.run_pooled_add_to_cart,
+                                driver_pool,
+                                plan.url,
+                                None,
+                                plan.num_retries,
+                                target.gender,
+                                target.size,
+                                plan.page_load_timeout,
+                            ),
+                        )
+                        for target in plan.targets
+                    ]
+                    succeeded, _ = async_engine.run(attempts, args.cart_target)
+                    if not succeeded:
+                        raise Exception("No size was added to cart.")
+            usage.setdefault(mode, []).append(sampler.report())
+
+            storefront.reset()
+            mode = f"tabs: 1 browser x{len(sizes)} tabs"
+            with resource_usage.UsageSampler() as sampler, timer.phase(mode):
+                driver = new_driver(args)
+                try:
+                    login_bench_driver(args, storefront, driver)
+                    main.run_tabbed_add_to_cart(
+                        driver,
+                        storefront.product_url,
+                        None,
+                        args.num_retries,
+                        plan.targets,
+                        args.page_load_timeout,
+                    )
+                finally:
+                    driver.quit()
+            usage.setdefault(mode, []).append(sampler.report())
+    report = timer.report("Cart phase wall time, every engine includes driver start and login")
+    print()
+    for mode, reports in usage.items():
+        print(
+            f"{mode}: p50 {percentile([r['cpu_seconds'] for r in reports], 50):.2f}s CPU, "
+            "max peak "
+            + resource_usage.format_bytes(max((r['peak_rss'] or 0) for r in reports) or None)
+            + f" RSS, max {max((r['peak_processes'] or 0) for r in reports)} processes"
+        )
+    report["usage"] = usage
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark main.py against the mock storefront.",
+        epilog="scenarios: " + "; ".join(f"{name}: {text}" for name, (_, text) in SCENARIOS.items()),
+    )
+    parser.add_argument("scenario", choices=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--driver-type", default="chrome", choices=("firefox", "chrome"))
+    parser.add_argument("--webdriver-path", default=None)
+    parser.add_argument("--headful", action="store_true", help="Show the browser windows")
+    parser.add_argument("--page-load-timeout", type=int, default=5)
+    parser.add_argument("--num-retries", type=int, default=3)
+    parser.add_argument("--shoe-gender", default="M")
+    parser.add_argument("--shoe-size", default="9")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the report here")
+    parser.add_argument("--timeline-dir", default=None, help="Record a span timeline here")
+    parser.add_argument("--wait-engine", default="polling", choices=main.WAIT_ENGINES)
+    parser.add_argument("--locator-engine", default="xpath", choices=main.LOCATOR_ENGINES)
+    parser.add_argument("--arm-lead-time", type=float, default=2)
+    parser.add_argument("--sizes", default="8,9,10", help="Comma-separated sizes for engines")
+    parser.add_argument("--cart-target", type=int, default=1, help="Successes before cancelling")
+    parser.add_argument("--metrics-port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--log-workers", default="1,4,8", help="Worker counts, for logging")
+    parser.add_argument("--log-calls", type=int, default=2000, help="Log calls per worker")
+    parser.add_argument("--prespawn-wait", type=float, default=3, help="Login phase, for startup")
+    parser.add_argument("--micro-delay", type=float, default=0.05, help="Element delay, for micro")
+    parser.add_argument("--command-latency-ms", type=float, default=0, help="Fake command cost")
+    parser.add_argument("--baseline", default=None, help="micro fails when slower than this report")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed micro slowdown")
+    parser.add_argument("--diagnostics-budget", type=float, default=diagnostics.BUDGET)
+    parser.add_argument("--screenshot-ms", type=float, default=300, help="Slow screenshot")
+    parser.add_argument(
+        "--max-import-ms", type=float, default=None, help="startup fails above this import time"
+    )
+    add_storefront_arguments(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    main.set_locator_engine(args.locator_engine)
+    fn, _ = SCENARIOS[args.scenario]
+    report = fn(args)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if report.get("regression"):
+        sys.exit(1)
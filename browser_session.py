@@ -0,0 +1,105 @@
+# pylint: disable=W1201
+
+import logging
+import threading
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+import instrumentation
+
+"""
+
+Hand an authenticated browser session from one driver to another.
+
+`export_session` captures the cookies and web storage of a logged-in driver as a plain
+(picklable) dict, and `import_session` injects it into a fresh driver. Cookies can only
+be set for the origin the driver is on, so the import first opens a tiny page on the
+session's origin.
+
+"""
+
+LOGGER = logging.getLogger()
+
+READ_STORAGE_SCRIPT = """
+function dump(storage) {
+  var items = {};
+  for (var i = 0; i < storage.length; i++) {
+    var key = storage.key(i);
+    items[key] = storage.getItem(key);
+  }
+  return items;
+}
+return {local: dump(window.localStorage), session: dump(window.sessionStorage)};
+"""
+
+WRITE_STORAGE_SCRIPT = """
+var local = arguments[0], session = arguments[1];
+for (var key in local) window.localStorage.setItem(key, local[key]);
+for (var key in session) window.sessionStorage.setItem(key, session[key]);
+"""
+
+
+def origin(url):
+    parts = urlparse(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+@instrumentation.traced()
+def export_session(driver):
+    storage = driver.execute_script(READ_STORAGE_SCRIPT) or {}
+    session = {
+        "origin": origin(driver.current_url),
+        "cookies": driver.get_cookies(),
+        "local_storage": storage.get("local", {}),
+        "session_storage": storage.get("session", {}),
+    }
+    LOGGER.info(
+        f"Exported session with {len(session['cookies'])} cookies and "
+        f"{len(session['local_storage'])} local storage items"
+    )
+    return session
+
+
+def add_cookie(driver, cookie):
+    cookie = {key: value for key, value in cookie.items() if key != "sameSite"}
+    if "expiry" in cookie:
+        cookie["expiry"] = int(cookie["expiry"])
+    try:
+        driver.add_cookie(cookie)
+    except WebDriverException:
+        # Cookies for a parent domain are rejected by some drivers; scope it to this host
+        cookie.pop("domain", None)
+        driver.add_cookie(cookie)
+
+
+@instrumentation.traced()
+def import_session(driver, session):
+    try:
+        # Any response on the origin will do; robots.txt is small and never redirects to login
+        driver.get(session["origin"] + "/robots.txt")
+    except TimeoutException:
+        LOGGER.info("Page load timed out but continuing anyway")
+
+    for cookie in session["cookies"]:
+        try:
+            add_cookie(driver, cookie)
+        except WebDriverException as e:
+            LOGGER.warning(f"Could not inject cookie {cookie.get('name')}: " + str(e))
+    driver.execute_script(
+        WRITE_STORAGE_SCRIPT, session["local_storage"], session["session_storage"]
+    )
+
+
+class SessionHandoff:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.session = None
+
+    def publish(self, session):
+        self.session = session
+        self.ready.set()
+
+    def get(self, timeout=None):
+        self.ready.wait(timeout)
+        return self.session
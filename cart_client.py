@@ -0,0 +1,116 @@
+# pylint: disable=W1201
+
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import instrumentation
+
+"""
+
+HTTP add-to-cart client for the Nike cart API.
+
+One persistent requests.Session holds a pooled, keep-alive connection to the API host,
+so retries and additional sizes reuse the TCP/TLS connection instead of paying a new
+handshake each time. Headers and the constant query parameters are built once, the
+login cookies are copied from the driver once, and transient failures are retried by
+the adapter with exponential backoff.
+
+"""
+
+LOGGER = logging.getLogger()
+
+NIKE_CART_API_URL = "https://secure-store.nike.com/us/services/jcartService"
+
+CART_HEADERS = {
+    "user-agent": "Mozilla/5.0 (X11; Linux x86_64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.99 Safari/537.36",
+    "origin": "https://www.nike.com",
+    "accept-encoding": "gzip, deflate, br",
+    "accept-language": "en-US,en;q=0.9",
+    "accept": "*/*",
+    "scheme": "https",
+}
+
+CART_PARAMS = {
+    "action": "addItem",
+    "lang_locale": "en_US",
+    "catalogId": "1",
+    "qty": "1",
+    "price": "",
+    "rt": "json",
+    "view": "3",
+    "displaySize": "10",
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CartClient:
+    def __init__(
+        self,
+        api_url=NIKE_CART_API_URL,
+        pool_maxsize=10,
+        max_retries=3,
+        backoff_factor=0.1,
+        timeout=10,
+    ):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(CART_HEADERS)
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def sync_cookies(self, driver):
+        cookies = driver.get_cookies()
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+        LOGGER.info(f"Copied {len(cookies)} cookies from the driver to the cart client")
+
+    @staticmethod
+    def item_params(product_id, sku_id, size):
+        params = dict(CART_PARAMS)
+        params["productId"] = product_id
+        params["skuId"] = sku_id
+        params["skuAndSize"] = "{}:{}".format(sku_id, size)
+        return params
+
+    @instrumentation.traced(name="cart_client.add_item", arg_names=("sku_id", "size"))
+    def add_item(self, product_id, sku_id, size):
+        response = self.session.get(
+            self.api_url, params=self.item_params(product_id, sku_id, size), timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise Exception(
+                "Request to add item to cart failed (code {}): {}".format(
+                    response.status_code, response.text
+                )
+            )
+        return response
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
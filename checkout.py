@@ -0,0 +1,105 @@
+# pylint: disable=W1201
+
+import logging
+import time
+
+import diagnostics
+import instrumentation
+import metrics
+import retry
+
+"""
+
+Checkout as a state machine.
+
+Checkout is a fixed sequence of steps (cart page, member checkout, spinner, shipping,
+billing, payment, pay now), each a callable that leaves the page ready for the next.
+When a step fails, the retry does not start over from the cart: `DETECT_SCRIPT` looks
+at the page to find the step it is on, and the steps run again from there. If the
+same step fails again, the cart page is loaded again and checkout starts from the
+beginning. Every step is timed, logged and recorded as a "checkout_step" span.
+
+"""
+
+LOGGER = logging.getLogger()
+
+STEPS = ("cart", "member_checkout", "spinner", "shipping", "billing", "payment", "pay_now")
+
+# Which step the page is waiting on, from the top document; null when it cannot tell
+DETECT_SCRIPT = """
+function visible(el) {
+  if (!el || !el.isConnected) return false;
+  var style = window.getComputedStyle(el);
+  if (style.visibility === "hidden" || style.display === "none") return false;
+  return !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+}
+if (document.getElementById("paymentIFrameEvo")) return "payment";
+if (visible(document.getElementById("billingSubmit"))) return "billing";
+if (visible(document.getElementById("shippingSubmit"))) return "shipping";
+if (visible(document.querySelector(".loading-spiner-holder"))) return "spinner";
+if (document.querySelector("button[data-automation='member-checkout-button']")) {
+  return "member_checkout";
+}
+return null;
+"""
+
+
+def detect_step(driver):
+    try:
+        driver.switch_to.default_content()
+        return driver.execute_script(DETECT_SCRIPT)
+    except Exception as e:
+        LOGGER.warning("Could not detect the checkout step: " + str(e))
+        return None
+
+
+class CheckoutState:
+    def __init__(self, steps, resume=True):
+        self.steps = steps
+        self.names = [name for name, _ in steps]
+        self.resume = resume
+        self.next_step = self.names[0]
+        self.failed_step = None
+        self.repeated_failure = False
+        self.timings = []
+
+    def resume_step(self, driver):
+        if not self.resume or self.repeated_failure:
+            return self.names[0]
+        detected = detect_step(driver)
+        if detected not in self.names:
+            # In between two steps: the failed one may still complete
+            return self.failed_step
+        return detected
+
+    def run_from(self, driver, action):
+        if action is not None:
+            self.next_step = self.resume_step(driver)
+            LOGGER.info(f"Resuming checkout at: {self.next_step}")
+        for name, step in self.steps[self.names.index(self.next_step):]:
+            start = time.monotonic()
+            try:
+                with instrumentation.span("checkout_step", step=name):
+                    step()
+            except Exception:
+                self.repeated_failure = self.failed_step == name
+                self.failed_step = name
+                raise
+            seconds = time.monotonic() - start
+            self.timings.append((name, seconds))
+            LOGGER.info(f"Checkout step {name} took {seconds:.2f}s")
+            metrics.observe("checkout_step_seconds", seconds, step=name)
+            following = self.names.index(name) + 1
+            self.next_step = self.names[following] if following < len(self.names) else None
+            self.repeated_failure = False
+
+
+def run(driver, steps, retry_policy, resume=True, failure="Failed to checkout."):
+    state = CheckoutState(steps, resume)
+    retry.run(
+        retry_policy,
+        lambda action: state.run_from(driver, action),
+        failure=failure,
+        on_failure=diagnostics.hook(driver, "checkout"),
+    )
+    return state.timings
@@ -0,0 +1,80 @@
+"""
+
+Readiness checks that replace the fixed sleeps in main.py.
+
+Each check is a JavaScript function body for event_waits (it reads its parameters from
+`args` and returns a truthy value once the page is ready), so the same check runs
+either from a MutationObserver or from a polled execute_script call.
+
+"""
+
+HELPERS = """
+function find(xpath) {
+  return document.evaluate(
+    xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+  ).singleNodeValue;
+}
+function visible(el) {
+  if (!el || !el.isConnected) return false;
+  var style = window.getComputedStyle(el);
+  if (style.visibility === "hidden" || style.display === "none") return false;
+  return !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+}
+function bagCount() {
+  var el = document.querySelector(
+    ".bag-count, [data-qa*='bag-count'], [class*='bag-count'], [class*='BagCount']"
+  );
+  return el ? el.textContent.trim() : null;
+}
+"""
+
+# args: email input xpath, password input xpath
+LOGIN_FORM_READY = HELPERS + """
+var email = find(args[0]), password = find(args[1]);
+return document.readyState === "complete" && visible(email) && !email.disabled
+  && !!password && !password.disabled;
+"""
+
+# args: signed-in marker xpath, error dismiss button xpath
+LOGIN_OUTCOME = HELPERS + """
+if (visible(find(args[0]))) return "success";
+if (visible(find(args[1]))) return "error";
+return null;
+"""
+
+# args: error dismiss button xpath
+ERROR_DISMISSED = HELPERS + """
+return !visible(find(args[0]));
+"""
+
+# args: size button xpath
+SIZE_SELECTED = HELPERS + """
+var el = find(args[0]);
+if (!el) return false;
+function selected(node) {
+  if (!node || node.nodeType !== 1) return false;
+  var flags = ["aria-pressed", "aria-checked", "aria-selected"];
+  for (var i = 0; i < flags.length; i++) {
+    if (node.getAttribute(flags[i]) === "true") return true;
+  }
+  if (/(^|[\\s_-])(selected|active|checked)($|[\\s_-])/i.test(node.getAttribute("class") || "")) {
+    return true;
+  }
+  return !!(node.checked || (node.control && node.control.checked));
+}
+var previous = el.previousElementSibling;
+return selected(el) || selected(el.parentElement)
+  || !!(previous && previous.tagName === "INPUT" && previous.checked);
+"""
+
+# args: none
+BAG_COUNT = HELPERS + """
+return bagCount();
+"""
+
+# args: bag count before adding, confirmation close button xpath
+ADDED_TO_BAG = HELPERS + """
+var count = bagCount();
+if (count !== null && count !== args[0]) return true;
+return visible(find(args[1]));
+"""
@@ -0,0 +1,638 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import argparse
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import browser_session
+import diagnostics
+import instrumentation
+import main
+import profiling
+import queue_logging
+import recorder
+import resource_usage
+import retry
+from driver_pool import DriverPool
+from plan import compile_plan
+
+"""
+
+Long-running mode: one process runs every release of a calendar on a warm browser fleet.
+
+    python daemon.py releases/ --fleet-size 6 --max-driver-rss-mb 1500
+
+Every `*.json` in the directory is a release config, the same as for main.py; files
+added later are picked up too. A job starts `--lead` seconds before its release_time
+(or at its login_time, if that is earlier), and jobs run one at a time. A release whose
+release_time (plus release_deadline) has passed never runs: a config in the directory
+becomes a "missed" job, and POST /jobs rejects it.
+
+The fleet keeps, per account, a signed-in main browser and a pool of signed-in cart
+browsers between releases, so a release only pays for the login when the session has
+expired. At most `--fleet-size` browsers are open: a release on another account closes
+the least recently used account first. Every `--recycle-interval` seconds, idle browsers
+whose process tree has grown past `--max-driver-rss-mb` are replaced (needs psutil);
+with share_session, a recycled browser gets the account's session back without logging
+in.
+
+Sizes are carted on the pool's threads (`cart_engine` "process" runs like "threaded"),
+or in tabs or over HTTP on the main browser; profile_cache is not used. Each job logs
+its resource use, and the control API on http://127.0.0.1:8700 reports it:
+
+    GET    /jobs          every job, with its state and resource use
+    GET    /jobs/<name>
+    POST   /jobs          a config, or {"name": ..., "config": {...}}
+    DELETE /jobs/<name>   cancel; a running job stops before its next phase
+    GET    /fleet         the open browsers of each account and their memory
+
+"""
+
+LOGGER = logging.getLogger()
+
+LEAD_TIME = 300
+FLEET_SIZE = 4
+POLL_INTERVAL = 5
+RECYCLE_INTERVAL = 60
+CONTROL_PORT = 8700
+ACTIVE_STATES = ("scheduled", "running")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def format_time(when):
+    if when is None:
+        return None
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when))
+
+
+def missed(plan):
+    if not plan.release_time:
+        return False
+    return time.time() > plan.release_time + (plan.release_deadline or 0)
+
+
+def start_time(plan, lead=LEAD_TIME):
+    times = [plan.login_time, plan.release_time - lead if plan.release_time else None]
+    times = [when for when in times if when]
+    return min(times) if times else time.time()
+
+
+class Job:
+    def __init__(self, name, plan, start_at, source=None):
+        self.name = name
+        self.plan = plan
+        self.start_at = start_at
+        self.source = source
+        self.state = "scheduled"
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.usage = None
+        self.cancelled = threading.Event()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled(f"Job {self.name} was cancelled")
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "state": self.state,
+            "source": self.source,
+            "username": self.plan.username,
+            "url": self.plan.url,
+            "sizes": [target.label for target in self.plan.targets],
+            "start_at": format_time(self.start_at),
+            "login_time": format_time(self.plan.login_time),
+            "release_time": format_time(self.plan.release_time),
+            "started": format_time(self.started),
+            "finished": format_time(self.finished),
+            "error": self.error,
+            "usage": self.usage,
+        }
+
+
+class Account:
+    def __init__(self, key):
+        self.key = key
+        self.plan = None
+        self.main_driver = None
+        self.session = None
+        self.pool = None
+        self.last_used = 0
+
+    @property
+    def size(self):
+        return (self.main_driver is not None) + (self.pool.size if self.pool is not None else 0)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.main_driver is not None:
+            main.quit_driver(self.main_driver)
+            self.main_driver = None
+
+    def to_dict(self):
+        main_rss = None
+        if self.main_driver is not None:
+            main_rss = resource_usage.driver_rss(self.main_driver)
+        pooled = list(self.pool.drivers) if self.pool is not None else []
+        return {
+            "username": self.key[0],
+            "driver_type": self.key[1],
+            "main_driver": self.main_driver is not None,
+            "main_rss": main_rss,
+            "pool_size": self.pool.size if self.pool is not None else 0,
+            "pool_idle": self.pool.idle.qsize() if self.pool is not None else 0,
+            "pool_rss": [resource_usage.driver_rss(driver) for driver in pooled],
+            "shared_session": self.session is not None,
+            "last_used": format_time(self.last_used or None),
+        }
+
+
+class Fleet:
+    def __init__(self, size=FLEET_SIZE, max_driver_rss=None):
+        if size < 2:
+            raise Exception("The fleet needs at least 2 browsers: a main and a cart browser.")
+        self.size = size
+        self.max_driver_rss = max_driver_rss
+        self.accounts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def account_key(plan):
+        return (plan.username, plan.driver_type, plan.webdriver_path, plan.headless, plan.home_url)
+
+    def pool_size(self, plan):
+        if plan.cart_method != "selenium" or plan.cart_engine == "tabs":
+            return 0
+        size = (plan.driver_pool or {}).get('size', len(plan.targets))
+        if size > self.size - 1:
+            LOGGER.warning(f"Carting {size} sizes on the {self.size - 1} browsers the fleet allows")
+            size = self.size - 1
+        return size
+
+    def prepare(self, plan):
+        key = self.account_key(plan)
+        with self.lock:
+            account = self.accounts.setdefault(key, Account(key))
+        pool_size = self.pool_size(plan)
+        self.make_room(account, 1 + pool_size)
+        account.plan = plan
+        account.last_used = time.time()
+        self.sign_in(account, plan)
+        self.warm_pool(account, plan, pool_size)
+        return account
+
+    def make_room(self, account, needed):
+        needed = max(needed, account.size)
+        while True:
+            with self.lock:
+                others = [other for other in self.accounts.values() if other is not account]
+                if not others or sum(other.size for other in others) + needed <= self.size:
+                    return
+                oldest = min(others, key=lambda other: other.last_used)
+                del self.accounts[oldest.key]
+            LOGGER.info(f"Closing the browsers of {oldest.key[0]} to make room in the fleet")
+            oldest.close()
+
+    def sign_in(self, account, plan):
+        driver = account.main_driver
+        if driver is not None and not DriverPool.healthy(driver):
+            LOGGER.warning("Main browser of the fleet died, replacing it")
+            main.quit_driver(driver)
+            driver = account.main_driver = None
+        if driver is None:
+            driver = account.main_driver = main.generate_driver(
+                plan.webdriver_path,
+                plan.driver_type,
+                plan.page_load_timeout,
+                plan.headless,
+                plan.resource_policy,
+            )
+            if account.session is not None:
+                if main.restore_session(driver, account.session, home_url=plan.home_url):
+                    LOGGER.info("Restored the fleet session in a new main browser")
+                    return
+        elif main.signed_in(driver, home_url=plan.home_url):
+            LOGGER.info("Main browser of the fleet is still signed in")
+            return
+        queue_logging.set_context(phase="login")
+        main.login(
+            driver,
+            plan.login_time,
+            plan.num_retries,
+            plan.username,
+            plan.password,
+            plan.page_load_timeout,
+            home_url=plan.home_url,
+        )
+        account.session = browser_session.export_session(driver) if plan.share_session else None
+        if account.pool is not None:
+            # Signed in with the old session
+            account.pool.close()
+            account.pool = None
+
+    def warm_pool(self, account, plan, size):
+        pool = account.pool
+        if size == 0 or (pool is not None and pool.size >= size and not pool.exhausted.is_set()):
+            return
+        if pool is not None:
+            pool.close()
+        session_handoff = browser_session.SessionHandoff()
+        session_handoff.publish(account.session)
+        pool_config = plan.driver_pool or {}
+        account.pool = DriverPool(
+            functools.partial(
+                main.generate_worker_driver,
+                plan.webdriver_path,
+                plan.driver_type,
+                plan.page_load_timeout,
+                plan.headless,
+                plan.resource_policy,
+            ),
+            size=size,
+            startup_concurrency=pool_config.get('startup_concurrency', 2),
+            health_check_interval=pool_config.get('health_check_interval', 30),
+            warm_up=functools.partial(
+                main.warm_up_driver,
+                session_handoff=session_handoff,
+                login_time=None,
+                num_retries=plan.num_retries,
+                username=plan.username,
+                password=plan.password,
+                page_load_timeout=plan.page_load_timeout,
+                home_url=plan.home_url,
+                url=plan.url,
+            ),
+        ).start()
+
+    def over_limit(self, driver):
+        rss = resource_usage.driver_rss(driver)
+        return rss is not None and rss > self.max_driver_rss
+
+    def recycle(self):
+        if self.max_driver_rss is None or resource_usage.psutil is None:
+            return 0
+        recycled = 0
+        with self.lock:
+            accounts = list(self.accounts.values())
+        for account in accounts:
+            if account.pool is not None:
+                recycled += account.pool.recycle(self.over_limit, "outgrew its memory limit")
+            if account.main_driver is not None and self.over_limit(account.main_driver):
+                LOGGER.warning("Main browser of the fleet outgrew its memory limit, replacing it")
+                main.quit_driver(account.main_driver)
+                account.main_driver = None
+                recycled += 1
+                try:
+                    self.sign_in(account, account.plan)
+                except Exception as e:
+                    # The next job of the account tries again
+                    LOGGER.exception("Failed to replace the main browser: " + str(e))
+        return recycled
+
+    def browsers(self):
+        with self.lock:
+            return sum(account.size for account in self.accounts.values())
+
+    def status(self):
+        with self.lock:
+            accounts = list(self.accounts.values())
+        return {"size": self.size, "accounts": [account.to_dict() for account in accounts]}
+
+    def close(self):
+        with self.lock:
+            accounts = list(self.accounts.values())
+            self.accounts.clear()
+        for account in accounts:
+            account.close()
+        LOGGER.info("Fleet closed")
+
+
+class Daemon:
+    def __init__(
+        self,
+        fleet,
+        config_dir=None,
+        lead=LEAD_TIME,
+        poll_interval=POLL_INTERVAL,
+        recycle_interval=RECYCLE_INTERVAL,
+    ):
+        self.fleet = fleet
+        self.config_dir = config_dir
+        self.lead = lead
+        self.poll_interval = poll_interval
+        self.recycle_interval = recycle_interval
+        self.jobs = {}
+        self.loaded = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def load_directory(self):
+        if self.config_dir is None:
+            return
+        for path in sorted(glob.glob(os.path.join(self.config_dir, "*.json"))):
+            if path in self.loaded:
+                continue
+            self.loaded.add(path)
+            try:
+                with open(path) as f:
+                    config = json.load(f)
+                name = os.path.splitext(os.path.basename(path))[0]
+                self.add(config, name, source=path, reject_missed=False)
+            except Exception as e:
+                LOGGER.error(f"Skipping {path}: " + str(e))
+
+    def add(self, config, name=None, source=None, reject_missed=True):
+        plan = compile_plan(config)
+        if reject_missed and missed(plan):
+            raise Exception("release_time has already passed: " + format_time(plan.release_time))
+        with self.lock:
+            if name is None:
+                number = len(self.jobs) + 1
+                while f"job-{number}" in self.jobs:
+                    number += 1
+                name = f"job-{number}"
+            elif name in self.jobs and self.jobs[name].state in ACTIVE_STATES:
+                raise Exception(f"Job {name} is already {self.jobs[name].state}")
+            job = Job(name, plan, start_time(plan, self.lead), source)
+            self.jobs[name] = job
+            if missed(plan):
+                job.state = "missed"
+        if job.state == "missed":
+            LOGGER.warning(
+                f"Not running job {name}: its release_time has passed ("
+                + format_time(plan.release_time)
+                + ")"
+            )
+            return job
+        LOGGER.info(f"Scheduled job {name} ({plan!r}) to start at " + format_time(job.start_at))
+        self.wake.set()
+        return job
+
+    def cancel(self, name):
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                raise KeyError(name)
+            if job.state not in ACTIVE_STATES:
+                raise Exception(f"Job {name} is already {job.state}")
+            job.cancelled.set()
+            if job.state == "scheduled":
+                job.state = "cancelled"
+                job.finished = time.time()
+        LOGGER.info(f"Cancelled job {name}")
+        return job
+
+    def job(self, name):
+        with self.lock:
+            return self.jobs.get(name)
+
+    def list_jobs(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in jobs]
+
+    def next_job(self):
+        with self.lock:
+            scheduled = [job for job in self.jobs.values() if job.state == "scheduled"]
+        return min(scheduled, key=lambda job: job.start_at, default=None)
+
+    def run(self):
+        last_recycle = time.monotonic()
+        while not self.stopped.is_set():
+            self.load_directory()
+            job = self.next_job()
+            delay = self.poll_interval
+            if job is not None:
+                delay = min(delay, job.start_at - time.time())
+                if delay <= 0:
+                    self.run_job(job)
+                    continue
+            if time.monotonic() - last_recycle >= self.recycle_interval:
+                self.fleet.recycle()
+                last_recycle = time.monotonic()
+            self.wake.wait(delay)
+            self.wake.clear()
+
+    def run_job(self, job):
+        with self.lock:
+            if job.state != "scheduled":
+                return
+            # Another job, or the daemon being down, can outlast the whole release
+            if missed(job.plan):
+                job.state = "missed"
+                job.finished = time.time()
+            else:
+                job.state = "running"
+                job.started = time.time()
+        if job.state == "missed":
+            LOGGER.warning(f"Not running job {job.name}: its release_time has passed")
+            return
+        LOGGER.info(f"Starting job {job.name}: {job.plan!r}")
+        usage = resource_usage.UsageSampler().start()
+        profile = None
+        try:
+            main.configure_worker(job.plan)
+            profile = profiling.start(f"job {job.name}")
+            self.run_plan(job)
+            state = "done"
+        except JobCancelled as e:
+            LOGGER.warning(str(e))
+            state = "cancelled"
+        except Exception as e:
+            LOGGER.exception(f"Job {job.name} failed: " + str(e))
+            state = "failed"
+            job.error = str(e)
+        finally:
+            report = usage.stop()
+            if profiling.finish(profile) is not None:
+                profiling.write_summary(job.plan.profiling_run_dir)
+            retry.log_report()
+            retry.reset_stats()
+            instrumentation.write_timeline()
+            recorder.flush()
+        report["fleet_browsers"] = self.fleet.browsers()
+        resource_usage.log_report(f"Job {job.name}", report)
+        with self.lock:
+            job.usage = report
+            job.state = state
+            job.finished = time.time()
+
+    def run_plan(self, job):
+        plan = job.plan
+        if plan.timeline_dir:
+            # A fresh timeline per job
+            instrumentation.enable(plan.timeline_dir)
+        job.check()
+        account = self.fleet.prepare(plan)
+        job.check()
+        main.run_cart_phase(plan, account.main_driver, account.session, account.pool)
+        job.check()
+        queue_logging.set_context(phase="checkout")
+        # Keeps the cookies: the next release of the account reuses the session
+        main.checkout_cart(
+            account.main_driver,
+            plan.num_retries,
+            plan.cvv,
+            plan.auto_confirm_purchase,
+            plan.page_load_timeout,
+            plan.cart_url,
+            clear_cookies=False,
+            resume=plan.checkout_resume,
+        )
+        LOGGER.info(f"Job {job.name} checked out.")
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    def send_json(self, value, status=200):
+        body = json.dumps(value, indent=1).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def job_name(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "jobs":
+            return parts[1]
+        return None
+
+    def do_GET(self):
+        daemon = self.server.release_daemon
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/jobs":
+            self.send_json({"jobs": daemon.list_jobs()})
+        elif path == "/fleet":
+            self.send_json(daemon.fleet.status())
+        elif self.job_name() is not None:
+            job = daemon.job(self.job_name())
+            if job is None:
+                self.send_json({"error": "No such job"}, 404)
+            else:
+                self.send_json(job.to_dict())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(body, dict):
+                raise Exception("Expected a config object")
+            name = body.get("name") if "config" in body else None
+            job = self.server.release_daemon.add(body.get("config", body), name, source="api")
+        except Exception as e:
+            self.send_json({"error": str(e)}, 400)
+            return
+        self.send_json(job.to_dict(), 201)
+
+    def do_DELETE(self):
+        name = self.job_name()
+        if name is None:
+            self.send_error(404)
+            return
+        try:
+            job = self.server.release_daemon.cancel(name)
+        except KeyError:
+            self.send_json({"error": "No such job"}, 404)
+            return
+        except Exception as e:
+            self.send_json({"error": str(e)}, 409)
+            return
+        self.send_json(job.to_dict())
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        LOGGER.debug("Control API: " + format % args)
+
+
+class ControlServer:
+    def __init__(self, daemon, host="127.0.0.1", port=CONTROL_PORT):
+        self.httpd = ThreadingHTTPServer((host, port), ControlHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.release_daemon = daemon
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="control-api", daemon=True
+        )
+        self.thread.start()
+        LOGGER.info("Serving the control API on " + self.url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run every release of a directory of configs on a warm browser fleet."
+    )
+    parser.add_argument("config_dir", help="Directory of release configs (*.json)")
+    parser.add_argument("--host", default="127.0.0.1", help="Control API host")
+    parser.add_argument("--port", type=int, default=CONTROL_PORT, help="Control API port")
+    parser.add_argument(
+        "--fleet-size", type=int, default=FLEET_SIZE, help="Most browsers open at once"
+    )
+    parser.add_argument(
+        "--max-driver-rss-mb",
+        type=float,
+        help="Replace idle browsers whose memory grew past this (needs psutil)",
+    )
+    parser.add_argument(
+        "--lead",
+        type=float,
+        default=LEAD_TIME,
+        help="Seconds before release_time a job starts",
+    )
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--recycle-interval", type=float, default=RECYCLE_INTERVAL)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.config_dir):
+        parser.error(f"{args.config_dir} is not a directory")
+    if args.max_driver_rss_mb is not None and resource_usage.psutil is None:
+        LOGGER.warning("psutil is not installed, browsers will not be recycled")
+    fleet = Fleet(
+        args.fleet_size,
+        args.max_driver_rss_mb * 1024 * 1024 if args.max_driver_rss_mb is not None else None,
+    )
+    daemon = Daemon(fleet, args.config_dir, args.lead, args.poll_interval, args.recycle_interval)
+    control = ControlServer(daemon, args.host, args.port).start()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        LOGGER.info("Stopping the daemon")
+    finally:
+        control.stop()
+        fleet.close()
+        diagnostics.stop()
+        recorder.flush()
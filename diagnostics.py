@@ -0,0 +1,205 @@
+# pylint: disable=W1201
+
+import base64
+import contextlib
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import urllib3
+
+import metrics
+
+"""
+
+Screenshots, page source and URL of the browser when a login, add to cart or checkout
+attempt fails.
+
+With `"diagnostics_dir": "diagnostics"` in the config, `retry.run` calls the phase's
+hook after every failed attempt, before backing off. The hook only reads from the
+browser: the URL, a screenshot (already base64 from the driver) and the page source.
+The reads run on the retry's own thread, one after the other, and together get at most
+`diagnostics_budget` seconds: each command is sent with an HTTP timeout of what is left
+of the budget, and what was not read by then is left out of the capture. A slow or hung
+browser costs a missing screenshot or page source, not a slow retry, and no other thread
+ever sends commands to the browser the retry is driving. Decoding and writing the files
+happen on a background thread, behind a small queue; when the queue is full the capture
+is dropped. Each process keeps its newest `diagnostics_max_captures` captures.
+
+Each capture is `<time>-<pid>-<phase>-<attempt>` with `.json` (URL, error, the action
+taken, what was skipped), `.png` and `.html`.
+
+"""
+
+LOGGER = logging.getLogger()
+
+QUEUE_SIZE = 8
+MAX_CAPTURES = 50
+BUDGET = 0.25
+
+READS = {
+    "url": lambda driver: driver.current_url,
+    "screenshot": lambda driver: driver.get_screenshot_as_base64(),
+    "source": lambda driver: driver.page_source,
+}
+
+_writer = None
+
+
+@contextlib.contextmanager
+def command_timeout(driver, seconds):
+    # Commands sent meanwhile fail after `seconds` instead of waiting on a hung browser
+    executor = driver.command_executor
+    saved = executor.keep_alive, getattr(executor, "_conn", None)
+    executor.keep_alive = True
+    executor._conn = urllib3.PoolManager(timeout=urllib3.Timeout(total=seconds), retries=False)
+    try:
+        yield
+    finally:
+        executor._conn.clear()
+        executor.keep_alive, executor._conn = saved
+
+
+class DiagnosticsWriter:
+    def __init__(
+        self, directory, max_captures=MAX_CAPTURES, budget=BUDGET, queue_size=QUEUE_SIZE
+    ):
+        self.directory = directory
+        self.max_captures = max_captures
+        self.budget = budget
+        self.pid = os.getpid()
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.run, name="diagnostics", daemon=True)
+        self.captured = 0
+        self.dropped = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread.start()
+        return self
+
+    def capture(self, driver, phase, attempt, error, action):
+        start = time.monotonic()
+        capture = {
+            "time": time.time(),
+            "pid": self.pid,
+            "phase": phase,
+            "attempt": attempt,
+            "action": action,
+            "error": f"{type(error).__name__}: {str(error).strip()}",
+            "skipped": [],
+        }
+        for name, read in READS.items():
+            remaining = self.budget - (time.monotonic() - start)
+            if remaining <= 0:
+                capture["skipped"].append(name)
+                continue
+            try:
+                with command_timeout(driver, remaining):
+                    capture[name] = read(driver)
+            except Exception as e:
+                capture["skipped"].append(name)
+                capture.setdefault("read_errors", {})[name] = str(e)
+        seconds = time.monotonic() - start
+        capture["capture_seconds"] = seconds
+        try:
+            self.queue.put_nowait(capture)
+            self.captured += 1
+        except queue.Full:
+            self.dropped += 1
+            LOGGER.warning(f"Diagnostics queue is full, dropped the {phase} capture")
+        metrics.observe("diagnostics_capture_seconds", seconds, phase=phase)
+        return seconds
+
+    def run(self):
+        while True:
+            capture = self.queue.get()
+            if capture is None:
+                return
+            try:
+                self.write(capture)
+                self.rotate()
+            except Exception as e:
+                LOGGER.warning("Failed to write diagnostics: " + str(e))
+
+    def write(self, capture):
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(capture["time"]))
+        milliseconds = int(capture["time"] * 1000) % 1000
+        stem = os.path.join(
+            self.directory,
+            f"{stamp}.{milliseconds:03d}-{capture['pid']}-{capture['phase']}-{capture['attempt']}",
+        )
+        screenshot = capture.pop("screenshot", None)
+        if screenshot:
+            with open(stem + ".png", "wb") as f:
+                f.write(base64.b64decode(screenshot))
+        source = capture.pop("source", None)
+        if source is not None:
+            with open(stem + ".html", "w", encoding="utf-8") as f:
+                f.write(source)
+        # Written last: a capture is complete once its .json exists
+        with open(stem + ".json", "w") as f:
+            json.dump(capture, f, indent=1)
+        LOGGER.info(f"Saved {capture['phase']} diagnostics to {stem}.*")
+
+    def rotate(self):
+        # The directory is shared by every process of the run: each one only trims its own
+        # captures, so every process keeps its newest ones; the names sort by time
+        paths = glob.glob(os.path.join(self.directory, f"*-{self.pid}-*.json"))
+        stems = sorted(path[: -len(".json")] for path in paths)
+        for stem in stems[: max(len(stems) - self.max_captures, 0)]:
+            for path in glob.glob(glob.escape(stem) + ".*"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stop(self, timeout=5):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            LOGGER.warning("Diagnostics writer is stuck, dropping its queue")
+            return
+        self.thread.join(timeout)
+        if self.dropped:
+            LOGGER.warning(f"Dropped {self.dropped} of {self.captured + self.dropped} diagnostics")
+
+
+def configure(directory, max_captures=MAX_CAPTURES, budget=BUDGET):
+    global _writer
+    # A forked worker inherits the parent's writer, but not its thread
+    if _writer is not None and _writer.pid == os.getpid() and _writer.thread.is_alive():
+        if (_writer.directory, _writer.max_captures) == (directory, max_captures):
+            _writer.budget = budget
+            return _writer
+        _writer.stop()
+    _writer = DiagnosticsWriter(directory, max_captures, budget).start()
+    return _writer
+
+
+def hook(driver, phase):
+    """
+    The `on_failure` of a retry.run on this driver. Returns the seconds the capture took,
+    which retry.run takes off the backoff.
+    """
+    if _writer is None:
+        return None
+    return lambda error, action, attempt: capture(driver, phase, attempt, error, action)
+
+
+def capture(driver, phase, attempt, error, action):
+    if _writer is None:
+        return 0
+    return _writer.capture(driver, phase, attempt, error, action)
+
+
+def stop(timeout=5):
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        return
+    _writer.stop(timeout)
+    _writer = None
@@ -0,0 +1,192 @@
+# pylint: disable=W1201
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from selenium.common.exceptions import WebDriverException
+
+import instrumentation
+
+"""
+
+Pool of pre-launched WebDriver instances.
+
+Browsers are started in the background (at most `startup_concurrency` at a time), run
+through an optional `warm_up` callable (e.g. log in and open the product page) and then
+wait idle until a worker acquires one. Idle drivers are health checked every
+`health_check_interval` seconds and replaced if their session died; `recycle` replaces
+the idle ones that match any other test (e.g. memory use). `close` waits up to
+`RELEASE_TIMEOUT` seconds for acquired drivers to be released before quitting them, so
+attempts still finishing a step are not left on a quit browser.
+
+"""
+
+LOGGER = logging.getLogger()
+
+RELEASE_TIMEOUT = 30
+
+
+class DriverPool:
+    def __init__(
+        self, factory, size, startup_concurrency=2, health_check_interval=30, warm_up=None
+    ):
+        if size < 1:
+            raise Exception("Driver pool size must be at least 1.")
+        self.factory = factory
+        self.size = size
+        self.warm_up = warm_up
+        self.health_check_interval = health_check_interval
+        self.idle = queue.Queue()
+        self.drivers = []
+        self.acquired = set()
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.closed = threading.Event()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, startup_concurrency), thread_name_prefix="driver-pool"
+        )
+        self.health_thread = None
+        self.launch_failures = 0
+        self.max_launch_failures = 3 * size
+        self.exhausted = threading.Event()
+
+    def start(self):
+        LOGGER.info(f"Starting driver pool of {self.size}")
+        for index in range(self.size):
+            self.executor.submit(self.launch, index)
+        if self.health_check_interval:
+            self.health_thread = threading.Thread(
+                target=self.health_check_loop, name="driver-pool-health", daemon=True
+            )
+            self.health_thread.start()
+        return self
+
+    def launch(self, index):
+        driver = None
+        try:
+            with instrumentation.span("driver_pool.launch", index=index):
+                driver = self.factory()
+                with self.lock:
+                    self.drivers.append(driver)
+                if self.warm_up:
+                    self.warm_up(driver)
+        except Exception as e:
+            LOGGER.exception(f"Failed to launch pooled driver {index}: " + str(e))
+            if driver is not None:
+                self.discard(driver)
+            with self.lock:
+                self.launch_failures += 1
+                exhausted = self.launch_failures >= self.max_launch_failures
+            if exhausted:
+                LOGGER.error("Too many pooled driver launch failures, giving up")
+                self.exhausted.set()
+            else:
+                # Keep the pool at its configured size
+                self.replace(index)
+            return
+        if self.closed.is_set():
+            self.discard(driver)
+            return
+        LOGGER.info(f"Pooled driver {index} is ready")
+        self.idle.put(driver)
+
+    @staticmethod
+    def healthy(driver):
+        try:
+            driver.current_url  # pylint: disable=W0104
+            return True
+        except WebDriverException:
+            return False
+
+    def discard(self, driver):
+        with self.lock:
+            if driver in self.drivers:
+                self.drivers.remove(driver)
+            self.acquired.discard(driver)
+            self.released.notify_all()
+        try:
+            driver.quit()
+        except Exception as e:
+            LOGGER.warning("Error quitting pooled driver: " + str(e))
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                driver = self.idle.get(timeout=1)
+            except queue.Empty:
+                if self.exhausted.is_set() and not self.drivers:
+                    raise Exception("Driver pool could not launch any more drivers.")
+                if deadline is not None and time.monotonic() > deadline:
+                    raise Exception("No pooled driver became ready in time.")
+                continue
+            if self.healthy(driver):
+                with self.lock:
+                    self.acquired.add(driver)
+                return driver
+            LOGGER.warning("Pooled driver failed its health check, replacing it")
+            self.discard(driver)
+            self.replace(len(self.drivers))
+
+    def replace(self, index):
+        if self.closed.is_set():
+            return
+        try:
+            self.executor.submit(self.launch, index)
+        except RuntimeError:
+            pass  # closed while replacing
+
+    def release(self, driver):
+        if self.closed.is_set():
+            self.discard(driver)
+            return
+        with self.lock:
+            self.acquired.discard(driver)
+            self.released.notify_all()
+        self.idle.put(driver)
+
+    def sweep(self, keep, reason):
+        checked = []
+        while True:
+            try:
+                checked.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        replaced = 0
+        for driver in checked:
+            if keep(driver):
+                self.idle.put(driver)
+            else:
+                LOGGER.warning(f"Idle pooled driver {reason}, replacing it")
+                self.discard(driver)
+                self.replace(len(self.drivers))
+                replaced += 1
+        return replaced
+
+    def recycle(self, should_recycle, reason="is recycled"):
+        return self.sweep(lambda driver: not should_recycle(driver), reason)
+
+    def health_check_loop(self):
+        while not self.closed.wait(self.health_check_interval):
+            self.sweep(self.healthy, "died")
+
+    def close(self, timeout=RELEASE_TIMEOUT):
+        self.closed.set()
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            # Attempts stopped early are still finishing a step on their drivers
+            if not self.released.wait_for(lambda: not self.acquired, timeout):
+                LOGGER.warning(f"Quitting {len(self.acquired)} pooled drivers still in use")
+            drivers = list(self.drivers)
+        for driver in drivers:
+            self.discard(driver)
+        LOGGER.info("Driver pool closed")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
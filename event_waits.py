@@ -0,0 +1,139 @@
+# pylint: disable=W1201
+
+import logging
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+"""
+
+Event-driven element waits.
+
+Instead of polling the driver every `frequency` seconds, one async script installs a
+MutationObserver in the page and calls back as soon as the element matches the
+condition, so a wait costs a single WebDriver round trip and resolves within a frame
+of the DOM change. `wait` returns None when the browser cannot run the script, and the
+caller falls back to WebDriverWait polling.
+
+Checks are plain JavaScript function bodies that read their parameters from `args` and
+return a truthy value once satisfied; `polling_script` wraps the same body for a
+synchronous execute_script call.
+
+"""
+
+LOGGER = logging.getLogger()
+
+CONDITIONS = ("present", "visible", "clickable", "invisible")
+
+ELEMENT_CHECK = """
+var xpath = args[0], condition = args[1];
+var el = document.evaluate(
+  xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+function visible(el) {
+  if (!el || !el.isConnected) return false;
+  var style = window.getComputedStyle(el);
+  if (style.visibility === "hidden" || style.display === "none") return false;
+  return !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+}
+switch (condition) {
+  case "present": return el;
+  case "visible": return visible(el) ? el : null;
+  case "clickable": return visible(el) && !el.disabled ? el : null;
+  case "invisible": return visible(el) ? null : true;
+}
+return null;
+"""
+
+OBSERVER_SCRIPT = """
+var done = arguments[arguments.length - 1];
+var timeoutMs = arguments[arguments.length - 2];
+var args = Array.prototype.slice.call(arguments, 0, arguments.length - 2);
+function check() { /*CHECK*/ }
+var result = check();
+if (result) { done(result); return; }
+var finished = false, observer, interval, timer;
+function finish(value) {
+  if (finished) return;
+  finished = true;
+  observer.disconnect();
+  clearInterval(interval);
+  clearTimeout(timer);
+  done(value);
+}
+observer = new MutationObserver(function () {
+  var value = check();
+  if (value) finish(value);
+});
+observer.observe(document, {
+  childList: true, subtree: true, attributes: true, characterData: true
+});
+// Style changes that come from stylesheets or layout do not mutate the DOM
+interval = setInterval(function () {
+  var value = check();
+  if (value) finish(value);
+}, 50);
+timer = setTimeout(function () { finish(null); }, timeoutMs);
+"""
+
+_SCRIPT_TIMEOUT_ATTR = "_event_wait_script_timeout"
+_SUPPORTED_ATTR = "_event_wait_supported"
+
+
+def observer_script(check):
+    return OBSERVER_SCRIPT.replace("/*CHECK*/", check)
+
+
+def polling_script(check):
+    return "var args = arguments;\n" + check
+
+
+WAIT_SCRIPT = observer_script(ELEMENT_CHECK)
+
+
+def class_name_xpath(class_name):
+    return f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+def ensure_script_timeout(driver, duration):
+    # Only pay for the extra round trip when the budget grows
+    current = getattr(driver, _SCRIPT_TIMEOUT_ATTR, 0)
+    if duration + 1 > current:
+        driver.set_script_timeout(duration + 1)
+        setattr(driver, _SCRIPT_TIMEOUT_ATTR, duration + 1)
+
+
+def run_observer(driver, duration, script, description, *args):
+    if getattr(driver, _SUPPORTED_ATTR, None) is False:
+        return None
+
+    try:
+        ensure_script_timeout(driver, duration)
+        result = driver.execute_async_script(script, *args, int(duration * 1000))
+    except TimeoutException:
+        raise
+    except WebDriverException as e:
+        # A navigation can unload the page under the script; only give up on the
+        # engine for good if it has never worked on this driver
+        if getattr(driver, _SUPPORTED_ATTR, None) is None:
+            LOGGER.warning("Event waits unavailable, falling back to polling: " + str(e))
+            setattr(driver, _SUPPORTED_ATTR, False)
+        else:
+            LOGGER.info("Event wait interrupted, polling instead: " + str(e))
+        return None
+
+    setattr(driver, _SUPPORTED_ATTR, True)
+    if not result:
+        raise TimeoutException(f"Timed out after {duration}s waiting for {description}")
+    return result
+
+
+def wait(driver, duration, condition, xpath=None, class_name=None):
+    if condition not in CONDITIONS:
+        raise Exception("Unknown wait condition: " + condition)
+    if xpath is None:
+        xpath = class_name_xpath(class_name)
+    return run_observer(driver, duration, WAIT_SCRIPT, f"{condition}: {xpath}", xpath, condition)
+
+
+def wait_for_check(driver, duration, check, description, *args):
+    return run_observer(driver, duration, observer_script(check), description, *args)
@@ -2,7 +2,6 @@ import os
 import sys
 import six
 import pause
-import requests
 import argparse
 import logging.config
 from selenium import webdriver
@@ -11,6 +10,7 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support import expected_conditions as EC
+from cart_client import CartClient
 
 """
 
@@ -49,7 +49,6 @@ logging.config.dictConfig(
 
 NIKE_HOME_URL = "https://www.nike.com/us/en_us/"
 NIKE_CHECKOUT_URL = "https://www.nike.com/checkout"
-NIKE_CART_API_URL = "https://secure-store.nike.com/us/services/jcartService"
 LOGGER = logging.getLogger()
 
 
@@ -80,47 +79,54 @@ def run(
         LOGGER.exception("Failed to login: " + str(e))
         six.reraise(Exception, e, sys.exc_info()[2])
 
-    if release_time:
-        LOGGER.info("Waiting until release time: " + release_time)
-        pause.until(date_parser.parse(release_time))
+    # Copy the login cookies once; every attempt reuses the same keep-alive connection
+    with CartClient() as cart_client:
+        cart_client.sync_cookies(driver)
 
-    num_retries_attempted = 0
-    while True:
-        try:
-            try:
-                LOGGER.info("Adding item to cart")
-                add_item_to_cart(
-                    driver=driver, product_id=product_id, sku_id=sku_id, size=shoe_size
-                )
-            except Exception as e:
-                LOGGER.exception("Failed to add item to cart " + str(e))
-                six.reraise(Exception, e, sys.exc_info()[2])
+        if release_time:
+            LOGGER.info("Waiting until release time: " + release_time)
+            pause.until(date_parser.parse(release_time))
 
+        num_retries_attempted = 0
+        while True:
             try:
-                LOGGER.info("Requesting page: " + NIKE_CHECKOUT_URL)
-                driver.get(NIKE_CHECKOUT_URL)
-            except TimeoutException:
-                LOGGER.info("Page load timed out but continuing anyway")
-
-            if purchase:
                 try:
-                    click_place_order_button(driver=driver)
+                    LOGGER.info("Adding item to cart")
+                    add_item_to_cart(
+                        cart_client=cart_client,
+                        product_id=product_id,
+                        sku_id=sku_id,
+                        size=shoe_size,
+                    )
                 except Exception as e:
-                    LOGGER.exception("Failed to click place order button: " + str(e))
+                    LOGGER.exception("Failed to add item to cart " + str(e))
                     six.reraise(Exception, e, sys.exc_info()[2])
 
-            LOGGER.info("Purchased shoe")
-            break
-        except Exception:
-            if num_retries and num_retries_attempted < num_retries:
-                num_retries_attempted += 1
-                continue
-            else:
+                try:
+                    LOGGER.info("Requesting page: " + NIKE_CHECKOUT_URL)
+                    driver.get(NIKE_CHECKOUT_URL)
+                except TimeoutException:
+                    LOGGER.info("Page load timed out but continuing anyway")
+
+                if purchase:
+                    try:
+                        click_place_order_button(driver=driver)
+                    except Exception as e:
+                        LOGGER.exception("Failed to click place order button: " + str(e))
+                        six.reraise(Exception, e, sys.exc_info()[2])
+
+                LOGGER.info("Purchased shoe")
                 break
+            except Exception:
+                if num_retries and num_retries_attempted < num_retries:
+                    num_retries_attempted += 1
+                    continue
+                else:
+                    break
 
-    if screenshot_path:
-        LOGGER.info("Saving screenshot")
-        driver.save_screenshot(screenshot_path)
+        if screenshot_path:
+            LOGGER.info("Saving screenshot")
+            driver.save_screenshot(screenshot_path)
 
     driver.quit()
 
@@ -166,37 +172,8 @@ def click_place_order_button(driver):
     driver.find_element_by_xpath(xpath).click()
 
 
-def add_item_to_cart(driver, product_id, sku_id, size):
-    cookies = driver.get_cookies()
-    params = {
-        "action": "addItem",
-        "lang_locale": "en_US",
-        "catalogId": "1",
-        "productId": product_id,
-        "qty": "1",
-        "price": "",
-        "skuAndSize": "{}:{}".format(sku_id, size),
-        "rt": "json",
-        "view": "3",
-        "skuId": sku_id,
-        "displaySize": "10",
-    }
-    headers = {
-        "user-agent": "Mozilla/5.0 (X11; Linux x86_64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.99 Safari/537.36",
-        "origin": "https://www.nike.com",
-        "accept-encoding": "gzip, deflate, br",
-        "accept-language": "en-US,en;q=0.9",
-        "accept": "*/*",
-        "scheme": "https",
-    }
-    response = requests.get(url=NIKE_CART_API_URL, params=params, headers=headers, cookies=cookies)
-    if response.status_code != 200:
-        raise Exception(
-            "Request to add item to cart failed (code {}): {}".format(
-                response.status_code, response.text
-            )
-        )
+def add_item_to_cart(cart_client, product_id, sku_id, size):
+    cart_client.add_item(product_id=product_id, sku_id=sku_id, size=size)
 
 
 def wait_until_clickable(driver, xpath=None, class_name=None, duration=10000, frequency=0.01):
@@ -0,0 +1,550 @@
+# pylint: disable=W1201
+
+import base64
+import logging
+import time
+
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    NoSuchElementException,
+    NoSuchFrameException,
+    StaleElementReferenceException,
+    WebDriverException,
+)
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
+
+import checkout
+import conditions
+import event_waits
+import locators
+import recorder
+from plan import size_target
+
+"""
+
+In-memory stand-in for a WebDriver session, for benchmarking the wait and click helpers
+of main.py without a browser.
+
+`FakeDriver` is a real selenium `WebDriver` whose `execute` answers the commands itself,
+so WebElements, `switch_to`, WebDriverWait and `instrumentation.CommandCounter` work
+unchanged. Pages are lists of `FakeElement`s, keyed by URL. Each element has its own
+schedule: it appears some time after the page loads (or after another element is
+clicked), can start disabled, can be hidden later, and can refuse its first clicks.
+The page scripts main.py runs (element waits, locators, readiness conditions, the armed
+click, checkout step detection and the recorder's timing and snapshot) are recognized
+by their text and answered from that model. Any other script raises, so a new script
+shows up as an error instead of a silently wrong result. Every command can be given a
+fixed latency to stand in for the WebDriver round trip, and single commands (a slow
+screenshot, say) a latency of their own.
+
+"""
+
+LOGGER = logging.getLogger()
+
+SIGNED_IN_XPATH = "//div[@class='pre-avatar']"
+SPINNER_XPATH = "//div[@class='loading-spiner-holder']"
+PAYMENT_IFRAME_XPATH = "//iframe[@id='paymentIFrameEvo']"
+STORED_CARDS_XPATH = "//iframe[@id='stored-cards-iframe']"
+CVV_XPATH = "//input[@name='cardCvv']"
+DISMISS_XPATH = "//input[@value='Dismiss this error']"
+OBSERVER_POLL = 0.005
+# The 8-byte PNG signature, which is all a screenshot needs to be
+SCREENSHOT = base64.b64encode(b"\x89PNG\r\n\x1a\n").decode("ascii")
+BASE_URL = "http://fake.test"
+PRODUCT_PATH = "/launch/t/fake"
+# Seconds; the spinner hides, the others appear, after the page load or the previous click
+STOREFRONT_DELAYS = {
+    "login_form": 0.1,
+    "signed_in": 0.3,
+    "size_button": 0.2,
+    "added": 0.3,
+    "spinner": 0.5,
+    "shipping": 0.2,
+    "billing": 0.2,
+    "payment": 0.2,
+}
+IGNORED_COMMANDS = (
+    Command.QUIT,
+    Command.SET_TIMEOUTS,
+    Command.SET_SCRIPT_TIMEOUT,
+    Command.IMPLICIT_WAIT,
+    Command.MAXIMIZE_WINDOW,
+    Command.DELETE_ALL_COOKIES,
+)
+
+
+class FakeElement:
+    def __init__(
+        self,
+        name,
+        xpath,
+        locator=None,
+        appear=0,
+        after=None,
+        hide=None,
+        hide_after=None,
+        enabled=0,
+        click_failures=0,
+        select=False,
+        navigate=None,
+        adds_to_bag=False,
+        frame=None,
+    ):
+        self.name = name
+        self.xpath = xpath
+        self.locator = locator
+        self.appear = appear  # seconds after the page loads
+        self.after = after  # (element name, seconds) after that element is clicked, instead
+        self.hide = hide  # seconds after the page loads
+        self.hide_after = hide_after  # (element name, seconds)
+        self.enabled = enabled  # seconds after it appears
+        self.click_failures = click_failures
+        self.select = select
+        self.navigate = navigate
+        self.adds_to_bag = adds_to_bag
+        self.frame = frame  # name of the iframe element it is in
+
+
+class PageState:
+    def __init__(self, url, elements, generation):
+        self.url = url
+        self.elements = {element.name: element for element in elements}
+        self.loaded_at = time.monotonic()
+        self.generation = generation
+        self.clicks = {}
+        self.click_failures = {element.name: element.click_failures for element in elements}
+        self.selected = set()
+        self.values = {}
+
+    def event_time(self, base, offset):
+        if base is None:
+            return self.loaded_at + offset
+        name, delay = base
+        clicked = self.clicks.get(name)
+        return None if clicked is None else clicked + delay
+
+    def appears(self, element):
+        return self.event_time(element.after, element.appear)
+
+    def present(self, element):
+        appears = self.appears(element)
+        return appears is not None and time.monotonic() >= appears
+
+    def visible(self, element):
+        if not self.present(element):
+            return False
+        now = time.monotonic()
+        if element.hide is not None and now >= self.loaded_at + element.hide:
+            return False
+        hides = self.event_time(element.hide_after, 0) if element.hide_after else None
+        return hides is None or now < hides
+
+    def enabled(self, element):
+        if not self.visible(element):
+            return False
+        return time.monotonic() >= self.appears(element) + element.enabled
+
+    def bag_count(self):
+        return str(
+            sum(1 for e in self.elements.values() if e.adds_to_bag and self.present(e))
+        )
+
+
+class FakeExecutor:
+    # Stands in for RemoteConnection; FakeDriver.execute never calls it, but honours the
+    # request timeout of a connection pool set on it, as diagnostics does
+    keep_alive = False
+    _conn = None
+
+    def execute(self, command, params):
+        raise WebDriverException("FakeDriver does not send commands: " + command)
+
+
+class FakeDriver(RemoteWebDriver):
+    def __init__(self, pages=None, command_latency=0.0, command_latencies=None):
+        self.pages = dict(pages or {})
+        self.command_latency = command_latency
+        self.command_latencies = dict(command_latencies or {})
+        self.page = None
+        self.generation = 0
+        self.frame = None
+        self.commands = 0
+        self.scripts = script_handlers()
+        super().__init__(command_executor=FakeExecutor(), desired_capabilities={})
+
+    def element_id(self, element):
+        return f"{self.generation}:{element.name}"
+
+    def element_ref(self, element):
+        return {"ELEMENT": self.element_id(element)}
+
+    def lookup(self, element_id):
+        generation, _, name = element_id.partition(":")
+        if self.page is None or int(generation) != self.generation:
+            raise StaleElementReferenceException(f"{name} is from another page")
+        return self.page.elements[name]
+
+    def load(self, url):
+        self.generation += 1
+        self.frame = None
+        self.page = PageState(url, self.pages.get(url, []), self.generation)
+
+    def find(self, xpath=None, locator_key=None, frame=True):
+        if self.page is None:
+            return None
+        for element in self.page.elements.values():
+            if frame and element.frame != self.frame:
+                continue
+            if xpath is not None and element.xpath != xpath:
+                continue
+            if locator_key is not None:
+                if element.locator is None or locator_key != key_of(element.locator):
+                    continue
+            if self.page.present(element):
+                return element
+        return None
+
+    def click(self, element):
+        if not self.page.enabled(element):
+            raise ElementClickInterceptedException(f"{element.name} is not clickable")
+        if self.page.click_failures.get(element.name):
+            self.page.click_failures[element.name] -= 1
+            raise ElementClickInterceptedException(f"{element.name} is covered")
+        self.page.clicks[element.name] = time.monotonic()
+        if element.select:
+            self.page.selected.add(element.name)
+        if element.navigate:
+            self.load(element.navigate)
+
+    def execute(self, driver_command, params=None):
+        self.commands += 1
+        latency = self.command_latencies.get(driver_command, self.command_latency)
+        timeout = self.request_timeout()
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise WebDriverException(f"{driver_command} timed out after {timeout:.3f}s")
+        if latency:
+            time.sleep(latency)
+        params = self._wrap_value(params or {})
+        value = self.handle(driver_command, params)
+        if driver_command == Command.NEW_SESSION:
+            return value
+        return {"status": 0, "value": self._unwrap_value(value)}
+
+    def request_timeout(self):
+        executor = self.command_executor
+        if not executor.keep_alive or executor._conn is None:
+            return None
+        timeout = executor._conn.connection_pool_kw.get("timeout")
+        return None if timeout is None else timeout.total
+
+    def handle(self, command, params):
+        if command == Command.NEW_SESSION:
+            # A reply with a status: selenium then speaks the JSON wire protocol, not W3C
+            return {"status": 0, "sessionId": "fake", "value": {"browserName": "fake"}}
+        if command in IGNORED_COMMANDS:
+            return None
+        if command == Command.GET:
+            self.load(params["url"])
+            return None
+        if command == Command.GET_CURRENT_URL:
+            return self.page.url if self.page else "about:blank"
+        if command == Command.SCREENSHOT:
+            return SCREENSHOT
+        if command == Command.GET_PAGE_SOURCE:
+            return self.snapshot() if self.page else "<html></html>"
+        if command == Command.FIND_ELEMENT:
+            if params["using"] != "xpath":
+                raise WebDriverException("FakeDriver only finds elements by xpath")
+            element = self.find(xpath=params["value"])
+            if element is None:
+                raise NoSuchElementException("No element at " + params["value"])
+            return self.element_ref(element)
+        if command == Command.FIND_ELEMENTS:
+            element = self.find(xpath=params["value"])
+            return [self.element_ref(element)] if element else []
+        if command == Command.IS_ELEMENT_DISPLAYED:
+            return self.page.visible(self.lookup(params["id"]))
+        if command == Command.IS_ELEMENT_ENABLED:
+            return self.page.enabled(self.lookup(params["id"]))
+        if command == Command.CLICK_ELEMENT:
+            self.click(self.lookup(params["id"]))
+            return None
+        if command == Command.CLEAR_ELEMENT:
+            self.page.values[self.lookup(params["id"]).name] = ""
+            return None
+        if command == Command.SEND_KEYS_TO_ELEMENT:
+            name = self.lookup(params["id"]).name
+            self.page.values[name] = self.page.values.get(name, "") + params["text"]
+            return None
+        if command == Command.SWITCH_TO_FRAME:
+            return self.switch_frame(params["id"])
+        if command == Command.SWITCH_TO_PARENT_FRAME:
+            parent = self.page.elements.get(self.frame) if self.frame else None
+            self.frame = parent.frame if parent else None
+            return None
+        if command == Command.EXECUTE_SCRIPT:
+            return self.run_script(params["script"], params["args"])
+        if command == Command.EXECUTE_ASYNC_SCRIPT:
+            return self.run_async_script(params["script"], params["args"])
+        raise WebDriverException("FakeDriver does not support " + command)
+
+    def switch_frame(self, frame_id):
+        if frame_id is None:
+            self.frame = None
+            return None
+        if not isinstance(frame_id, dict):
+            raise NoSuchFrameException("FakeDriver only switches to frame elements")
+        self.frame = self.lookup(frame_id["ELEMENT"]).name
+        return None
+
+    def run_script(self, script, args):
+        handler = self.scripts.get(script)
+        if handler is None:
+            raise WebDriverException("FakeDriver does not know this script: " + script[:60])
+        return handler(self, *args)
+
+    def run_async_script(self, script, args):
+        # Observer scripts: check at once, then often, as a MutationObserver would
+        check = self.scripts.get(script)
+        if check is None:
+            raise WebDriverException("FakeDriver does not know this script: " + script[:60])
+        *args, timeout_ms = args
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            result = check(self, *args)
+            if result or time.monotonic() >= deadline:
+                return result or None
+            time.sleep(OBSERVER_POLL)
+
+    # The page scripts main.py runs, answered from the page model
+
+    def element_check(self, xpath, condition):
+        element = self.find(xpath=xpath)
+        if condition == "present":
+            return self.element_ref(element) if element else None
+        if condition == "visible":
+            return self.element_ref(element) if element and self.page.visible(element) else None
+        if condition == "clickable":
+            return self.element_ref(element) if element and self.page.enabled(element) else None
+        return None if element and self.page.visible(element) else True
+
+    def locate_check(self, css, texts, contains, xpath, action):
+        element = self.find(locator_key=(css, tuple(texts), contains))
+        if element is None and xpath:
+            result = self.locate_element(self.find(xpath=xpath), action)
+            return [result] if result else None
+        return self.locate_element(element, action)
+
+    def locate_element(self, element, action):
+        if element is None:
+            return None
+        if action == "present":
+            return self.element_ref(element)
+        if not self.page.visible(element):
+            return None
+        if action == "visible":
+            return self.element_ref(element)
+        if not self.page.enabled(element):
+            return None
+        if action == "clickable":
+            return self.element_ref(element)
+        try:
+            self.click(element)
+        except ElementClickInterceptedException:
+            return None
+        return "clicked"
+
+    def visible_xpath(self, xpath):
+        element = self.find(xpath=xpath)
+        return bool(element and self.page.visible(element))
+
+    def login_form_ready(self, email_xpath, password_xpath):
+        email = self.find(xpath=email_xpath)
+        password = self.find(xpath=password_xpath)
+        return bool(email and password and self.page.enabled(email) and self.page.enabled(password))
+
+    def login_outcome(self, signed_in_xpath, dismiss_xpath):
+        if self.visible_xpath(signed_in_xpath):
+            return "success"
+        if self.visible_xpath(dismiss_xpath):
+            return "error"
+        return None
+
+    def size_selected(self, xpath):
+        element = self.find(xpath=xpath)
+        return bool(element and element.name in self.page.selected)
+
+    def added_to_bag(self, count, close_xpath):
+        return self.page.bag_count() != count or self.visible_xpath(close_xpath)
+
+    def fire(self, element_ref):
+        element = self.lookup(element_ref["ELEMENT"])
+        if not self.page.enabled(element):
+            return False
+        self.click(element)
+        return True
+
+    def navigation_timing(self):
+        url = self.page.url if self.page else "about:blank"
+        path = "/" + url.split("://", 1)[-1].partition("/")[2]
+        return {"url": path, "server": 0, "transfer": 0, "dom_ready": 0, "load": 0, "resources": 0}
+
+    def snapshot(self):
+        present = [e for e in self.page.elements.values() if self.page.present(e)]
+        return "<html><body>" + "".join(f"<!-- {e.xpath} -->" for e in present) + "</body></html>"
+
+    def detect_checkout_step(self):
+        top = self.frame
+        self.frame = None
+        try:
+            if self.find(xpath=PAYMENT_IFRAME_XPATH):
+                return "payment"
+            for step, xpath in (
+                ("billing", locators.BILLING_SUBMIT.xpath),
+                ("shipping", locators.SHIPPING_SUBMIT.xpath),
+                ("spinner", SPINNER_XPATH),
+            ):
+                if self.visible_xpath(xpath):
+                    return step
+            if self.find(xpath=locators.MEMBER_CHECKOUT.xpath):
+                return "member_checkout"
+            return None
+        finally:
+            self.frame = top
+
+
+def key_of(locator):
+    return (locator.css, tuple(locator.texts), locator.contains)
+
+
+def script_handlers():
+    import main
+
+    checks = {
+        event_waits.ELEMENT_CHECK: FakeDriver.element_check,
+        locators.LOCATE_CHECK: FakeDriver.locate_check,
+        conditions.LOGIN_FORM_READY: FakeDriver.login_form_ready,
+        conditions.LOGIN_OUTCOME: FakeDriver.login_outcome,
+        conditions.ERROR_DISMISSED: lambda driver, xpath: not driver.visible_xpath(xpath),
+        conditions.SIZE_SELECTED: FakeDriver.size_selected,
+        conditions.BAG_COUNT: lambda driver: driver.page.bag_count(),
+        conditions.ADDED_TO_BAG: FakeDriver.added_to_bag,
+    }
+    handlers = {}
+    for check, handler in checks.items():
+        # The same check runs polled or from an observer
+        handlers[event_waits.polling_script(check)] = handler
+        handlers[event_waits.observer_script(check)] = handler
+    handlers[main.FIRE_SCRIPT] = FakeDriver.fire
+    handlers[checkout.DETECT_SCRIPT] = lambda driver: driver.detect_checkout_step()
+    handlers[recorder.TIMING_SCRIPT] = FakeDriver.navigation_timing
+    handlers[recorder.SNAPSHOT_SCRIPT] = FakeDriver.snapshot
+    return handlers
+
+
+def storefront_pages(
+    base_url=BASE_URL,
+    shoe_gender="M",
+    shoe_size="9",
+    delays=None,
+    click_failures=None,
+):
+    """
+    The login, product, cart and checkout pages, as main.py sees them. `delays` and
+    `click_failures` are keyed by element name.
+    """
+    delays = dict(STOREFRONT_DELAYS, **(delays or {}))
+    failures = click_failures or {}
+    target = size_target(shoe_gender, str(shoe_size))
+
+    def element(name, xpath, **kwargs):
+        return FakeElement(name, xpath, click_failures=failures.get(name, 0), **kwargs)
+
+    login = [
+        element("email", "//input[@name='emailAddress']", appear=delays["login_form"]),
+        element("password", "//input[@name='password']", appear=delays["login_form"]),
+        element("sign_in", "//input[@value='SIGN IN']", appear=delays["login_form"]),
+        element("signed_in", SIGNED_IN_XPATH, after=("sign_in", delays["signed_in"])),
+    ]
+    product = [
+        element(
+            "size_button",
+            target.xpath,
+            locator=target.locator,
+            appear=delays["size_button"],
+            select=True,
+        ),
+        element("add_to_bag", locators.ADD_TO_BAG.xpath, locator=locators.ADD_TO_BAG),
+        element(
+            "close_modal",
+            locators.CLOSE_MODAL.xpath,
+            locator=locators.CLOSE_MODAL,
+            after=("add_to_bag", delays["added"]),
+            hide_after=("close_modal", 0),
+            adds_to_bag=True,
+        ),
+    ]
+    cart = [
+        element(
+            "member_checkout",
+            locators.MEMBER_CHECKOUT.xpath,
+            locator=locators.MEMBER_CHECKOUT,
+            navigate=base_url + "/checkout",
+        )
+    ]
+    checkout_page = [
+        element("spinner", SPINNER_XPATH, hide=delays["spinner"]),
+        element(
+            "shipping_checkbox",
+            locators.SHIPPING_CHECKBOX.xpath,
+            locator=locators.SHIPPING_CHECKBOX,
+            appear=delays["spinner"],
+            hide_after=("shipping_submit", delays["shipping"]),
+        ),
+        element(
+            "shipping_submit",
+            locators.SHIPPING_SUBMIT.xpath,
+            locator=locators.SHIPPING_SUBMIT,
+            appear=delays["spinner"],
+            hide_after=("shipping_submit", delays["shipping"]),
+        ),
+        element(
+            "billing_submit",
+            locators.BILLING_SUBMIT.xpath,
+            locator=locators.BILLING_SUBMIT,
+            after=("shipping_submit", delays["shipping"]),
+            hide_after=("billing_submit", delays["billing"]),
+        ),
+        element(
+            "payment_iframe",
+            PAYMENT_IFRAME_XPATH,
+            after=("billing_submit", delays["billing"] + delays["payment"]),
+        ),
+        element(
+            "stored_cards",
+            STORED_CARDS_XPATH,
+            after=("billing_submit", delays["billing"] + delays["payment"]),
+            frame="payment_iframe",
+        ),
+        element(
+            "pay_now",
+            locators.PAY_NOW.xpath,
+            locator=locators.PAY_NOW,
+            after=("billing_submit", delays["billing"] + delays["payment"]),
+            frame="payment_iframe",
+        ),
+        element(
+            "cvv",
+            CVV_XPATH,
+            after=("billing_submit", delays["billing"] + delays["payment"]),
+            frame="stored_cards",
+        ),
+    ]
+    return {
+        base_url + "/login": login,
+        base_url + PRODUCT_PATH: product,
+        base_url + "/cart": cart,
+        base_url + "/checkout": checkout_page,
+    }
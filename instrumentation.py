@@ -0,0 +1,238 @@
+# pylint: disable=W1201
+
+import functools
+import glob
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+
+Lightweight span recorder for main.py.
+
+Spans are kept in memory per process and appended to `<timeline_dir>/spans-<pid>.jsonl`
+on flush. The timeline directory is passed to spawned workers through the environment,
+so every mp.Pool worker records into the same place. `write_timeline` merges all of
+them into `timeline.json` and a Chrome trace (`timeline.trace.json`, open it in
+chrome://tracing or https://ui.perfetto.dev).
+
+Times come from time.monotonic_ns, which is system-wide, so spans from different
+processes line up on one axis.
+
+"""
+
+TIMELINE_DIR_ENV = "SNKRS_TIMELINE_DIR"
+LOGGER = logging.getLogger()
+
+_timeline_dir = os.environ.get(TIMELINE_DIR_ENV)
+_spans = []
+_listeners = []
+_process_name = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return _timeline_dir is not None or bool(_listeners)
+
+
+def enable(timeline_dir, clear=True):
+    global _timeline_dir
+    os.makedirs(timeline_dir, exist_ok=True)
+    if clear:
+        for path in glob.glob(os.path.join(timeline_dir, "spans-*.jsonl")):
+            os.remove(path)
+    _timeline_dir = timeline_dir
+    os.environ[TIMELINE_DIR_ENV] = timeline_dir
+
+
+def disable():
+    global _timeline_dir
+    flush()
+    _timeline_dir = None
+    os.environ.pop(TIMELINE_DIR_ENV, None)
+
+
+def add_listener(listener):
+    # Called with every finished span, with or without a timeline
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def set_process_name(name):
+    global _process_name
+    _process_name = name
+
+
+def record(name, start_ns, end_ns, **args):
+    if not enabled():
+        return
+    item = {
+        "name": name,
+        "start_ns": start_ns,
+        "end_ns": end_ns,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "process": _process_name,
+        "args": args,
+    }
+    for listener in _listeners:
+        listener(item)
+    if _timeline_dir is not None:
+        _spans.append(item)
+
+
+@contextmanager
+def span(name, **args):
+    if not enabled():
+        yield args
+        return
+    start_ns = time.monotonic_ns()
+    try:
+        yield args
+    except Exception as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        record(name, start_ns, time.monotonic_ns(), **args)
+
+
+def traced(name=None, arg_names=()):
+    def decorate(fn):
+        span_name = name or fn.__name__
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            span_args = {}
+            if arg_names:
+                bound = signature.bind_partial(*args, **kwargs)
+                for arg_name in arg_names:
+                    value = bound.arguments.get(arg_name)
+                    if value is not None:
+                        span_args[arg_name] = value
+            with span(span_name, **span_args):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class CommandCounter:
+    def __init__(self, driver):
+        self.counts = {}
+        self.seconds = {}
+        self.driver = driver
+        self.execute = driver.execute
+        driver.execute = self.counted_execute
+
+    def counted_execute(self, driver_command, params=None):
+        start = time.perf_counter()
+        try:
+            return self.execute(driver_command, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                self.counts[driver_command] = self.counts.get(driver_command, 0) + 1
+                self.seconds[driver_command] = self.seconds.get(driver_command, 0) + elapsed
+
+    def total(self):
+        with _lock:
+            return sum(self.counts.values())
+
+    def detach(self):
+        self.driver.execute = self.execute
+
+
+def drain():
+    with _lock:
+        pending = _spans[:]
+        del _spans[: len(pending)]
+    return pending
+
+
+def flush():
+    if _timeline_dir is None:
+        return
+    pending = drain()
+    if not pending:
+        return
+    path = os.path.join(_timeline_dir, f"spans-{os.getpid()}.jsonl")
+    with open(path, "a") as f:
+        for item in pending:
+            f.write(json.dumps(item) + "\n")
+
+
+def load_spans(timeline_dir):
+    spans = []
+    for path in glob.glob(os.path.join(timeline_dir, "spans-*.jsonl")):
+        with open(path) as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    spans.sort(key=lambda item: item["start_ns"])
+    return spans
+
+
+def to_chrome_trace(spans, origin_ns):
+    events = []
+    named = set()
+    for item in spans:
+        if item["pid"] not in named:
+            named.add(item["pid"])
+            label = item["process"] or f"PID {item['pid']}"
+            events.append(
+                {"name": "process_name", "ph": "M", "pid": item["pid"], "args": {"name": label}}
+            )
+        events.append(
+            {
+                "name": item["name"],
+                "cat": "snkrs",
+                "ph": "X",
+                "ts": (item["start_ns"] - origin_ns) / 1000,
+                "dur": (item["end_ns"] - item["start_ns"]) / 1000,
+                "pid": item["pid"],
+                "tid": item["tid"],
+                "args": item["args"],
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_timeline(timeline_dir=None):
+    timeline_dir = timeline_dir or _timeline_dir
+    if timeline_dir is None:
+        return None
+    flush()
+    spans = load_spans(timeline_dir)
+    if not spans:
+        return None
+    origin_ns = spans[0]["start_ns"]
+    timeline = {
+        "origin_monotonic_ns": origin_ns,
+        "spans": [
+            dict(
+                item,
+                start=(item["start_ns"] - origin_ns) / 1e9,
+                duration=(item["end_ns"] - item["start_ns"]) / 1e9,
+            )
+            for item in spans
+        ],
+    }
+    json_path = os.path.join(timeline_dir, "timeline.json")
+    with open(json_path, "w") as f:
+        json.dump(timeline, f, indent=1)
+    trace_path = os.path.join(timeline_dir, "timeline.trace.json")
+    with open(trace_path, "w") as f:
+        json.dump(to_chrome_trace(spans, origin_ns), f)
+    LOGGER.info(f"Wrote timeline of {len(spans)} spans to {json_path} and {trace_path}")
+    return json_path
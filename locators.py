@@ -0,0 +1,163 @@
+# pylint: disable=W1201
+
+import logging
+
+from selenium.webdriver.support.ui import WebDriverWait
+
+import event_waits
+import instrumentation
+
+"""
+
+Compiled element locators.
+
+A locator narrows the candidates with a CSS selector and then matches their own text,
+instead of running an XPath over every node of the document on each poll. The lookup,
+the clickability check, the scroll and the click all happen inside one script, so a
+click costs a single WebDriver round trip once the element is ready (and a single
+round trip overall with the event wait engine), and a wait returns the element
+handle it found instead of making the caller look it up again.
+
+Every locator keeps the XPath it replaces. It is used by the "xpath" locator engine,
+and as a fallback in the same check: when the selector matches nothing, the XPath is
+tried in the same poll, so markup the selector does not cover is still found as soon as
+it appears. What only the XPath found comes back wrapped in a list.
+
+"""
+
+LOGGER = logging.getLogger()
+
+ACTIONS = ("present", "visible", "clickable", "click")
+
+LOCATE_CHECK = """
+var css = args[0], texts = args[1], contains = args[2], xpath = args[3], action = args[4];
+function visible(el) {
+  if (!el || !el.isConnected) return false;
+  var style = window.getComputedStyle(el);
+  if (style.visibility === "hidden" || style.display === "none") return false;
+  return !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+}
+function matches(el) {
+  if (!texts.length && !contains) return true;
+  var first = null;
+  for (var i = 0; i < el.childNodes.length; i++) {
+    var node = el.childNodes[i];
+    if (node.nodeType !== 3) continue;
+    if (texts.indexOf(node.nodeValue) >= 0) return true;
+    if (first === null) first = node.nodeValue;
+  }
+  return !!contains && first !== null && first.toLowerCase().indexOf(contains) >= 0;
+}
+function act(el) {
+  if (action === "present") return el;
+  if (!visible(el)) return null;
+  if (action === "visible") return el;
+  if (el.disabled) return null;
+  if (action === "clickable") return el;
+  el.scrollIntoView({block: "center"});
+  el.click();
+  return "clicked";
+}
+var el = null;
+var candidates = document.querySelectorAll(css);
+for (var i = 0; i < candidates.length; i++) {
+  if (matches(candidates[i])) { el = candidates[i]; break; }
+}
+if (el) return act(el);
+if (!xpath) return null;
+el = document.evaluate(
+  xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null
+).singleNodeValue;
+if (!el) return null;
+var result = act(el);
+return result ? [result] : null;
+"""
+
+LOCATE_SCRIPT = event_waits.polling_script(LOCATE_CHECK)
+
+
+class Locator:
+    def __init__(self, name, css, xpath, texts=(), contains=None):
+        self.name = name
+        self.css = css
+        self.xpath = xpath
+        self.texts = list(texts)
+        self.contains = contains.lower() if contains else None
+
+    def __repr__(self):
+        return f"Locator({self.name})"
+
+    def args(self, action):
+        return [self.css, self.texts, self.contains, self.xpath, action]
+
+
+def run(driver, duration, locator, action, event=False, frequency=0.1):
+    args = locator.args(action)
+    result = None
+    if event:
+        result = event_waits.wait_for_check(
+            driver, duration, LOCATE_CHECK, f"{action}: {locator.name}", *args
+        )
+    if result is None:
+        result = WebDriverWait(driver, duration, frequency).until(
+            lambda d: d.execute_script(LOCATE_SCRIPT, *args),
+            f"Timed out waiting for {action}: {locator.name}",
+        )
+    return result
+
+
+def locate(driver, duration, locator, action="clickable", event=False, frequency=0.1):
+    if action not in ACTIONS:
+        raise Exception("Unknown locator action: " + action)
+    with instrumentation.span("locate", locator=locator.name, action=action):
+        result = run(driver, duration, locator, action, event, frequency)
+    if isinstance(result, list):
+        # The selector does not cover this page's markup
+        LOGGER.warning(f"Only the XPath found {locator.name}, its selector needs updating")
+        return result[0]
+    return result
+
+
+def click(driver, duration, locator, event=False, frequency=0.1):
+    return locate(driver, duration, locator, "click", event, frequency)
+
+
+SIZE_CANDIDATES = "button, [role='button'], label, li, a, span"
+BUTTON_CANDIDATES = (
+    "button, [role='button'], a, span, input[type='button'], input[type='submit']"
+)
+
+
+def size_button(xpath, size_labels):
+    return Locator("size_button", SIZE_CANDIDATES, xpath, texts=size_labels)
+
+
+ADD_TO_BAG = Locator(
+    "add_to_bag",
+    BUTTON_CANDIDATES,
+    (
+        "//*["
+        "not(name()='script') and "
+        "contains(translate(text(),'ABCDEFGHIJKLMNOPQRSTUVWXYZ','abcdefghijklmnopqrstuvwxyz'), 'add to bag')"
+        "]"
+    ),
+    contains="add to bag",
+)
+CLOSE_MODAL = Locator(
+    "close_modal", "button[aria-label='Close']", "//button[@aria-label='Close']"
+)
+MEMBER_CHECKOUT = Locator(
+    "member_checkout",
+    "button[data-automation='member-checkout-button']",
+    "//button[@data-automation='member-checkout-button']",
+)
+SHIPPING_CHECKBOX = Locator(
+    "shipping_checkbox", "span.checkbox-checkmark", "//span[@class='checkbox-checkmark']"
+)
+SHIPPING_SUBMIT = Locator(
+    "shipping_submit", "button#shippingSubmit", "//button[@id='shippingSubmit']"
+)
+BILLING_SUBMIT = Locator(
+    "billing_submit", "button#billingSubmit", "//button[@id='billingSubmit']"
+)
+PAY_NOW = Locator("pay_now", "button#stored-cards-paynow", "//button[@id='stored-cards-paynow']")
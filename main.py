@@ -4,18 +4,44 @@
 import json
 import os
 import sys
-import pause
 import logging.config
 import multiprocessing as mp
+import functools
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from selenium import webdriver
-from dateutil import parser as date_parser
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support import expected_conditions as EC
-import pdb
+import browser_session
+import checkout
+import conditions
+import diagnostics
+import event_waits
+import instrumentation
+import locators
+import metrics
+import profiling
+import queue_logging
+import recorder
+import resource_blocking
+import retry
+import scheduler
+import tabs
+from driver_pool import DriverPool
+from plan import (
+    ARM_LEAD_TIME,
+    LOCATOR_ENGINES,
+    NIKE_CART_URL,
+    NIKE_HOME_URL,
+    STEP_TIMEOUTS as DEFAULT_STEP_TIMEOUTS,
+    WAIT_ENGINES,
+    compile_plan,
+    size_target,
+)
 
 
 logging.config.dictConfig(
@@ -23,9 +49,7 @@ logging.config.dictConfig(
         "version": 1,
         "disable_existing_loggers": False,
         "formatters": {
-            "default": {
-                "format": "%(asctime)s [PID %(process)d] [Thread %(thread)d] [%(levelname)s] [%(name)s] %(message)s"
-            }
+            "default": {"format": queue_logging.TEXT_FORMAT}
         },
         "handlers": {
             "console": {
@@ -45,12 +69,33 @@ logging.config.dictConfig(
     }
 )
 
-NIKE_HOME_URL = "https://www.nike.com/login"
-NIKE_CART_URL = "https://www.nike.com/au/cart"
+SIGNED_IN_XPATH = "//div[@class='pre-avatar']"
 LOGGER = logging.getLogger()
+WAIT_ENGINE = "polling"
+LOCATOR_ENGINE = "xpath"
+STEP_TIMEOUTS = dict(DEFAULT_STEP_TIMEOUTS)
+# Set in cart workers; shared by every worker of the pool and set once the cart target is met
+CART_STOP_EVENT = None
+HUMAN_REACTION_SLEEP = 3
+PAGE_TRANSITION_SLEEP = 1.5
+FIRE_SCRIPT = """
+var el = arguments[0];
+if (!el.isConnected || el.disabled) return false;
+el.scrollIntoView({block: "center"});
+el.click();
+return true;
+"""
 
 
-def generate_driver(webdriver_path, driver_type, page_load_timeout):
+@instrumentation.traced()
+def generate_driver(
+    webdriver_path,
+    driver_type,
+    page_load_timeout,
+    headless=False,
+    resource_policy=None,
+    profile_dir=None,
+):
     if webdriver_path is not None:
         executable_path = webdriver_path
     elif sys.platform == "darwin":
@@ -62,23 +107,102 @@ def generate_driver(webdriver_path, driver_type, page_load_timeout):
     else:
         raise Exception("Drivers for installed operating system not found.")
 
-    if driver_type == "firefox":
-        driver = webdriver.Firefox(executable_path=executable_path, log_path=os.devnull)
-    elif driver_type == "chrome":
-        driver = webdriver.Chrome(executable_path=executable_path)
-    else:
-        raise Exception("Only firefox and chrome drivers are supported.")
+    start = time.monotonic()
+    try:
+        if driver_type == "firefox":
+            options = webdriver.FirefoxOptions()
+            if headless:
+                options.add_argument("--headless")
+            if profile_dir is not None:
+                options.add_argument("-profile")
+                options.add_argument(profile_dir)
+            if resource_policy is not None:
+                resource_blocking.configure_options(options, driver_type, resource_policy)
+            driver = webdriver.Firefox(
+                executable_path=executable_path, options=options, log_path=os.devnull
+            )
+        elif driver_type == "chrome":
+            options = webdriver.ChromeOptions()
+            if headless:
+                options.add_argument("headless")
+            if profile_dir is not None:
+                options.add_argument("user-data-dir=" + profile_dir)
+            if resource_policy is not None:
+                resource_blocking.configure_options(options, driver_type, resource_policy)
+            driver = webdriver.Chrome(executable_path=executable_path, options=options)
+        else:
+            raise Exception("Only firefox and chrome drivers are supported.")
+    except Exception:
+        metrics.inc("driver_starts_total", driver_type=driver_type, outcome="error")
+        raise
+    metrics.inc("driver_starts_total", driver_type=driver_type, outcome="ok")
+    metrics.observe("driver_start_seconds", time.monotonic() - start, driver_type=driver_type)
+    metrics.count_commands(driver)
+    profiling.watch(driver)
 
     try:
         driver.set_page_load_timeout(page_load_timeout)
         driver.maximize_window()
     except Exception as e:
         LOGGER.exception("Error in driver setup: " + str(e))
+    if resource_policy is not None:
+        resource_blocking.apply(driver, resource_policy)
 
     return driver
 
 
+def generate_worker_driver(
+    webdriver_path,
+    driver_type,
+    page_load_timeout,
+    headless=False,
+    resource_policy=None,
+    profile_cache=None,
+):
+    # The cached profile is open in the main browser, so workers start from a copy
+    return generate_driver(
+        webdriver_path,
+        driver_type,
+        page_load_timeout,
+        headless=headless,
+        resource_policy=resource_policy,
+        profile_dir=profile_cache.copy() if profile_cache is not None else None,
+    )
+
+
+def set_wait_engine(wait_engine):
+    global WAIT_ENGINE
+    if wait_engine not in WAIT_ENGINES:
+        raise Exception("Wait engine must be one of: " + ", ".join(WAIT_ENGINES))
+    WAIT_ENGINE = wait_engine
+
+
+def set_locator_engine(locator_engine):
+    global LOCATOR_ENGINE
+    if locator_engine not in LOCATOR_ENGINES:
+        raise Exception("Locator engine must be one of: " + ", ".join(LOCATOR_ENGINES))
+    LOCATOR_ENGINE = locator_engine
+
+
+def set_step_timeouts(step_timeouts):
+    unknown = set(step_timeouts or {}) - set(DEFAULT_STEP_TIMEOUTS)
+    if unknown:
+        raise Exception("Unknown step timeouts: " + ", ".join(sorted(unknown)))
+    # In place and from the defaults: a plan's timeouts never outlive it
+    STEP_TIMEOUTS.clear()
+    STEP_TIMEOUTS.update(DEFAULT_STEP_TIMEOUTS)
+    STEP_TIMEOUTS.update(step_timeouts or {})
+
+
+def event_wait(driver, duration, condition, xpath, class_name):
+    if WAIT_ENGINE != "event" or not (xpath or class_name):
+        return None
+    return event_waits.wait(driver, duration, condition, xpath=xpath, class_name=class_name)
+
+
 def wait_until_clickable(driver, duration, xpath=None, class_name=None, frequency=0.1):
+    if event_wait(driver, duration, "clickable", xpath, class_name) is not None:
+        return
     if xpath:
         WebDriverWait(driver, duration, frequency).until(
             EC.element_to_be_clickable((By.XPATH, xpath))
@@ -89,7 +213,23 @@ def wait_until_clickable(driver, duration, xpath=None, class_name=None, frequenc
         )
 
 
+def wait_until_present(driver, duration, xpath=None, class_name=None, frequency=0.1):
+    if event_wait(driver, duration, "present", xpath, class_name) is not None:
+        return
+    if xpath:
+        WebDriverWait(driver, duration, frequency).until(
+            EC.presence_of_element_located((By.XPATH, xpath))
+        )
+    elif class_name:
+        WebDriverWait(driver, duration, frequency).until(
+            EC.presence_of_element_located((By.CLASS_NAME, class_name))
+        )
+
+
+@instrumentation.traced(arg_names=("xpath", "class_name"))
 def wait_until_visible(driver, duration, xpath=None, class_name=None, frequency=0.1):
+    if event_wait(driver, duration, "visible", xpath, class_name) is not None:
+        return
     if xpath:
         WebDriverWait(driver, duration, frequency).until(
             EC.visibility_of_element_located((By.XPATH, xpath))
@@ -100,7 +240,10 @@ def wait_until_visible(driver, duration, xpath=None, class_name=None, frequency=
         )
 
 
+@instrumentation.traced(arg_names=("xpath", "class_name"))
 def wait_until_invisible(driver, duration, xpath=None, class_name=None, frequency=0.1):
+    if event_wait(driver, duration, "invisible", xpath, class_name) is not None:
+        return
     if xpath:
         WebDriverWait(driver, duration, frequency).until(
             EC.invisibility_of_element_located((By.XPATH, xpath))
@@ -111,7 +254,15 @@ def wait_until_invisible(driver, duration, xpath=None, class_name=None, frequenc
         )
 
 
-def wait_and_click(driver, duration, xpath, frequency=0.1, click_attempts=6, click_sleep=1):
+@instrumentation.traced(arg_names=("xpath",))
+def wait_and_click(
+    driver, duration, xpath=None, frequency=0.1, click_attempts=6, click_sleep=1, locator=None
+):
+    if locator is not None:
+        if LOCATOR_ENGINE == "compiled":
+            locators.click(driver, duration, locator, WAIT_ENGINE == "event", frequency)
+            return
+        xpath = locator.xpath
     wait_until_clickable(driver, duration, xpath=xpath, frequency=frequency)
     for _ in range(click_attempts):
         try:
@@ -124,7 +275,31 @@ def wait_and_click(driver, duration, xpath, frequency=0.1, click_attempts=6, cli
         raise Exception("Failure in clicking.")
 
 
+def wait_for_condition(driver, name, check, *args, replaced_sleep=0):
+    timeout = STEP_TIMEOUTS[name]
+    start = time.monotonic()
+    with instrumentation.span("transition", condition=name, replaced_sleep=replaced_sleep):
+        result = None
+        if WAIT_ENGINE == "event":
+            result = event_waits.wait_for_check(driver, timeout, check, name, *args)
+        if result is None:
+            script = event_waits.polling_script(check)
+            result = WebDriverWait(driver, timeout, 0.1).until(
+                lambda d: d.execute_script(script, *args), f"Timed out waiting for {name}"
+            )
+    LOGGER.info(
+        f"Condition {name} met in {time.monotonic() - start:.3f}s"
+        + (f" (replaces a {replaced_sleep}s sleep)" if replaced_sleep else "")
+    )
+    return result
+
+
+@instrumentation.traced(arg_names=("xpath", "class_name"))
 def wait_and_switch_iframe(driver, duration, xpath=None, class_name=None, frequency=0.1):
+    frame = event_wait(driver, duration, "present", xpath, class_name)
+    if frame is not None:
+        driver.switch_to.frame(frame)
+        return
     if xpath:
         WebDriverWait(driver, duration, frequency).until(
             EC.frame_to_be_available_and_switch_to_it((By.XPATH, xpath))
@@ -135,6 +310,7 @@ def wait_and_switch_iframe(driver, duration, xpath=None, class_name=None, freque
         )
 
 
+@instrumentation.traced()
 def random_type(element, word, base_delay_ms, range_delay_ms):
     element.clear()
     for c in word:
@@ -143,248 +319,1024 @@ def random_type(element, word, base_delay_ms, range_delay_ms):
         time.sleep(delay_ms / 1000)
 
 
-def login_attempt(driver, username, password, page_load_timeout, human_reaction_sleep=3):
+@instrumentation.traced()
+def login_attempt(driver, username, password, page_load_timeout, home_url=NIKE_HOME_URL):
     try:
-        LOGGER.info("Requesting page: " + NIKE_HOME_URL)
-        driver.get(NIKE_HOME_URL)
+        LOGGER.info("Requesting page: " + home_url)
+        driver.get(home_url)
     except TimeoutException:
         LOGGER.info("Page load timed out but continuing anyway")
 
+    email_xpath = "//input[@name='emailAddress']"
+    password_xpath = "//input[@name='password']"
+    sign_in_xpath = "//input[@value='SIGN IN']"
+    dismiss_button = "//input[@value='Dismiss this error']"
+
     LOGGER.info("Waiting for login fields to become visible")
-    wait_until_visible(driver, page_load_timeout, xpath="//input[@name='emailAddress']")
-    time.sleep(human_reaction_sleep)
+    wait_until_visible(driver, page_load_timeout, xpath=email_xpath)
+    recorder.page(driver, "login")
+    wait_for_condition(
+        driver,
+        "login_form_ready",
+        conditions.LOGIN_FORM_READY,
+        email_xpath,
+        password_xpath,
+        replaced_sleep=HUMAN_REACTION_SLEEP,
+    )
 
     LOGGER.info("Entering username and password")
-    email_input = driver.find_element_by_xpath("//input[@name='emailAddress']")
+    email_input = driver.find_element_by_xpath(email_xpath)
     random_type(email_input, username, 100, 50)
 
-    password_input = driver.find_element_by_xpath("//input[@name='password']")
+    password_input = driver.find_element_by_xpath(password_xpath)
     random_type(password_input, password, 100, 50)
 
     LOGGER.info("Logging in")
-    driver.find_element_by_xpath("//input[@value='SIGN IN']").click()
+    driver.find_element_by_xpath(sign_in_xpath).click()
 
     while True:
-        try:
-            dismiss_button = "//input[@value='Dismiss this error']"
-            wait_until_visible(driver, page_load_timeout, xpath=dismiss_button)
-            time.sleep(human_reaction_sleep)
-            driver.find_element_by_xpath(dismiss_button).click()
-            time.sleep(human_reaction_sleep)
-            password_input = driver.find_element_by_xpath("//input[@name='password']")
-            random_type(password_input, password, 100, 50)
-            driver.find_element_by_xpath("//input[@value='SIGN IN']").click()
-        except TimeoutException:
-            LOGGER.info("No error message upon login")
+        outcome = wait_for_condition(
+            driver,
+            "login_outcome",
+            conditions.LOGIN_OUTCOME,
+            SIGNED_IN_XPATH,
+            dismiss_button,
+        )
+        if outcome == "success":
             break
+        LOGGER.info("Dismissing login error")
+        wait_and_click(driver, page_load_timeout, xpath=dismiss_button)
+        wait_for_condition(
+            driver,
+            "error_dismissed",
+            conditions.ERROR_DISMISSED,
+            dismiss_button,
+            replaced_sleep=HUMAN_REACTION_SLEEP,
+        )
+        password_input = driver.find_element_by_xpath(password_xpath)
+        random_type(password_input, password, 100, 50)
+        driver.find_element_by_xpath(sign_in_xpath).click()
 
-    wait_until_visible(driver, page_load_timeout, xpath="//div[@class='pre-avatar']")
     LOGGER.info("Successfully logged in")
 
 
-def login(driver, login_time, num_retries, username, password, page_load_timeout):
-    if login_time:
-        LOGGER.info("Waiting until login time: " + login_time)
-        pause.until(date_parser.parse(login_time))
+def login(
+    driver, login_time, num_retries, username, password, page_load_timeout, home_url=NIKE_HOME_URL
+):
+    scheduler.wait_until(login_time, "login time")
+    # Every attempt starts from the login page, whatever went wrong
+    with metrics.timed("phase_seconds", phase="login"):
+        retry.run(
+            retry.policy("login", num_retries),
+            lambda action: login_attempt(
+                driver, username, password, page_load_timeout, home_url=home_url
+            ),
+            failure="Failed to login.",
+            on_failure=diagnostics.hook(driver, "login"),
+        )
+
+
+def restore_session(driver, session, home_url=NIKE_HOME_URL):
+    browser_session.import_session(driver, session)
+    return signed_in(driver, home_url=home_url)
+
+
+def signed_in(driver, home_url=NIKE_HOME_URL):
+    try:
+        LOGGER.info("Requesting page: " + home_url)
+        driver.get(home_url)
+    except TimeoutException:
+        LOGGER.info("Page load timed out but continuing anyway")
+    try:
+        wait_until_visible(driver, STEP_TIMEOUTS["session_check"], xpath=SIGNED_IN_XPATH)
+        return True
+    except TimeoutException:
+        return False
 
-    for _ in range(num_retries):
+
+def login_or_restore(
+    driver,
+    session,
+    login_time,
+    num_retries,
+    username,
+    password,
+    page_load_timeout,
+    home_url=NIKE_HOME_URL,
+):
+    if session is not None:
         try:
-            login_attempt(driver, username, password, page_load_timeout)
-            break
+            if restore_session(driver, session, home_url=home_url):
+                LOGGER.info("Reusing the shared login session")
+                return
+            LOGGER.warning("Shared login session was rejected, logging in")
         except Exception as e:
-            LOGGER.exception("Failed to login: " + str(e))
-    else:
-        raise Exception("Failed to login.")
+            LOGGER.exception("Failed to restore shared login session: " + str(e))
+    login(driver, login_time, num_retries, username, password, page_load_timeout, home_url=home_url)
+
+
+# Labels, XPath and locator are built once per size and reused by every retry
+def get_size_xpath(shoe_gender, shoe_size):
+    return size_target(shoe_gender, str(shoe_size)).xpath
 
 
-def get_generic_size_label(shoe_gender, shoe_size):
-    trim0 = lambda n: int(n) if n % 1 == 0 else n
-    conversions = {shoe_gender: float(shoe_size)}
-    if shoe_gender == 'M':
-        conversions['W'] = float(shoe_size) + 1.5
-    elif shoe_gender == 'W':
-        conversions['M'] = float(shoe_size) - 1.5
-    size_label = f"M {trim0(conversions['M'])} / W {trim0(conversions['W'])}"
-    return size_label
+def get_size_locator(shoe_gender, shoe_size):
+    return size_target(shoe_gender, str(shoe_size)).locator
 
 
+@instrumentation.traced(arg_names=("shoe_gender", "shoe_size"))
 def add_to_cart_attempt(
-    driver,
-    shoe_gender,
-    shoe_size,
-    page_load_timeout,
-    page_transition_sleep=1.5,
-    confirmation_timeout=5,
+    driver, shoe_gender, shoe_size, page_load_timeout, confirmation_timeout=5, size_clicked=False
 ):
-    LOGGER.info("Waiting for size buttons to appear")
-    simple_size_label = f"US {shoe_size}"
-    generic_size_label = f"US {get_generic_size_label(shoe_gender, shoe_size)}"
-    wait_and_click(
-        driver,
-        page_load_timeout,
-        xpath=(
-            "//*["
-            "not(name()='script') and "
-            "(text()='{}' or text()='{}')"
-            "]".format(simple_size_label, generic_size_label)
-        ),
-    )
-    time.sleep(page_transition_sleep)
+    size_locator = get_size_locator(shoe_gender, shoe_size)
+    if not size_clicked:
+        LOGGER.info("Waiting for size buttons to appear")
+        with instrumentation.span("wait_for_sizes"):
+            wait_and_click(driver, page_load_timeout, locator=size_locator)
+        recorder.page(driver, "product")
+    try:
+        wait_for_condition(
+            driver,
+            "size_selected",
+            conditions.SIZE_SELECTED,
+            size_locator.xpath,
+            replaced_sleep=PAGE_TRANSITION_SLEEP,
+        )
+    except TimeoutException:
+        LOGGER.warning("Size selection was not confirmed, continuing anyway")
 
+    bag_count = driver.execute_script(event_waits.polling_script(conditions.BAG_COUNT))
     LOGGER.info("Waiting for add to bag button to become clickable")
-    wait_and_click(
-        driver,
-        page_load_timeout,
-        xpath=(
-            "//*["
-            "not(name()='script') and "
-            "contains(translate(text(),'ABCDEFGHIJKLMNOPQRSTUVWXYZ','abcdefghijklmnopqrstuvwxyz'), 'add to bag')"
-            "]"
-        ),
-    )
-    time.sleep(page_transition_sleep)
+    wait_and_click(driver, page_load_timeout, locator=locators.ADD_TO_BAG)
 
     LOGGER.info("Waiting for added to bag confirmation")
+    close_xpath = locators.CLOSE_MODAL.xpath
     try:
-        wait_and_click(driver, confirmation_timeout, xpath="//button[@aria-label='Close']")
+        wait_for_condition(
+            driver,
+            "added_to_bag",
+            conditions.ADDED_TO_BAG,
+            bag_count,
+            close_xpath,
+            replaced_sleep=PAGE_TRANSITION_SLEEP,
+        )
+        wait_and_click(driver, confirmation_timeout, locator=locators.CLOSE_MODAL)
     except Exception as e:
         LOGGER.warning("Confirmation failed: " + str(e))
 
 
-def add_to_cart(driver, url, release_time, num_retries, shoe_gender, shoe_size, page_load_timeout):
+@instrumentation.traced()
+def arm_add_to_cart(driver, url, size_locator):
+    try:
+        LOGGER.info("Arming on page: " + url)
+        driver.get(url)
+    except TimeoutException:
+        LOGGER.info("Page load timed out but continuing anyway")
+    return locate_size_button(driver, size_locator)
+
+
+def locate_size_button(driver, size_locator):
+    try:
+        if LOCATOR_ENGINE == "compiled":
+            # The wait hands back the element, no second lookup
+            return locators.locate(
+                driver, STEP_TIMEOUTS["arm"], size_locator, "present", WAIT_ENGINE == "event"
+            )
+        wait_until_present(driver, STEP_TIMEOUTS["arm"], xpath=size_locator.xpath)
+        return driver.find_element_by_xpath(size_locator.xpath)
+    except Exception as e:
+        LOGGER.warning("Size button not available before release, reloading at release: " + str(e))
+        return None
+
+
+def fire_armed_click(driver, element):
+    try:
+        return bool(driver.execute_script(FIRE_SCRIPT, element))
+    except Exception as e:
+        LOGGER.warning("Armed click failed: " + str(e))
+        return False
+
+
+def wait_for_release(driver, url, release_time, shoe_gender, shoe_size, arm_lead_time):
+    clock = scheduler.ReleaseClock(release_time)
+    armed = None
+    if arm_lead_time and clock.remaining(-arm_lead_time) > 0:
+        LOGGER.info(f"Waiting until {arm_lead_time}s before release to arm")
+        clock.sleep_until(-arm_lead_time)
+    if arm_lead_time:
+        armed = arm_add_to_cart(driver, url, get_size_locator(shoe_gender, shoe_size))
+
+    LOGGER.info("Waiting until release time")
+    with instrumentation.span("pause_until", reason="release time"):
+        skew = clock.sleep_until()
+    with instrumentation.span("release_fire", skew_ms=skew * 1000, armed=armed is not None):
+        size_clicked = armed is not None and fire_armed_click(driver, armed)
+    LOGGER.info(
+        f"Fired {shoe_gender} {shoe_size} at release with {skew * 1000:.3f} ms skew"
+        + (" (armed click)" if size_clicked else "")
+    )
+    if armed is None:
+        LOGGER.info("Requesting page: " + url)
+        driver.get(url)
+    return size_clicked
+
+
+def add_to_cart(
+    driver,
+    url,
+    release_time,
+    num_retries,
+    shoe_gender,
+    shoe_size,
+    page_load_timeout,
+    arm_lead_time=ARM_LEAD_TIME,
+    stop_event=None,
+):
     if release_time:
-        LOGGER.info("Waiting until release time: " + release_time)
-        pause.until(date_parser.parse(release_time))
+        size_clicked = wait_for_release(
+            driver, url, release_time, shoe_gender, shoe_size, arm_lead_time
+        )
+    else:
+        size_clicked = False
+        LOGGER.info("Requesting page: " + url)
+        driver.get(url)
+    # From the release (or the page load) to carted
+    with metrics.timed("phase_seconds", phase="add_to_cart"):
+        retry_add_to_cart(
+            driver,
+            url,
+            num_retries,
+            shoe_gender,
+            shoe_size,
+            page_load_timeout,
+            size_clicked=size_clicked,
+            stop_event=stop_event,
+            deadline=retry.release_deadline(release_time),
+        )
 
-    LOGGER.info("Requesting page: " + url)
-    driver.get(url)
-    for _ in range(num_retries):
-        try:
-            add_to_cart_attempt(driver, shoe_gender, shoe_size, page_load_timeout)
-            break
-        except Exception as e:
-            LOGGER.exception("Failed to select shoe size and add to cart: " + str(e))
+
+def retry_add_to_cart(
+    driver,
+    url,
+    num_retries,
+    shoe_gender,
+    shoe_size,
+    page_load_timeout,
+    size_clicked=False,
+    stop_event=None,
+    deadline=None,
+):
+    def attempt(action):
+        # Only the first attempt can rely on the armed click; a soft retry clicks again
+        add_to_cart_attempt(
+            driver,
+            shoe_gender,
+            shoe_size,
+            page_load_timeout,
+            size_clicked=size_clicked and action is None,
+        )
+
+    def recover(action):
+        if action == retry.RELOAD:
             LOGGER.info("Requesting page again: " + url)
-            driver.get(url)
+            try:
+                driver.get(url)
+            except TimeoutException:
+                LOGGER.info("Page load timed out but continuing anyway")
+
+    retry.run(
+        retry.policy("add_to_cart", num_retries),
+        attempt,
+        recover,
+        deadline=deadline,
+        stop_event=stop_event,
+        failure="Failed to select shoe size and add to cart.",
+        on_failure=diagnostics.hook(driver, "add_to_cart"),
+    )
+
+
+def run_tabbed_add_to_cart(
+    driver,
+    url,
+    release_time,
+    num_retries,
+    targets,
+    page_load_timeout,
+    arm_lead_time=ARM_LEAD_TIME,
+):
+    home_handle = driver.current_window_handle
+    handles = tabs.open_tabs(driver, len(targets))
+    tab_entries = list(zip(handles, targets))
+    size_clicked = {}
+    try:
+        if release_time:
+            clock = scheduler.ReleaseClock(release_time)
+            armed = {}
+            if arm_lead_time and clock.remaining(-arm_lead_time) > 0:
+                LOGGER.info(f"Waiting until {arm_lead_time}s before release to arm the tabs")
+                clock.sleep_until(-arm_lead_time)
+            if arm_lead_time:
+                LOGGER.info("Arming tabs on page: " + url)
+                tabs.navigate_all(driver, handles, url)
+                for handle, target in tab_entries:
+                    driver.switch_to.window(handle)
+                    armed[handle] = locate_size_button(driver, target.locator)
+
+            LOGGER.info("Waiting until release time")
+            with instrumentation.span("pause_until", reason="release time"):
+                skew = clock.sleep_until()
+            with instrumentation.span("release_fire", skew_ms=skew * 1000, tabs=len(handles)):
+                for handle, target in tab_entries:
+                    if armed.get(handle) is not None:
+                        driver.switch_to.window(handle)
+                        size_clicked[handle] = fire_armed_click(driver, armed[handle])
+            LOGGER.info(
+                f"Fired {sum(size_clicked.values())} of {len(handles)} armed tabs at release "
+                f"with {skew * 1000:.3f} ms skew"
+            )
+            tabs.navigate_all(
+                driver, [handle for handle in handles if armed.get(handle) is None], url
+            )
         else:
-            raise Exception("Failed to select shoe size and add to cart.")
+            LOGGER.info("Requesting page in every tab: " + url)
+            tabs.navigate_all(driver, handles, url)
 
+        failed = []
+        for handle, target in tab_entries:
+            driver.switch_to.window(handle)
+            try:
+                retry_add_to_cart(
+                    driver,
+                    url,
+                    num_retries,
+                    target.gender,
+                    target.size,
+                    page_load_timeout,
+                    size_clicked=size_clicked.get(handle, False),
+                )
+                LOGGER.info(f"Added to cart in tab: {target.label}")
+                metrics.inc("carted_sizes_total", size=target.label)
+            except Exception as e:
+                LOGGER.exception("Failed to add to cart in tab: " + str(e))
+                metrics.inc("cart_failures_total", size=target.label)
+                failed.append(target.label)
+        if failed:
+            LOGGER.warning("Failed to add to cart in tabs: " + ", ".join(failed))
+        # Checkout still gets the sizes that are in the cart
+        if len(failed) == len(tab_entries):
+            raise Exception("Failed to add any size to cart.")
+    finally:
+        tabs.close_tabs(driver, handles, home_handle)
 
-def checkout_cart_attempt(driver, num_retries, cvv, auto_confirm_purchase, page_load_timeout):
-    for _ in range(num_retries):
-        try:
+
+@instrumentation.traced()
+def checkout_cart_attempt(
+    driver,
+    num_retries,
+    cvv,
+    auto_confirm_purchase,
+    page_load_timeout,
+    cart_url=NIKE_CART_URL,
+    clear_cookies=True,
+    resume=True,
+):
+    spinner_xpath = "//div[@class='loading-spiner-holder']"
+    payment_iframe_xpath = "//iframe[@id='paymentIFrameEvo']"
+
+    def open_cart():
+        if clear_cookies:
             LOGGER.info("Clearing cookies")
             driver.delete_all_cookies()  # cart page can get stuck on empty
-            LOGGER.info("Requesting page: " + NIKE_CART_URL)
-            driver.get(NIKE_CART_URL)
-            wait_and_click(
-                driver,
-                page_load_timeout,
-                xpath="//button[@data-automation='member-checkout-button']",
-            )
-            break
+        LOGGER.info("Requesting page: " + cart_url)
+        try:
+            driver.get(cart_url)
         except TimeoutException:
             LOGGER.info("Page load timed out but continuing anyway")
-            raise Exception("Failed to start checkout.")
+        recorder.page(driver, "cart")
 
-    try:
-        wait_until_visible(driver, page_load_timeout, xpath="//div[@class='loading-spiner-holder']")
-    except Exception as e:
-        LOGGER.warning("Loading spinner was not visible: " + str(e))
-    wait_until_invisible(driver, page_load_timeout, xpath="//div[@class='loading-spiner-holder']")
-    wait_and_click(driver, page_load_timeout, xpath="//span[@class='checkbox-checkmark']")
-    wait_and_click(driver, page_load_timeout, xpath="//button[@id='shippingSubmit']")
-    wait_and_click(driver, page_load_timeout, xpath="//button[@id='billingSubmit']")
-
-    LOGGER.info("Entering CVV")
-    driver.switch_to_default_content()
-    wait_and_switch_iframe(driver, page_load_timeout, xpath="//iframe[@id='paymentIFrameEvo']")
-    wait_and_switch_iframe(driver, page_load_timeout, xpath="//iframe[@id='stored-cards-iframe']")
-    xpath = "//input[@name='cardCvv']"
-    wait_until_visible(driver, page_load_timeout, xpath=xpath)
-    cvv_input = driver.find_element_by_xpath(xpath)
-    random_type(cvv_input, cvv, 150, 100)
-    driver.switch_to.parent_frame()
+    def start_checkout():
+        wait_and_click(driver, page_load_timeout, locator=locators.MEMBER_CHECKOUT)
+
+    def wait_for_spinner():
+        try:
+            wait_until_visible(driver, page_load_timeout, xpath=spinner_xpath)
+        except Exception as e:
+            LOGGER.warning("Loading spinner was not visible: " + str(e))
+        wait_until_invisible(driver, page_load_timeout, xpath=spinner_xpath)
+        recorder.page(driver, "checkout")
+
+    def submit_shipping():
+        wait_and_click(driver, page_load_timeout, locator=locators.SHIPPING_CHECKBOX)
+        wait_and_click(driver, page_load_timeout, locator=locators.SHIPPING_SUBMIT)
+
+    def submit_billing():
+        wait_and_click(driver, page_load_timeout, locator=locators.BILLING_SUBMIT)
+
+    def enter_cvv():
+        LOGGER.info("Entering CVV")
+        driver.switch_to_default_content()
+        wait_and_switch_iframe(driver, page_load_timeout, xpath=payment_iframe_xpath)
+        wait_and_switch_iframe(
+            driver, page_load_timeout, xpath="//iframe[@id='stored-cards-iframe']"
+        )
+        xpath = "//input[@name='cardCvv']"
+        wait_until_visible(driver, page_load_timeout, xpath=xpath)
+        cvv_input = driver.find_element_by_xpath(xpath)
+        cvv_input.clear()  # a resumed step may find it half typed
+        random_type(cvv_input, cvv, 150, 100)
+        driver.switch_to.parent_frame()
+
+    def pay_now():
+        # Resumed steps start from the top document
+        driver.switch_to_default_content()
+        wait_and_switch_iframe(driver, page_load_timeout, xpath=payment_iframe_xpath)
+        wait_and_click(driver, page_load_timeout, locator=locators.PAY_NOW)
+
+    steps = [
+        ("cart", open_cart),
+        ("member_checkout", start_checkout),
+        ("spinner", wait_for_spinner),
+        ("shipping", submit_shipping),
+        ("billing", submit_billing),
+        ("payment", enter_cvv),
+    ]
     if auto_confirm_purchase:
-        wait_and_click(driver, page_load_timeout, xpath="//button[@id='stored-cards-paynow']")
+        steps.append(("pay_now", pay_now))
+    return checkout.run(
+        driver,
+        steps,
+        retry.policy("checkout", num_retries),
+        resume=resume,
+        failure="Failed to checkout.",
+    )
 
 
-def checkout_cart(driver, num_retries, cvv, auto_confirm_purchase, page_load_timeout):
+def checkout_cart(
+    driver,
+    num_retries,
+    cvv,
+    auto_confirm_purchase,
+    page_load_timeout,
+    cart_url=NIKE_CART_URL,
+    clear_cookies=True,
+    resume=True,
+):
     try:
-        checkout_cart_attempt(driver, num_retries, cvv, auto_confirm_purchase, page_load_timeout)
+        with metrics.timed("phase_seconds", phase="checkout"):
+            timings = checkout_cart_attempt(
+                driver,
+                num_retries,
+                cvv,
+                auto_confirm_purchase,
+                page_load_timeout,
+                cart_url=cart_url,
+                clear_cookies=clear_cookies,
+                resume=resume,
+            )
+        LOGGER.info(
+            "Checkout steps: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings)
+        )
+        return timings
     except Exception as e:
         LOGGER.exception("Failed to checkout cart: " + str(e))
         raise e
 
 
-def run_add_to_cart(
-    webdriver_path,
-    driver_type,
-    page_load_timeout,
-    num_retries,
+def configure_worker(plan):
+    set_wait_engine(plan.wait_engine)
+    set_locator_engine(plan.locator_engine)
+    set_step_timeouts(plan.step_timeouts)
+    retry.configure(plan.retry_policies, plan.release_deadline)
+    # Each one is also turned off: the daemon configures one plan after another.
+    # From the plan, not the environment: forkserver workers get the server's environment
+    if plan.timeline_dir:
+        instrumentation.enable(plan.timeline_dir, clear=False)
+    else:
+        instrumentation.disable()
+    if plan.record_dir:
+        recorder.enable(plan.record_dir)
+    else:
+        recorder.disable()
+    if plan.diagnostics_dir:
+        diagnostics.configure(
+            plan.diagnostics_dir, plan.diagnostics_max_captures, plan.diagnostics_budget
+        )
+    else:
+        diagnostics.stop()
+    profiling.configure(
+        plan.profiling_run_dir,
+        plan.profiling_cpu,
+        plan.profiling_sample_interval,
+        plan.profiling_tracemalloc,
+        plan.profiling_usage_interval,
+    )
+
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        LOGGER.warning("Failed to quit driver: " + str(e))
+
+
+def init_cart_worker(plan, log_queue=None, stop_event=None, metrics_queue=None):
+    global CART_STOP_EVENT
+    if log_queue is not None:
+        queue_logging.install(log_queue)
+        queue_logging.set_worker(mp.current_process().name)
+    if metrics_queue is not None:
+        metrics.install(metrics_queue)
+    CART_STOP_EVENT = stop_event
+    configure_worker(plan)
+
+
+def mp_context(plan):
+    # The log writer and the worker pool share it: queues only pass between the same kind
+    context = mp.get_context(plan.mp_start_method)
+    if plan.mp_start_method == "forkserver":
+        context.set_forkserver_preload(["__main__"])
+    return context
+
+
+def start_worker_pool(plan, log_queue=None, stop_event=None, metrics_queue=None):
+    return mp_context(plan).Pool(
+        len(plan.targets),
+        initializer=init_cart_worker,
+        initargs=(plan, log_queue, stop_event, metrics_queue),
+    )
+
+
+def run_add_to_cart(plan, target, session=None, stop_event=None):
+    instrumentation.set_process_name(f"worker {target.label}")
+    configure_worker(plan)
+    if stop_event is None:
+        stop_event = CART_STOP_EVENT
+    drivers = []
+    profile = profiling.start(f"worker {target.label}")
+
+    def attempt(action):
+        if drivers:
+            LOGGER.info("Browser was lost, starting a new driver")
+            quit_driver(drivers.pop())
+        queue_logging.set_context(size=target.label, phase="login")
+        driver = generate_worker_driver(
+            plan.webdriver_path,
+            plan.driver_type,
+            plan.page_load_timeout,
+            headless=plan.headless,
+            resource_policy=plan.resource_policy,
+            profile_cache=plan.profile_cache,
+        )
+        drivers.append(driver)
+        login_or_restore(
+            driver,
+            session,
+            plan.login_time,
+            plan.num_retries,
+            plan.username,
+            plan.password,
+            plan.page_load_timeout,
+            home_url=plan.home_url,
+        )
+        queue_logging.set_context(phase="add_to_cart")
+        add_to_cart(
+            driver,
+            plan.url,
+            plan.release_time,
+            plan.num_retries,
+            target.gender,
+            target.size,
+            plan.page_load_timeout,
+            arm_lead_time=plan.arm_lead_time,
+            stop_event=stop_event,
+        )
+
+    try:
+        retry.run(
+            retry.policy("worker", plan.num_retries),
+            attempt,
+            stop_event=stop_event,
+            failure=f"Failed to add {target.label} to cart.",
+        )
+        LOGGER.info(f"Added to cart: {target.label}")
+        metrics.inc("carted_sizes_total", size=target.label)
+    finally:
+        # Also when stopped early: the main process has moved on to checkout
+        for driver in drivers:
+            quit_driver(driver)
+        profiling.finish(profile)
+        retry.log_report()
+        instrumentation.flush()
+        recorder.flush()
+        diagnostics.stop()
+
+
+def run_cart_worker(cart_args):
+    plan, target, session = cart_args
+    try:
+        run_add_to_cart(plan, target, session)
+        return target.label, None
+    except Exception as e:
+        # Reported as text, some WebDriver exceptions cannot be unpickled
+        return target.label, f"{type(e).__name__}: {e}"
+
+
+def wait_for_cart_target(outcomes, cart_target, count, stop_event):
+    succeeded = []
+    failed = []
+    for label, error in outcomes:
+        if error is None:
+            LOGGER.info(f"Cart attempt succeeded: {label}")
+            succeeded.append(label)
+        else:
+            LOGGER.warning(f"Cart attempt failed: {label}: {error}")
+            metrics.inc("cart_failures_total", size=label)
+            failed.append(label)
+        if len(succeeded) >= cart_target:
+            break
+    remaining = count - len(succeeded) - len(failed)
+    if remaining:
+        LOGGER.info(f"Cart target of {cart_target} reached, stopping {remaining} attempts")
+    stop_event.set()
+    if not succeeded:
+        raise Exception("Failed to add any size to cart.")
+    return succeeded, failed
+
+
+def run_worker_pool_add_to_cart(worker_pool, cart_args, cart_target, stop_event):
+    # Outcomes arrive as each worker finishes, not once the slowest one has
+    outcomes = worker_pool.imap_unordered(run_cart_worker, cart_args)
+    return wait_for_cart_target(outcomes, cart_target, len(cart_args), stop_event)
+
+
+def run_threaded_add_to_cart(driver_pool, plan, cart_target):
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(len(plan.targets))
+    try:
+        futures = {
+            executor.submit(
+                run_pooled_add_to_cart,
+                driver_pool,
+                plan.url,
+                plan.release_time,
+                plan.num_retries,
+                target.gender,
+                target.size,
+                plan.page_load_timeout,
+                plan.arm_lead_time,
+                stop_event,
+            ): target.label
+            for target in plan.targets
+        }
+        outcomes = (
+            (futures[future], None if future.exception() is None else str(future.exception()))
+            for future in as_completed(futures)
+        )
+        return wait_for_cart_target(outcomes, cart_target, len(futures), stop_event)
+    finally:
+        # Stopped attempts finish their current step in the background; closing the
+        # driver pool waits for them to release their drivers
+        executor.shutdown(wait=False)
+
+
+def warm_up_driver(
+    driver,
+    session_handoff,
     login_time,
+    num_retries,
     username,
     password,
+    page_load_timeout,
+    home_url,
+    url,
+):
+    login_or_restore(
+        driver,
+        session_handoff.get(),
+        login_time,
+        num_retries,
+        username,
+        password,
+        page_load_timeout,
+        home_url=home_url,
+    )
+    try:
+        LOGGER.info("Parking pooled driver on: " + url)
+        driver.get(url)
+    except TimeoutException:
+        LOGGER.info("Page load timed out but continuing anyway")
+
+
+def run_pooled_add_to_cart(
+    driver_pool,
     url,
     release_time,
+    num_retries,
     shoe_gender,
     shoe_size,
+    page_load_timeout,
+    arm_lead_time=ARM_LEAD_TIME,
+    stop_event=None,
+):
+    queue_logging.set_context(size=f"{shoe_gender} {shoe_size}", phase="add_to_cart")
+    driver = driver_pool.acquire()
+    try:
+        add_to_cart(
+            driver,
+            url,
+            release_time,
+            num_retries,
+            shoe_gender,
+            shoe_size,
+            page_load_timeout,
+            arm_lead_time=arm_lead_time,
+            stop_event=stop_event,
+        )
+        LOGGER.info(f"Added to cart: {shoe_gender} {shoe_size}")
+        metrics.inc("carted_sizes_total", size=f"{shoe_gender} {shoe_size}")
+    finally:
+        driver_pool.release(driver)
+
+
+def http_cart_attempt(cart_client, product_id, target, stop_event=None):
+    if stop_event is not None and stop_event.is_set():
+        from async_engine import CartAttemptCancelled
+
+        raise CartAttemptCancelled(f"Stopped carting {target.label}")
+    cart_client.add_item(product_id, target.sku_id, target.size)
+    LOGGER.info(f"Added to cart over HTTP: {target.label}")
+    metrics.inc("carted_sizes_total", size=target.label)
+
+
+def run_http_add_to_cart(
+    driver,
+    release_time,
+    num_retries,
+    product_id,
+    targets,
+    cart_api_url=None,
+    cart_engine="process",
+    cart_target=None,
+    task_timeout=None,
+):
+    # Imported here, so the Selenium paths and their workers never load requests or asyncio
+    import async_engine
+    from cart_client import NIKE_CART_API_URL, CartClient
+
+    # Cookies are copied once; every size and retry shares the pooled keep-alive connection
+    with CartClient(
+        cart_api_url or NIKE_CART_API_URL, pool_maxsize=len(targets), max_retries=num_retries
+    ) as cart_client:
+        cart_client.sync_cookies(driver)
+        scheduler.wait_until(release_time, "release time")
+
+        if cart_engine == "asyncio":
+            attempts = [
+                (
+                    target.label,
+                    functools.partial(http_cart_attempt, cart_client, product_id, target),
+                )
+                for target in targets
+            ]
+            succeeded, _ = async_engine.run(attempts, cart_target or len(attempts), task_timeout)
+            if not succeeded:
+                raise Exception("Failed to add any size to cart over HTTP.")
+            return
+
+        stop_event = threading.Event()
+        executor = ThreadPoolExecutor(len(targets))
+        futures = {}
+        try:
+            futures = {
+                executor.submit(
+                    http_cart_attempt, cart_client, product_id, target, stop_event
+                ): target.label
+                for target in targets
+            }
+            outcomes = (
+                (futures[future], None if future.exception() is None else str(future.exception()))
+                for future in as_completed(futures)
+            )
+            return wait_for_cart_target(
+                outcomes, cart_target or len(futures), len(futures), stop_event
+            )
+        finally:
+            # Requests in flight finish before the client closes; the rest never start
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+def run_cart_phase(
+    plan, main_driver, session=None, driver_pool=None, worker_pool=None, stop_event=None
 ):
-    driver = generate_driver(webdriver_path, driver_type, page_load_timeout)
-    login(driver, login_time, num_retries, username, password, page_load_timeout)
-    add_to_cart(driver, url, release_time, num_retries, shoe_gender, shoe_size, page_load_timeout)
-    LOGGER.info(f"Added to cart: {shoe_gender} {shoe_size}")
-    driver.quit()
+    import async_engine
+    import resource_usage
+
+    queue_logging.set_context(phase="cart")
+    cart_args = [(plan, target, session) for target in plan.targets]
+    # TEST: run_add_to_cart(*cart_args[0])
+    with resource_usage.UsageSampler() as usage, instrumentation.span(
+        "cart_workers", cart_method=plan.cart_method, cart_engine=plan.cart_engine
+    ):
+        if plan.cart_method == "http":
+            run_http_add_to_cart(
+                main_driver,
+                plan.release_time,
+                plan.num_retries,
+                plan.product_id,
+                plan.targets,
+                plan.cart_api_url,
+                plan.cart_engine,
+                plan.cart_target,
+                plan.cart_task_timeout,
+            )
+        elif plan.cart_engine == "tabs":
+            # One tab per size in the logged-in main browser, so nothing to log in again
+            run_tabbed_add_to_cart(
+                main_driver,
+                plan.url,
+                plan.release_time,
+                plan.num_retries,
+                plan.targets,
+                plan.page_load_timeout,
+                plan.arm_lead_time,
+            )
+        elif plan.cart_engine == "asyncio":
+            attempts = [
+                (
+                    target.label,
+                    functools.partial(
+                        run_pooled_add_to_cart,
+                        driver_pool,
+                        plan.url,
+                        plan.release_time,
+                        plan.num_retries,
+                        target.gender,
+                        target.size,
+                        plan.page_load_timeout,
+                        plan.arm_lead_time,
+                    ),
+                )
+                for target in plan.targets
+            ]
+            succeeded, _ = async_engine.run(
+                attempts, plan.cart_target, plan.cart_task_timeout, plan.release_time
+            )
+            if not succeeded:
+                raise Exception("Failed to add any size to cart.")
+        elif driver_pool is not None:
+            # Pooled drivers live in this process, so the size workers are threads
+            run_threaded_add_to_cart(driver_pool, plan, plan.cart_target)
+        else:
+            run_worker_pool_add_to_cart(
+                worker_pool, cart_args, plan.cart_target, stop_event
+            )
+            worker_pool.close()
+    report = usage.report()
+    resource_usage.log_report(f"Cart phase ({plan.cart_method}, {plan.cart_engine})", report)
+    return report
 
 
 if __name__ == "__main__":
+    # Only the main process uses these; spawned workers never import them
+    import pdb
+
     config_path = sys.argv[1] if len(sys.argv) > 1 else "config.json"
     LOGGER.info("Loading config file: " + config_path)
     with open(config_path) as f:
         config = json.load(f)
 
-    mp_start_method = "spawn"  # https://pythonspeed.com/articles/python-multiprocessing/
-    driver_type = config['driver_type']
-    webdriver_path = config.get('webdriver_path', None)
-    username = config['username']
-    password = config['password']
-    login_time = config.get('login_time', None)
-    release_time = config.get('release_time', None)
-    url = config['url']
-    shoe_list = config['shoe_list']
-    cvv = config['cvv']
-    auto_confirm_purchase = config.get('auto_confirm_purchase', False)
-    num_retries = config.get('num_retries', 10)
-    page_load_timeout = config.get('page_load_timeout', 15)
+    # Validates everything up front; nothing below reads config again
+    plan = compile_plan(config)
+    LOGGER.info(f"Compiled {plan!r}")
+    profile_cache = plan.profile_cache
+    if profile_cache is not None:
+        if plan.profile_cache_invalidate:
+            profile_cache.invalidate()
+        profile_cache.prepare(plan.profile_cache_max_age_hours)
 
+    if plan.timeline_dir:
+        instrumentation.enable(plan.timeline_dir)
+        instrumentation.set_process_name("main")
+    configure_worker(plan)
+    # From here on every process logs through the writer process
+    log_writer = queue_logging.LogWriter(mp_context(plan), json_file=plan.log_json_file).start()
+    queue_logging.set_worker("main")
+    metrics_server = None
+    if plan.metrics_port is not None:
+        # Served until the process exits, so the final numbers can still be scraped
+        metrics_server = metrics.MetricsServer(
+            mp_context(plan), plan.metrics_host, plan.metrics_port
+        ).start()
+    profile = profiling.start("main")
+
+    driver_pool = None
+    worker_pool = None
+    cart_stop_event = None
+    session_handoff = browser_session.SessionHandoff()
     try:
-        main_driver = generate_driver(webdriver_path, driver_type, page_load_timeout)
-        login(main_driver, login_time, num_retries, username, password, page_load_timeout)
+        if (
+            plan.cart_method == "selenium"
+            and plan.cart_engine == "process"
+            and plan.driver_pool is None
+        ):
+            # Started now, so the workers finish importing while the main browser logs in
+            cart_stop_event = mp_context(plan).Event()
+            worker_pool = start_worker_pool(
+                plan,
+                log_writer.queue,
+                cart_stop_event,
+                metrics_server.queue if metrics_server is not None else None,
+            )
+        if (
+            plan.driver_pool is not None
+            and plan.cart_method == "selenium"
+            and plan.cart_engine != "tabs"
+        ):
+            driver_pool = DriverPool(
+                functools.partial(
+                    generate_worker_driver,
+                    plan.webdriver_path,
+                    plan.driver_type,
+                    plan.page_load_timeout,
+                    plan.headless,
+                    plan.resource_policy,
+                    profile_cache,
+                ),
+                size=plan.driver_pool.get('size', len(plan.targets)),
+                startup_concurrency=plan.driver_pool.get('startup_concurrency', 2),
+                health_check_interval=plan.driver_pool.get('health_check_interval', 30),
+                warm_up=functools.partial(
+                    warm_up_driver,
+                    session_handoff=session_handoff,
+                    login_time=plan.login_time,
+                    num_retries=plan.num_retries,
+                    username=plan.username,
+                    password=plan.password,
+                    page_load_timeout=plan.page_load_timeout,
+                    home_url=plan.home_url,
+                    url=plan.url,
+                ),
+            ).start()
 
-        cart_args = [
-            (
-                webdriver_path,
-                driver_type,
-                page_load_timeout,
-                num_retries,
-                login_time,
-                username,
-                password,
-                url,
-                release_time,
-                shoe_entry['gender'],
-                shoe_entry['size'],
+        queue_logging.set_context(phase="login")
+        main_driver = generate_driver(
+            plan.webdriver_path,
+            plan.driver_type,
+            plan.page_load_timeout,
+            plan.headless,
+            plan.resource_policy,
+            profile_dir=profile_cache.path if profile_cache is not None else None,
+        )
+        if profile_cache is not None and signed_in(main_driver, home_url=plan.home_url):
+            LOGGER.info("Signed in from the cached profile")
+        else:
+            login(
+                main_driver,
+                plan.login_time,
+                plan.num_retries,
+                plan.username,
+                plan.password,
+                plan.page_load_timeout,
+                home_url=plan.home_url,
             )
-            for shoe_entry in shoe_list
-        ]
-        # TEST: run_add_to_cart(*cart_args[0])
-        with mp.Pool(len(cart_args)) as pool:
-            pool.starmap(run_add_to_cart, cart_args)
+        session = browser_session.export_session(main_driver) if plan.share_session else None
+        session_handoff.publish(session)
 
-        checkout_cart(main_driver, num_retries, cvv, auto_confirm_purchase, page_load_timeout)
+        run_cart_phase(plan, main_driver, session, driver_pool, worker_pool, cart_stop_event)
+        if driver_pool is not None:
+            driver_pool.close()
+
+        # Clearing cookies would sign the cached profile out for the next run
+        queue_logging.set_context(phase="checkout")
+        checkout_cart(
+            main_driver,
+            plan.num_retries,
+            plan.cvv,
+            plan.auto_confirm_purchase,
+            plan.page_load_timeout,
+            plan.cart_url,
+            clear_cookies=profile_cache is None,
+            resume=plan.checkout_resume,
+        )
         LOGGER.info("Checked out.")
     except Exception as e:
         LOGGER.exception("Failed run: " + str(e))
     finally:
+        if worker_pool is not None:
+            cart_stop_event.set()
+            worker_pool.terminate()
+        if driver_pool is not None:
+            if not session_handoff.ready.is_set():
+                session_handoff.publish(None)  # unblock warm ups still waiting on the main login
+            driver_pool.close()
+        profiling.finish(profile)
+        profiling.write_summary()
+        retry.log_report()
+        instrumentation.write_timeline()
+        recorder.flush()
+        diagnostics.stop()
+        log_writer.stop()
         print("Enter exit() to exit.")
         pdb.set_trace()
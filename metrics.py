@@ -0,0 +1,251 @@
+# pylint: disable=W1201
+
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+
+Live metrics in the Prometheus text format.
+
+With `"metrics_port": 9100` in the config, the main process serves
+http://127.0.0.1:9100/metrics for the whole run. It has counters and histograms for
+driver starts, phase and checkout step latency, WebDriver commands, retries and carted
+sizes, plus the memory and CPU of every process the bot started. Pool workers do not
+serve anything: they put each update on a queue, and a thread in the main process
+applies it. The endpoint therefore covers every worker.
+
+Nothing is recorded unless a server was started in this process or a worker was given
+its queue, so the calls cost nothing in a run without metrics.
+
+"""
+
+LOGGER = logging.getLogger()
+
+PREFIX = "snkrs_"
+# Upper bounds in seconds, from a WebDriver round trip to a slow page load
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS = {
+    "driver_starts_total": ("counter", "Browsers started, by driver type and outcome"),
+    "driver_start_seconds": ("histogram", "Time to start a browser"),
+    "phase_seconds": ("histogram", "Time spent in login, add to cart and checkout"),
+    "checkout_step_seconds": ("histogram", "Time spent in each completed checkout step"),
+    "webdriver_commands_total": ("counter", "WebDriver commands sent, by command"),
+    "retries_total": ("counter", "Failed attempts, by phase and the action taken"),
+    "diagnostics_capture_seconds": ("histogram", "Time spent capturing diagnostics of a failure"),
+    "carted_sizes_total": ("counter", "Sizes added to cart"),
+    "cart_failures_total": ("counter", "Sizes that could not be added to cart"),
+    "process_resident_memory_bytes": ("gauge", "Resident memory of each process of the run"),
+    "process_cpu_seconds": ("gauge", "CPU time used so far by each process of the run"),
+    "processes": ("gauge", "Processes in the run: the bot, its workers, drivers and browsers"),
+}
+
+_registry = None
+_queue = None
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.histograms = {}
+
+    def apply(self, kind, name, value, labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            if kind == "inc":
+                self.values[key] = self.values.get(key, 0) + value
+            elif kind == "set":
+                self.values[key] = value
+            elif kind == "observe":
+                self.histograms.setdefault(key, Histogram()).observe(value)
+
+    def clear_gauge(self, name):
+        with self.lock:
+            for key in [key for key in self.values if key[0] == name]:
+                del self.values[key]
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in METRICS.items():
+                lines.append(f"# HELP {PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                if kind != "histogram":
+                    for (metric, labels), value in sorted(self.values.items()):
+                        if metric == name:
+                            lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+                    continue
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        bucket = format_labels(labels, [("le", bound)])
+                        lines.append(f"{PREFIX}{name}_bucket{bucket} {count}")
+                    bucket = format_labels(labels, [("le", "+Inf")])
+                    lines.append(f"{PREFIX}{name}_bucket{bucket} {histogram.count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def enabled():
+    return _registry is not None or _queue is not None
+
+
+def record(kind, name, value, labels):
+    if _registry is not None:
+        _registry.apply(kind, name, value, labels)
+    elif _queue is not None:
+        try:
+            _queue.put_nowait((kind, name, value, labels))
+        except queue.Full:
+            pass
+
+
+def inc(name, amount=1, **labels):
+    record("inc", name, amount, labels)
+
+
+def observe(name, value, **labels):
+    record("observe", name, value, labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    if not enabled():
+        yield
+        return
+    start = time.monotonic()
+    yield
+    observe(name, time.monotonic() - start, **labels)
+
+
+def install(metrics_queue):
+    global _registry, _queue
+    # A forked worker inherits the main process's registry; its updates belong on the queue
+    _registry = None
+    _queue = metrics_queue
+
+
+def count_commands(driver):
+    if not enabled():
+        return
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        inc("webdriver_commands_total", command=driver_command)
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        self.server.metrics_server.sample_processes()
+        body = self.server.metrics_server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        LOGGER.debug("Metrics: " + format % args)
+
+
+class MetricsServer:
+    def __init__(self, context, host="127.0.0.1", port=9100):
+        self.registry = Registry()
+        self.queue = context.Queue()
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics_server = self
+        self.threads = []
+        self.stopped = threading.Event()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        global _registry
+        _registry = self.registry
+        for target in (self.httpd.serve_forever, self.collect):
+            thread = threading.Thread(target=target, name="metrics", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        LOGGER.info("Serving metrics on " + self.url)
+        return self
+
+    def collect(self):
+        while not self.stopped.is_set():
+            try:
+                kind, name, value, labels = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            self.registry.apply(kind, name, value, labels)
+
+    def sample_processes(self):
+        # Sampled on scrape, so an idle endpoint costs nothing
+        import resource_usage
+
+        if resource_usage.psutil is None:
+            return
+        self.registry.clear_gauge("process_resident_memory_bytes")
+        self.registry.clear_gauge("process_cpu_seconds")
+        processes = 0
+        for process in resource_usage.process_tree(os.getpid()):
+            try:
+                labels = {"pid": process.pid, "name": process.name()}
+                cpu = process.cpu_times()
+                self.registry.apply(
+                    "set", "process_resident_memory_bytes", process.memory_info().rss, labels
+                )
+                self.registry.apply("set", "process_cpu_seconds", cpu.user + cpu.system, labels)
+                processes += 1
+            except (resource_usage.psutil.NoSuchProcess, resource_usage.psutil.AccessDenied):
+                continue
+        self.registry.apply("set", "processes", processes, {})
+
+    def stop(self):
+        global _registry
+        self.stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        _registry = None
@@ -0,0 +1,589 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+"""
+
+Local stand-in for the login, launch, cart and checkout pages that main.py drives.
+
+Every page carries the same DOM hooks the bot waits on, so the whole pipeline can be
+run (and timed) offline. Server response times and in-page transitions are driven by
+the `latencies` table and random failures by the `failure_rates` table. A latency is
+either a number of seconds, a `[min, max]` range, or `{"samples": [...]}` to draw from,
+which is how `--replay` serves the timing profile of recorded runs (recorder.py).
+
+"""
+
+LOGGER = logging.getLogger()
+
+DEFAULT_LATENCIES = {
+    # Server side: delay before the response is written
+    "page": 0.05,
+    "api": 0.05,
+    "asset": 0.02,
+    # In page: delay before the next DOM state appears
+    "login_submit": 0.3,
+    "size_buttons": 0.2,
+    "add_to_bag": 0.3,
+    "checkout_spinner": 0.5,
+    "shipping": 0.2,
+    "billing": 0.2,
+    "payment_iframe": 0.2,
+}
+
+DEFAULT_FAILURE_RATES = {
+    "page": 0.0,  # HTTP 500 instead of a page
+    "login_error": 0.0,  # "Dismiss this error" banner after SIGN IN
+    "add_to_bag": 0.0,  # add to bag silently does nothing
+    "cart_api": 0.0,  # HTTP 503 from the cart API
+    # Checkout steps
+    "checkout_page": 0.0,  # member checkout does not leave the cart page
+    "checkout_spinner": 0.0,  # the loading spinner never clears
+    "shipping_submit": 0.0,  # Save & Continue does nothing
+    "billing_submit": 0.0,  # Continue to Payment does nothing
+}
+
+DEFAULT_PRODUCT_SLUG = "air-max-mock"
+
+# Heavy resources on the launch and cart pages: path -> (content type, size in bytes)
+ASSETS = {
+    "/assets/hero-1.jpg": ("image/jpeg", 400_000),
+    "/assets/hero-2.jpg": ("image/jpeg", 400_000),
+    "/assets/hero-3.jpg": ("image/jpeg", 400_000),
+    "/assets/thumb.png": ("image/png", 60_000),
+    "/assets/promo.mp4": ("video/mp4", 2_000_000),
+    "/assets/brand.woff2": ("font/woff2", 120_000),
+    "/tracking/beacon.js": ("application/javascript", 80_000),
+}
+
+
+def draw(delay):
+    if isinstance(delay, dict):
+        return random.choice(delay["samples"])
+    if isinstance(delay, (list, tuple)):
+        return random.uniform(*delay)
+    return delay
+
+
+def size_range(start=3.5, stop=18, step=0.5):
+    sizes = []
+    size = start
+    while size <= stop:
+        sizes.append(size)
+        size += step
+    return sizes
+
+
+def trim0(n):
+    return int(n) if n % 1 == 0 else n
+
+
+def size_labels():
+    return [f"US M {trim0(m)} / W {trim0(m + 1.5)}" for m in size_range()]
+
+
+PAGE_HEAD = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>
+  .hidden {{ display: none; }}
+  .modal {{ position: fixed; top: 20%; left: 30%; background: #fff; border: 1px solid #000; padding: 2em; }}
+  .size.selected {{ outline: 2px solid #000; }}
+</style>
+<script>
+  const CONFIG = {config};
+  function later(name, fn) {{ setTimeout(fn, (CONFIG.latencies[name] || 0) * 1000); }}
+  function fails(name) {{
+    const index = CONFIG.fail_once.indexOf(name);
+    if (index >= 0) {{
+      // An injected failure happens once, then the server forgets it
+      CONFIG.fail_once.splice(index, 1);
+      fetch("/api/failed", {{method: "POST", body: name}});
+      return true;
+    }}
+    return Math.random() < (CONFIG.failure_rates[name] || 0);
+  }}
+  function show(id) {{ document.getElementById(id).classList.remove("hidden"); }}
+  function hide(id) {{ document.getElementById(id).classList.add("hidden"); }}
+</script>
+</head><body>
+"""
+
+PAGE_TAIL = "</body></html>\n"
+
+# The tracker is served from a second host name so it can be host-blocked
+ASSETS_HTML = """
+<style>
+  @font-face {{ font-family: Brand; src: url(/assets/brand.woff2) format("woff2"); }}
+  body {{ font-family: Brand, sans-serif; }}
+</style>
+<img src="/assets/hero-1.jpg" alt=""><img src="/assets/hero-2.jpg" alt="">
+<img src="/assets/hero-3.jpg" alt=""><img src="/assets/thumb.png" alt="">
+<video src="/assets/promo.mp4" preload="auto" muted autoplay></video>
+<script async src="{tracker_url}/tracking/beacon.js"></script>
+"""
+
+LOGIN_BODY = """
+<form onsubmit="return false">
+  <input name="emailAddress" type="email">
+  <input name="password" type="password">
+  <input type="button" value="SIGN IN" onclick="signIn()">
+</form>
+<div id="login-error" class="hidden">
+  <p>Your email or password was entered incorrectly.</p>
+  <input type="button" value="Dismiss this error" onclick="hide('login-error')">
+</div>
+<div id="account" class="{account_class}"><div class="pre-avatar">JD</div></div>
+<script>
+  function signIn() {
+    later("login_submit", function () {
+      if (fails("login_error")) { show("login-error"); return; }
+      document.cookie = "mock_session=1; path=/; max-age=86400";
+      show("account");
+    });
+  }
+</script>
+"""
+
+PRODUCT_BODY = """
+<h1>{slug}</h1>
+<div id="sizes"></div>
+<button id="add-to-bag" type="button" onclick="addToBag()">Add to Bag</button>
+<span class="bag-count">0</span>
+<div id="added" class="modal hidden">
+  <p>Added to bag</p>
+  <button type="button" aria-label="Close" onclick="hide('added')">&times;</button>
+</div>
+<script>
+  let selected = null;
+  // Before a simulated release the size buttons are shown but disabled
+  const releaseDelay = CONFIG.release_at ? Math.max(0, CONFIG.release_at * 1000 - Date.now()) : 0;
+  later("size_buttons", function () {{
+    const sizes = document.getElementById("sizes");
+    for (const label of {labels}) {{
+      const button = document.createElement("button");
+      button.type = "button";
+      button.className = "size";
+      button.disabled = releaseDelay > 0;
+      button.textContent = label;
+      button.onclick = function () {{
+        for (const other of sizes.children) other.classList.remove("selected");
+        button.classList.add("selected");
+        selected = label;
+      }};
+      sizes.appendChild(button);
+    }}
+  }});
+  if (releaseDelay > 0) {{
+    setTimeout(function () {{
+      for (const button of document.querySelectorAll("#sizes button")) button.disabled = false;
+    }}, releaseDelay);
+  }}
+  function addToBag() {{
+    if (selected === null) return;
+    later("add_to_bag", function () {{
+      if (fails("add_to_bag")) return;
+      fetch("/api/cart", {{method: "POST", body: JSON.stringify({{size: selected}})}})
+        .then(function (response) {{ return response.json(); }})
+        .then(function (cart) {{
+          document.querySelector(".bag-count").textContent = cart.items.length;
+          show("added");
+        }});
+    }});
+  }}
+</script>
+"""
+
+CART_BODY = """
+<h1>Bag</h1>
+<ul>{items}</ul>
+<button type="button" data-automation="member-checkout-button"
+        onclick="if (!fails('checkout_page')) location.href='/checkout'">Member Checkout</button>
+"""
+
+CHECKOUT_BODY = """
+<div class="loading-spiner-holder">Loading...</div>
+<div id="shipping" class="hidden">
+  <label><span class="checkbox-checkmark"></span> Use saved address</label>
+  <button id="shippingSubmit" type="button" onclick="toBilling()">Save &amp; Continue</button>
+</div>
+<div id="billing" class="hidden">
+  <button id="billingSubmit" type="button" onclick="toPayment()">Continue to Payment</button>
+</div>
+<div id="payment"></div>
+<script>
+  later("checkout_spinner", function () {
+    if (fails("checkout_spinner")) return;
+    document.querySelector(".loading-spiner-holder").style.display = "none";
+    show("shipping");
+  });
+  function toBilling() {
+    if (fails("shipping_submit")) return;
+    later("shipping", function () { hide("shipping"); show("billing"); });
+  }
+  function toPayment() {
+    if (fails("billing_submit")) return;
+    later("billing", function () {
+      hide("billing");
+      later("payment_iframe", function () {
+        const frame = document.createElement("iframe");
+        frame.id = "paymentIFrameEvo";
+        frame.src = "/payment";
+        document.getElementById("payment").appendChild(frame);
+      });
+    });
+  }
+</script>
+"""
+
+PAYMENT_BODY = """
+<iframe id="stored-cards-iframe" src="/stored-cards"></iframe>
+<button id="stored-cards-paynow" type="button" onclick="payNow()">Place Order</button>
+<p id="placed" class="hidden">Order placed</p>
+<script>
+  function payNow() {
+    fetch("/api/order", {method: "POST"}).then(function () { show("placed"); });
+  }
+</script>
+"""
+
+STORED_CARDS_BODY = """
+<input name="cardCvv" type="password" autocomplete="off">
+"""
+
+
+class MockStorefront:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latencies=None,
+        failure_rates=None,
+        product_slug=DEFAULT_PRODUCT_SLUG,
+        release_at=None,
+    ):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.failure_rates = dict(DEFAULT_FAILURE_RATES, **(failure_rates or {}))
+        self.product_slug = product_slug
+        self.release_at = release_at
+        self.fail_once = []
+        self.lock = threading.Lock()
+        self.cart = []
+        self.orders = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.asset_requests = 0
+        self.connections = 0
+        self.httpd = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.storefront = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def tracker_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{'localhost' if host != 'localhost' else '127.0.0.1'}:{port}"
+
+    @property
+    def login_url(self):
+        return self.base_url + "/login"
+
+    @property
+    def product_url(self):
+        return self.base_url + "/launch/t/" + self.product_slug
+
+    @property
+    def cart_url(self):
+        return self.base_url + "/cart"
+
+    @property
+    def cart_api_url(self):
+        return self.base_url + "/services/jcartService"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        LOGGER.info("Mock storefront listening on " + self.base_url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self.lock:
+            self.cart = []
+            self.orders = 0
+            self.requests = 0
+            self.bytes_sent = 0
+            self.asset_requests = 0
+            self.connections = 0
+            self.fail_once = []
+
+    def inject_failure(self, name):
+        # The next page that reaches `name` fails there, once
+        with self.lock:
+            self.fail_once.append(name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "cart": list(self.cart),
+                "orders": self.orders,
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "asset_requests": self.asset_requests,
+                "connections": self.connections,
+                "fail_once": list(self.fail_once),
+            }
+
+    def sleep(self, name):
+        delay = draw(self.latencies.get(name, 0))
+        if delay > 0:
+            time.sleep(delay)
+
+    def fails(self, name):
+        return random.random() < self.failure_rates.get(name, 0)
+
+    def render(self, title, body, assets=False):
+        page_config = {
+            # In-page delays are drawn once per page load
+            "latencies": {name: draw(delay) for name, delay in self.latencies.items()},
+            "failure_rates": self.failure_rates,
+            "fail_once": list(self.fail_once),
+            "release_at": self.release_at,
+        }
+        if assets:
+            body = ASSETS_HTML.format(tracker_url=self.tracker_url) + body
+        return PAGE_HEAD.format(title=title, config=json.dumps(page_config)) + body + PAGE_TAIL
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY keep-alive
+    # connections stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    @property
+    def storefront(self):
+        return self.server.storefront
+
+    def setup(self):
+        super().setup()
+        with self.storefront.lock:
+            self.storefront.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        LOGGER.debug("Mock storefront: " + format % args)
+
+    def send_body(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        self.send_bytes(status, body.encode("utf-8"), content_type, headers)
+
+    def send_bytes(self, status, data, content_type, headers=None, cache_control="no-store"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", cache_control)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.storefront.lock:
+            self.storefront.requests += 1
+            self.storefront.bytes_sent += len(data)
+
+    def send_json(self, payload, status=200):
+        self.send_body(status, json.dumps(payload), content_type="application/json")
+
+    def signed_in(self):
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        return "mock_session" in cookies and cookies["mock_session"].value == "1"
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        storefront = self.storefront
+        path = urlparse(self.path).path
+
+        if path == "/__stats":
+            self.send_json(storefront.stats())
+            return
+        if path == "/services/jcartService":
+            self.cart_api()
+            return
+        if path in ASSETS:
+            self.asset(path)
+            return
+
+        storefront.sleep("page")
+        if storefront.fails("page"):
+            self.send_body(500, storefront.render("Error", "<h1>Something went wrong</h1>"))
+            return
+
+        if path == "/login":
+            # A returning session lands on the page already signed in
+            body = LOGIN_BODY.replace("{account_class}", "" if self.signed_in() else "hidden")
+            self.send_body(200, storefront.render("Login", body))
+        elif path == "/robots.txt":
+            self.send_body(200, "User-agent: *\n", content_type="text/plain")
+        elif path == "/launch/t/" + storefront.product_slug:
+            body = PRODUCT_BODY.format(slug=storefront.product_slug, labels=json.dumps(size_labels()))
+            self.send_body(200, storefront.render(storefront.product_slug, body, assets=True))
+        elif path == "/cart":
+            with storefront.lock:
+                items = "".join(f"<li>{size}</li>" for size in storefront.cart)
+            body = CART_BODY.format(items=items)
+            self.send_body(200, storefront.render("Bag", body, assets=True))
+        elif path == "/checkout":
+            self.send_body(200, storefront.render("Checkout", CHECKOUT_BODY))
+        elif path == "/payment":
+            self.send_body(200, storefront.render("Payment", PAYMENT_BODY))
+        elif path == "/stored-cards":
+            self.send_body(200, storefront.render("Stored cards", STORED_CARDS_BODY))
+        else:
+            self.send_body(404, storefront.render("Not found", "<h1>Not found</h1>"))
+
+    def asset(self, path):
+        storefront = self.storefront
+        storefront.sleep("asset")
+        content_type, size = ASSETS[path]
+        with storefront.lock:
+            storefront.asset_requests += 1
+        # Cacheable, like the real static assets
+        self.send_bytes(200, bytes(size), content_type, cache_control="public, max-age=86400")
+
+    def cart_api(self):
+        storefront = self.storefront
+        storefront.sleep("api")
+        if storefront.fails("cart_api"):
+            self.send_json({"status": "failure"}, status=503)
+            return
+        query = parse_qs(urlparse(self.path).query)
+        size = query.get("skuAndSize", [""])[0].partition(":")[2]
+        with storefront.lock:
+            storefront.cart.append(size)
+            items = list(storefront.cart)
+        self.send_json({"status": "success", "items": items})
+
+    def do_POST(self):
+        storefront = self.storefront
+        path = urlparse(self.path).path
+        body = self.read_body()
+
+        if path == "/__reset":
+            storefront.reset()
+            self.send_json({})
+            return
+
+        storefront.sleep("api")
+        if path == "/api/cart":
+            size = json.loads(body or b"{}").get("size")
+            with storefront.lock:
+                storefront.cart.append(size)
+                items = list(storefront.cart)
+            self.send_json({"items": items})
+        elif path == "/api/failed":
+            name = body.decode("utf-8")
+            with storefront.lock:
+                if name in storefront.fail_once:
+                    storefront.fail_once.remove(name)
+            self.send_json({})
+        elif path == "/api/order":
+            with storefront.lock:
+                storefront.orders += 1
+            self.send_json({"status": "placed"})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+
+def parse_overrides(values, cast=float):
+    overrides = {}
+    for value in values or []:
+        name, _, number = value.partition("=")
+        if "," in number:
+            overrides[name] = [cast(n) for n in number.split(",")]
+        else:
+            overrides[name] = cast(number)
+    return overrides
+
+
+def add_storefront_arguments(parser):
+    parser.add_argument(
+        "--latency",
+        action="append",
+        metavar="NAME=SECONDS[,MAX]",
+        help="Override a latency; " + ", ".join(DEFAULT_LATENCIES),
+    )
+    parser.add_argument(
+        "--failure-rate",
+        action="append",
+        metavar="NAME=PROBABILITY",
+        help="Override a failure rate; " + ", ".join(DEFAULT_FAILURE_RATES),
+    )
+    parser.add_argument(
+        "--replay",
+        action="append",
+        metavar="RECORDING",
+        help="Draw latencies from recorded runs (files or directories); --latency still wins",
+    )
+
+
+def storefront_from_args(args, **kwargs):
+    latencies = {}
+    if args.replay:
+        import recorder
+
+        latencies = recorder.replay_latencies(args.replay)
+    return MockStorefront(
+        latencies=dict(latencies, **parse_overrides(args.latency)),
+        failure_rates=parse_overrides(args.failure_rate),
+        **kwargs,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--release-in", type=float, default=None, help="Simulate a release this many seconds out"
+    )
+    add_storefront_arguments(parser)
+    args = parser.parse_args()
+
+    release_at = time.time() + args.release_in if args.release_in is not None else None
+    storefront = storefront_from_args(
+        args, host=args.host, port=args.port, release_at=release_at
+    ).start()
+    LOGGER.info("Login page: " + storefront.login_url)
+    LOGGER.info("Product page: " + storefront.product_url)
+    LOGGER.info("Cart page: " + storefront.cart_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        storefront.stop()
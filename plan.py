@@ -0,0 +1,322 @@
+# pylint: disable=W1201
+
+import functools
+import logging
+import multiprocessing as mp
+import os
+import time
+
+import diagnostics
+import locators
+import profiling
+import retry
+import scheduler
+from profile_cache import ProfileCache
+from resource_blocking import resolve as resolve_resource_policy
+
+"""
+
+Config compilation.
+
+`compile_plan` reads config.json once, validates every setting, parses the login and
+release times, and precomputes each size's labels, XPath and locator. All problems are
+reported together, before any browser starts. The resulting `Plan` is a plain,
+picklable object: workers receive it as-is instead of a long tuple of arguments, and
+never parse times or build size labels again.
+
+"""
+
+LOGGER = logging.getLogger()
+
+NIKE_HOME_URL = "https://www.nike.com/login"
+NIKE_CART_URL = "https://www.nike.com/au/cart"
+DRIVER_TYPES = ("firefox", "chrome")
+WAIT_ENGINES = ("polling", "event")
+LOCATOR_ENGINES = ("xpath", "compiled")
+CART_METHODS = ("selenium", "http")
+CART_ENGINES = ("process", "asyncio", "tabs")
+ARM_LEAD_TIME = 10
+# forkserver workers fork from a process that has already imported main.py and selenium
+MP_START_METHOD = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+# Readiness conditions and their time budgets (seconds), with the fixed sleeps they replaced
+STEP_TIMEOUTS = {
+    "login_form_ready": 5,
+    "login_outcome": 15,
+    "error_dismissed": 5,
+    "size_selected": 3,
+    "added_to_bag": 5,
+    "session_check": 5,
+    "arm": 10,
+}
+# US sizes per gender: M(en), W(omen), Y(outh, big kids), C(hild, little kids and toddlers)
+SIZE_RANGES = {"M": (3.5, 18), "W": (5, 19.5), "Y": (1, 7), "C": (1, 13.5)}
+WOMEN_OFFSET = 1.5  # US W = US M + 1.5; youth sizes share the men's numbers
+KIND_NAMES = {int: "an integer", bool: "true or false", str: "a string"}
+
+
+def trim0(n):
+    return int(n) if n % 1 == 0 else n
+
+
+def generic_size_label(shoe_gender, shoe_size):
+    men = float(shoe_size) - (WOMEN_OFFSET if shoe_gender == "W" else 0)
+    return f"M {trim0(men)} / W {trim0(men + WOMEN_OFFSET)}"
+
+
+def size_labels(shoe_gender, shoe_size):
+    size = trim0(float(shoe_size))
+    if shoe_gender == "C":
+        return [f"US {size}C", f"{size}C"]
+    labels = [f"US {size}"]
+    if shoe_gender == "Y":
+        labels = [f"US {size}Y", f"{size}Y"]
+    generic = generic_size_label(shoe_gender, shoe_size)
+    return labels + [f"US {generic}", generic]
+
+
+def size_xpath(labels):
+    return (
+        "//*["
+        "not(name()='script') and "
+        "(" + " or ".join(f"text()='{label}'" for label in labels) + ")"
+        "]"
+    )
+
+
+class SizeTarget:
+    def __init__(self, gender, size, sku_id=None):
+        self.gender = gender
+        self.size = size
+        self.sku_id = sku_id
+        self.labels = size_labels(gender, size)
+        self.xpath = size_xpath(self.labels)
+        self.locator = locators.size_button(self.xpath, self.labels)
+
+    @property
+    def label(self):
+        return f"{self.gender} {self.size}"
+
+
+@functools.lru_cache(maxsize=None)
+def size_target(gender, size):
+    return SizeTarget(gender, size)
+
+
+def validate_size(gender, size):
+    if gender not in SIZE_RANGES:
+        return f"unknown gender {gender!r}, use one of " + ", ".join(SIZE_RANGES)
+    try:
+        value = float(size)
+    except (TypeError, ValueError):
+        return f"size {size!r} is not a number"
+    low, high = SIZE_RANGES[gender]
+    if value % 0.5 or not low <= value <= high:
+        return f"size {size} is not a US {gender} size ({low} to {high}, in half sizes)"
+    return None
+
+
+class Plan:
+    def __init__(self, settings):
+        self.__dict__.update(settings)
+
+    def __repr__(self):
+        return "Plan(" + ", ".join(target.label for target in self.targets) + ")"
+
+
+def compile_plan(config):
+    errors = []
+
+    def setting(key, default=None, required=False, choices=None, kind=None, minimum=None):
+        if key not in config:
+            if required:
+                errors.append(f"{key} is required")
+            return default
+        value = config[key]
+        if value is None:
+            return default
+        if choices is not None and value not in choices:
+            errors.append(f"{key} must be one of: " + ", ".join(map(str, choices)))
+        elif kind is not None and (isinstance(value, bool) or not isinstance(value, kind)):
+            errors.append(f"{key} must be " + ("an integer" if kind is int else "a number"))
+        elif minimum is not None and value < minimum:
+            errors.append(f"{key} must be at least {minimum}")
+        return value
+
+    def parsed_time(key):
+        try:
+            return scheduler.parse_time(config.get(key, None))
+        except (ValueError, TypeError, OverflowError) as e:
+            errors.append(f"{key} is not a valid time: {e}")
+            return None
+
+    def section(key, fields):
+        # An object setting: every key known, of the right type and range
+        value = config.get(key, None)
+        if value is None:
+            return None
+        if not isinstance(value, dict):
+            errors.append(f"{key} must be an object")
+            return None
+        for name, item in value.items():
+            if name not in fields:
+                errors.append(f"{key}: unknown setting {name!r}")
+                continue
+            kind, minimum = fields[name]
+            if item is None:
+                continue
+            if isinstance(item, bool) != (kind is bool) or not isinstance(item, kind):
+                errors.append(f"{key}: {name} must be " + KIND_NAMES.get(kind, "a number"))
+            elif minimum is not None and item < minimum:
+                errors.append(f"{key}: {name} must be at least {minimum}")
+        # Like top-level settings, null means the default
+        return {name: item for name, item in value.items() if item is not None}
+
+    number = (int, float)
+    settings = {
+        "driver_type": setting('driver_type', required=True, choices=DRIVER_TYPES),
+        "webdriver_path": setting('webdriver_path'),
+        "username": setting('username', required=True),
+        "password": setting('password', required=True),
+        "url": setting('url', required=True),
+        "cvv": setting('cvv', required=True),
+        "auto_confirm_purchase": setting('auto_confirm_purchase', False),
+        "num_retries": setting('num_retries', 10, kind=int, minimum=1),
+        "page_load_timeout": setting('page_load_timeout', 15, kind=number, minimum=1),
+        "headless": setting('headless', False),
+        "home_url": setting('home_url', NIKE_HOME_URL),
+        "cart_url": setting('cart_url', NIKE_CART_URL),
+        "timeline_dir": setting('timeline_dir'),
+        "record_dir": setting('record_dir'),
+        "diagnostics_dir": setting('diagnostics_dir'),
+        "diagnostics_max_captures": setting(
+            'diagnostics_max_captures', diagnostics.MAX_CAPTURES, kind=int, minimum=1
+        ),
+        "diagnostics_budget": setting(
+            'diagnostics_budget', diagnostics.BUDGET, kind=number, minimum=0
+        ),
+        "profiling_dir": setting('profiling_dir'),
+        "profiling_cpu": setting('profiling_cpu', choices=profiling.CPU_PROFILERS),
+        "profiling_sample_interval": setting(
+            'profiling_sample_interval', profiling.SAMPLE_INTERVAL, kind=number, minimum=0.001
+        ),
+        "profiling_tracemalloc": setting('profiling_tracemalloc', False),
+        "profiling_usage_interval": setting('profiling_usage_interval', kind=number, minimum=0.1),
+        "log_json_file": setting('log_json_file'),
+        "wait_engine": setting('wait_engine', "polling", choices=WAIT_ENGINES),
+        "locator_engine": setting('locator_engine', "xpath", choices=LOCATOR_ENGINES),
+        "step_timeouts": setting('step_timeouts', {}),
+        "driver_pool": section(
+            'driver_pool',
+            {
+                "size": (int, 1),
+                "startup_concurrency": (int, 1),
+                "health_check_interval": (number, 0),
+            },
+        ),
+        "share_session": setting('share_session', True),
+        "arm_lead_time": setting('arm_lead_time', ARM_LEAD_TIME, kind=number, minimum=0),
+        "cart_method": setting('cart_method', "selenium", choices=CART_METHODS),
+        "cart_engine": setting('cart_engine', "process", choices=CART_ENGINES),
+        "mp_start_method": setting(
+            'mp_start_method', MP_START_METHOD, choices=mp.get_all_start_methods()
+        ),
+        "cart_target": setting('cart_target', kind=int, minimum=1),
+        "cart_task_timeout": setting('cart_task_timeout', kind=number, minimum=0),
+        "retry_policies": setting('retry_policies', {}),
+        "release_deadline": setting('release_deadline', kind=number, minimum=0),
+        "checkout_resume": setting('checkout_resume', True),
+        "metrics_port": setting('metrics_port', kind=int, minimum=0),
+        "metrics_host": setting('metrics_host', "127.0.0.1"),
+        "product_id": setting('product_id'),
+        "cart_api_url": setting('cart_api_url'),
+        # Parsed once here; workers get epoch seconds
+        "login_time": parsed_time('login_time'),
+        "release_time": parsed_time('release_time'),
+    }
+
+    if not isinstance(settings["step_timeouts"], dict):
+        errors.append("step_timeouts must be an object")
+        settings["step_timeouts"] = {}
+    for name, timeout in settings["step_timeouts"].items():
+        if name not in STEP_TIMEOUTS:
+            errors.append(f"step_timeouts: unknown step {name!r}")
+        elif isinstance(timeout, bool) or not isinstance(timeout, number) or timeout <= 0:
+            errors.append(f"step_timeouts: {name} must be a positive number")
+    if isinstance(settings["retry_policies"], dict):
+        errors.extend(retry.validate_policies(settings["retry_policies"]))
+    else:
+        errors.append("retry_policies must be an object")
+    if settings["login_time"] and settings["release_time"]:
+        if settings["login_time"] > settings["release_time"]:
+            errors.append("login_time must be before release_time")
+
+    targets = []
+    shoe_list = config.get('shoe_list')
+    if not isinstance(shoe_list, list) or not shoe_list:
+        errors.append("shoe_list must be a non-empty list")
+        shoe_list = []
+    seen = set()
+    for index, shoe_entry in enumerate(shoe_list):
+        if not isinstance(shoe_entry, dict):
+            errors.append(f"shoe_list[{index}] must be an object with a gender and a size")
+            continue
+        gender, size = shoe_entry.get('gender'), shoe_entry.get('size')
+        problem = validate_size(gender, size)
+        if problem:
+            errors.append(f"shoe_list[{index}]: {problem}")
+            continue
+        if (gender, float(size)) in seen:
+            errors.append(f"shoe_list[{index}]: {gender} {size} is listed twice")
+        seen.add((gender, float(size)))
+        sku_id = shoe_entry.get('sku_id', config.get('sku_id'))
+        targets.append(SizeTarget(gender, str(size), sku_id))
+    settings["targets"] = targets
+
+    settings["profiling_run_dir"] = None
+    if settings["profiling_dir"]:
+        # Named once here, so every worker profiles into the same run directory
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+        settings["profiling_run_dir"] = os.path.join(
+            settings["profiling_dir"], f"run-{stamp}.{int(now * 1000) % 1000:03d}"
+        )
+
+    if settings["cart_engine"] == "tabs" and settings["cart_method"] != "selenium":
+        errors.append("The tabs cart engine needs the selenium cart method")
+    if settings["cart_engine"] == "asyncio" and settings["driver_pool"] is None:
+        # asyncio attempts share this process, so they need pooled drivers
+        settings["driver_pool"] = {}
+    if settings["cart_target"] is None:
+        # Early stop is opt-in; the asyncio engine has always stopped at the first size
+        settings["cart_target"] = 1 if settings["cart_engine"] == "asyncio" else len(targets)
+    if settings["cart_method"] == "http":
+        if settings["product_id"] is None:
+            errors.append("The http cart method needs a product_id")
+        if any(target.sku_id is None for target in targets):
+            errors.append("The http cart method needs a sku_id for every shoe")
+
+    try:
+        settings["resource_policy"] = resolve_resource_policy(config.get('resource_policy', None))
+    except Exception as e:
+        errors.append(str(e))
+
+    profile_cache_config = section(
+        'profile_cache',
+        {"dir": (str, None), "invalidate": (bool, None), "max_age_hours": (number, 0)},
+    )
+    settings["profile_cache"] = None
+    if profile_cache_config is not None and settings["username"] and not errors:
+        settings["profile_cache"] = ProfileCache(
+            profile_cache_config.get('dir') or "profiles",
+            settings["username"],
+            settings["driver_type"],
+        )
+        settings["profile_cache_invalidate"] = profile_cache_config.get('invalidate', False)
+        settings["profile_cache_max_age_hours"] = profile_cache_config.get('max_age_hours', None)
+
+    if errors:
+        raise Exception("Invalid config:\n  " + "\n  ".join(errors))
+
+    if settings["release_time"] and settings["release_time"] < time.time():
+        LOGGER.warning("release_time is in the past, carting right away")
+    return Plan(settings)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+
+"""
+
+Persistent browser profiles, one per account and driver type.
+
+The main browser runs directly on the cached profile, so its HTTP cache, service worker
+assets and cookies carry over to the next run. A profile can only be opened by one
+browser at a time: before the main browser starts, the profile is snapshotted, and worker
+and pooled browsers start from a throwaway copy of that snapshot (copy-on-start), so they
+never copy the files of a running browser. Copies are deleted on the next run.
+
+    "profile_cache": {"dir": "profiles", "max_age_hours": 24, "invalidate": false}
+
+    python profile_cache.py invalidate you@example.com --dir profiles
+
+"""
+
+LOGGER = logging.getLogger()
+
+# Lock files of a running browser; copying them would make the copy look in use
+LOCK_FILES = (
+    "SingletonLock",
+    "SingletonCookie",
+    "SingletonSocket",
+    "lock",
+    ".parentlock",
+    "parent.lock",
+)
+CREATED_MARKER = ".profile-created"
+
+
+def account_slug(account):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", account)
+
+
+class ProfileCache:
+    def __init__(self, root, account, driver_type):
+        self.root = os.path.abspath(root)
+        self.account_dir = os.path.join(self.root, account_slug(account))
+        self.path = os.path.join(self.account_dir, driver_type)
+        self.copies_dir = os.path.join(self.account_dir, driver_type + "-copies")
+        self.snapshot = os.path.join(self.copies_dir, "snapshot")
+
+    @property
+    def marker(self):
+        return os.path.join(self.path, CREATED_MARKER)
+
+    def exists(self):
+        return os.path.isfile(self.marker)
+
+    def age(self):
+        if not self.exists():
+            return None
+        return time.time() - os.path.getmtime(self.marker)
+
+    def prepare(self, max_age_hours=None):
+        if max_age_hours is not None and self.exists() and self.age() > max_age_hours * 3600:
+            LOGGER.info(f"Profile is older than {max_age_hours}h")
+            self.invalidate()
+        self.clean_copies()
+        if self.exists():
+            LOGGER.info("Using warm profile: " + self.path)
+            shutil.copytree(
+                self.path,
+                self.snapshot,
+                ignore=shutil.ignore_patterns(*LOCK_FILES),
+                symlinks=True,
+            )
+        else:
+            LOGGER.info("Creating profile: " + self.path)
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.marker, "w") as f:
+                f.write(time.strftime("%Y-%m-%d %H:%M:%S\n"))
+        return self
+
+    def copy(self):
+        os.makedirs(self.copies_dir, exist_ok=True)
+        target = tempfile.mkdtemp(prefix="profile-", dir=self.copies_dir)
+        if os.path.isdir(self.snapshot):
+            # copytree creates the target itself; mkdtemp only reserved the name
+            os.rmdir(target)
+            shutil.copytree(self.snapshot, target, symlinks=True)
+        return target
+
+    def clean_copies(self):
+        shutil.rmtree(self.copies_dir, ignore_errors=True)
+
+    def invalidate(self):
+        LOGGER.info("Invalidating profile: " + self.path)
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.clean_copies()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Manage the cached browser profiles.")
+    parser.add_argument("action", choices=("invalidate", "show"))
+    parser.add_argument("account")
+    parser.add_argument("--dir", default="profiles")
+    parser.add_argument("--driver-type", default=None, choices=("firefox", "chrome"))
+    args = parser.parse_args()
+
+    for driver_type in [args.driver_type] if args.driver_type else ["chrome", "firefox"]:
+        profile_cache = ProfileCache(args.dir, args.account, driver_type)
+        if args.action == "invalidate":
+            profile_cache.invalidate()
+        elif profile_cache.exists():
+            LOGGER.info(f"{profile_cache.path}: {profile_cache.age() / 3600:.1f}h old")
+        else:
+            LOGGER.info(f"{profile_cache.path}: not cached")
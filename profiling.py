@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from selenium.webdriver.remote.command import Command
+
+import instrumentation
+
+"""
+
+Profiling of a run: where the time goes on the Python side and on the browser side.
+
+With `"profiling_dir": "profiling"` in the config, every process of the run (the main
+process and each `run_add_to_cart` worker) profiles itself into one directory per run,
+`profiling/run-<time>`, and the main process writes `summary.txt` and `summary.json`
+there at the end. Each profiled process writes `<name>-<pid>.session.json` with:
+
+    the wall and Python CPU time of the process, and the WebDriver commands its drivers
+    sent: how many of each, and the seconds spent waiting for the browser to answer
+
+plus, depending on the flags:
+
+    profiling_cpu "cprofile"      `.prof`, for pstats or snakeviz; it only sees the thread
+                                  that started it, so threaded cart engines need "sampling"
+    profiling_cpu "sampling"      `.folded`, stacks of every thread sampled each
+                                  `profiling_sample_interval` seconds (flamegraph.pl,
+                                  speedscope)
+    profiling_tracemalloc         `.tracemalloc`, the snapshot at the end, and the lines
+                                  that allocated the most since the start in the summary
+    profiling_usage_interval      `.usage.jsonl`, RSS and CPU of the process and of its
+                                  children (driver, browser) every few seconds (psutil)
+
+`python profiling.py profiling/run-<time>` prints the summary of a run again.
+
+"""
+
+LOGGER = logging.getLogger()
+
+CPU_PROFILERS = ("cprofile", "sampling")
+SAMPLE_INTERVAL = 0.005
+TOP = 15
+
+_config = None
+_counters = []
+_retired = {}  # per pid: the counts and seconds of the drivers that quit
+_lock = threading.Lock()
+
+
+def configure(
+    run_dir, cpu=None, sample_interval=SAMPLE_INTERVAL, trace_memory=False, usage_interval=None
+):
+    global _config
+    if run_dir is None:
+        _config = None
+        return
+    _config = {
+        "run_dir": run_dir,
+        "cpu": cpu,
+        "sample_interval": sample_interval,
+        "trace_memory": trace_memory,
+        "usage_interval": usage_interval,
+    }
+
+
+def enabled():
+    return _config is not None
+
+
+class QuitCounter(instrumentation.CommandCounter):
+    def counted_execute(self, driver_command, params=None):
+        try:
+            return super().counted_execute(driver_command, params)
+        finally:
+            if driver_command == Command.QUIT:
+                retire(self)
+
+
+def watch(driver):
+    if _config is None:
+        return
+    counter = QuitCounter(driver)
+    with _lock:
+        _counters.append((os.getpid(), counter))
+
+
+def add_counts(totals, counter):
+    counts, seconds = totals
+    for command, count in counter.counts.items():
+        counts[command] = counts.get(command, 0) + count
+        seconds[command] = seconds.get(command, 0) + counter.seconds.get(command, 0)
+
+
+def retire(counter):
+    # Its counts stay in the totals, but the driver is no longer kept alive
+    with _lock:
+        for index, (pid, watched) in enumerate(_counters):
+            if watched is counter:
+                del _counters[index]
+                add_counts(_retired.setdefault(pid, ({}, {})), counter)
+                break
+    counter.detach()
+    counter.driver = None
+
+
+def command_totals():
+    pid = os.getpid()
+    with _lock:
+        # A forked worker inherits the counters of the parent's drivers
+        retired_counts, retired_seconds = _retired.get(pid, ({}, {}))
+        totals = (dict(retired_counts), dict(retired_seconds))
+        for watched_pid, counter in _counters:
+            if watched_pid == pid:
+                add_counts(totals, counter)
+    return totals
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiling-sampler", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            # Not the profilers' own threads
+            own = {
+                thread.ident
+                for thread in threading.enumerate()
+                if thread.name.startswith("profiling-")
+            }
+            for thread_id, frame in sys._current_frames().items():  # pylint: disable=W0212
+                if thread_id in own:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                stack = ";".join(reversed(labels))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def top(self, count=TOP):
+        leaves = {}
+        for stack, samples in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + samples
+        return sorted(leaves.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+class UsageRecorder:
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.peaks = {"python_rss": None, "children_rss": None}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiling-usage", daemon=True)
+
+    def sample(self):
+        from resource_usage import psutil
+
+        process = psutil.Process()
+        usage = {"time": time.time(), "children": 0, "children_rss": 0, "children_cpu": 0.0}
+        with process.oneshot():
+            cpu = process.cpu_times()
+            usage["python_rss"] = process.memory_info().rss
+            usage["python_cpu"] = cpu.user + cpu.system
+        for child in process.children(recursive=True):
+            try:
+                cpu = child.cpu_times()
+                usage["children_rss"] += child.memory_info().rss
+                usage["children_cpu"] += cpu.user + cpu.system
+                usage["children"] += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        for name in self.peaks:
+            self.peaks[name] = max(self.peaks[name] or 0, usage[name])
+        return usage
+
+    def run(self):
+        with open(self.path, "w") as f:
+            while True:
+                f.write(json.dumps(self.sample()) + "\n")
+                f.flush()
+                if self.stopped.wait(self.interval):
+                    return
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Session:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.pid = os.getpid()
+        self.stem = os.path.join(config["run_dir"], f"{name.replace(' ', '-')}-{self.pid}")
+        self.profile = None
+        self.sampler = None
+        self.usage = None
+        self.traced = False
+        self.memory_start = None
+        self.started = None
+        self.wall_start = None
+        self.cpu_start = None
+        self.commands_start = None
+
+    def start(self):
+        import resource_usage
+
+        os.makedirs(self.config["run_dir"], exist_ok=True)
+        self.started = time.time()
+        self.wall_start = time.monotonic()
+        self.cpu_start = time.process_time()
+        self.commands_start = command_totals()
+        if self.config["trace_memory"]:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                self.traced = True
+            self.memory_start = tracemalloc.take_snapshot()
+        if self.config["usage_interval"]:
+            if resource_usage.psutil is None:
+                LOGGER.warning("psutil is not installed, not sampling RSS and CPU")
+            else:
+                self.usage = UsageRecorder(
+                    self.stem + ".usage.jsonl", self.config["usage_interval"]
+                ).start()
+        if self.config["cpu"] == "sampling":
+            self.sampler = StackSampler(self.config["sample_interval"]).start()
+        elif self.config["cpu"] == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.usage is not None:
+            self.usage.stop()
+        counts, seconds = command_totals()
+        start_counts, start_seconds = self.commands_start
+        summary = {
+            "name": self.name,
+            "pid": self.pid,
+            "started": self.started,
+            "wall_seconds": time.monotonic() - self.wall_start,
+            "python_cpu_seconds": time.process_time() - self.cpu_start,
+            "commands": {
+                command: {
+                    "count": count - start_counts.get(command, 0),
+                    "seconds": seconds[command] - start_seconds.get(command, 0),
+                }
+                for command, count in counts.items()
+                if count > start_counts.get(command, 0)
+            },
+        }
+        if self.profile is not None:
+            self.profile.dump_stats(self.stem + ".prof")
+            stats = pstats.Stats(self.profile).stats
+            top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP]
+            summary["cprofile_top"] = [
+                [f"{function} ({os.path.basename(path)}:{line})", total, cumulative]
+                for (path, line, function), (_, _, total, cumulative, _) in top
+            ]
+        if self.sampler is not None:
+            self.sampler.write(self.stem + ".folded")
+            summary["samples"] = self.sampler.samples
+            summary["sampling_top"] = self.sampler.top()
+        if self.usage is not None:
+            summary.update(self.usage.peaks)
+        if self.memory_start is not None:
+            # Without the profilers' own allocations
+            ignored = [
+                tracemalloc.Filter(False, path)
+                for path in (cProfile.__file__, tracemalloc.__file__, __file__)
+            ]
+            snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+            snapshot.dump(self.stem + ".tracemalloc")
+            summary["python_peak_traced"] = tracemalloc.get_traced_memory()[1]
+            summary["allocations_top"] = [
+                [str(stat.traceback[0]), stat.size_diff, stat.count_diff]
+                for stat in snapshot.compare_to(
+                    self.memory_start.filter_traces(ignored), "lineno"
+                )[:TOP]
+            ]
+            if self.traced:
+                tracemalloc.stop()
+        with open(self.stem + ".session.json", "w") as f:
+            json.dump(summary, f, indent=1)
+        return summary
+
+
+def start(name):
+    if _config is None:
+        return None
+    return Session(name, _config).start()
+
+
+def finish(profile):
+    # A forked worker inherits the parent's session, which is not its own to finish
+    if profile is None or profile.pid != os.getpid():
+        return None
+    try:
+        return profile.stop()
+    except Exception as e:
+        LOGGER.warning(f"Failed to write the {profile.name} profile: " + str(e))
+        return None
+
+
+@contextmanager
+def session(name):
+    profile = start(name)
+    try:
+        yield profile
+    finally:
+        finish(profile)
+
+
+def format_bytes(value):
+    import resource_usage
+
+    return resource_usage.format_bytes(value or None)
+
+
+def summarize(sessions):
+    lines = []
+    lines.append(
+        f"{'process':<24}{'wall (s)':>10}{'python cpu':>12}{'commands':>10}"
+        f"{'webdriver (s)':>15}{'python rss':>14}{'browser rss':>14}"
+    )
+    for item in sessions:
+        commands = item["commands"].values()
+        lines.append(
+            f"{item['name'] + ' ' + str(item['pid']):<24}{item['wall_seconds']:>10.2f}"
+            f"{item['python_cpu_seconds']:>12.2f}{sum(c['count'] for c in commands):>10}"
+            f"{sum(c['seconds'] for c in commands):>15.2f}"
+            f"{format_bytes(item.get('python_rss')):>14}"
+            f"{format_bytes(item.get('children_rss')):>14}"
+        )
+    commands = {}
+    for item in sessions:
+        for command, totals in item["commands"].items():
+            count, seconds = commands.get(command, (0, 0))
+            commands[command] = (count + totals["count"], seconds + totals["seconds"])
+    if commands:
+        lines += ["", f"{'webdriver command':<32}{'count':>8}{'seconds':>10}{'mean (ms)':>11}"]
+        for command, (count, seconds) in sorted(
+            commands.items(), key=lambda item: item[1][1], reverse=True
+        ):
+            lines.append(f"{command:<32}{count:>8}{seconds:>10.2f}{seconds / count * 1000:>11.1f}")
+    for item in sessions:
+        for key, title in (
+            ("cprofile_top", "self seconds, cumulative seconds"),
+            ("sampling_top", f"samples of {item.get('samples')}"),
+            ("allocations_top", "bytes, blocks allocated since the start"),
+        ):
+            if item.get(key):
+                lines += ["", f"{item['name']} {item['pid']}: {key} ({title})"]
+                for label, *values in item[key]:
+                    lines.append(
+                        "  " + "  ".join(
+                            f"{value:.3f}" if isinstance(value, float) else str(value)
+                            for value in values
+                        ) + "  " + label
+                    )
+    return "\n".join(lines) + "\n"
+
+
+def load_sessions(run_dir):
+    sessions = []
+    for path in glob.glob(os.path.join(run_dir, "*.session.json")):
+        with open(path) as f:
+            sessions.append(json.load(f))
+    return sorted(sessions, key=lambda item: item["started"])
+
+
+def write_summary(run_dir=None):
+    run_dir = run_dir or (_config or {}).get("run_dir")
+    if run_dir is None:
+        return None
+    sessions = load_sessions(run_dir)
+    if not sessions:
+        return None
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(sessions, f, indent=1)
+    path = os.path.join(run_dir, "summary.txt")
+    with open(path, "w") as f:
+        f.write(summarize(sessions))
+    python_cpu = sum(item["python_cpu_seconds"] for item in sessions)
+    webdriver = sum(c["seconds"] for item in sessions for c in item["commands"].values())
+    LOGGER.info(
+        f"Profiled {len(sessions)} processes: {python_cpu:.2f}s of Python CPU, "
+        f"{webdriver:.2f}s waiting on WebDriver commands. Summary: {path}"
+    )
+    return path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python profiling.py <profiling run directory>")
+    sessions = load_sessions(sys.argv[1])
+    if not sessions:
+        sys.exit(f"No profiles in {sys.argv[1]}")
+    print(summarize(sessions), end="")
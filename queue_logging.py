@@ -0,0 +1,147 @@
+# pylint: disable=W1201
+
+import json
+import logging
+import logging.handlers
+import signal
+import sys
+import threading
+import time
+
+"""
+
+Logging through a queue, with a single writer process.
+
+Processes that log this way get a `QueueHandler` instead of their own console and file
+handlers. A log call formats the record and hands it to the queue's feeder thread, so
+it never waits on stdout or on the disk, and only the writer process writes to them.
+Lines from different workers therefore never interleave. The writer writes
+`purchase.log` as before, and, when asked, a JSON lines log. Each record carries the
+worker, the size and the phase it was logged from, and a `time.monotonic` timestamp.
+The timestamp is system-wide, so records from different processes line up with the
+span timeline.
+
+"""
+
+LOGGER = logging.getLogger()
+
+TEXT_FORMAT = (
+    "%(asctime)s [PID %(process)d] [Thread %(thread)d] [%(levelname)s] [%(name)s] %(message)s"
+)
+
+_worker = None
+_context = threading.local()
+
+
+def set_worker(name):
+    global _worker
+    _worker = name
+
+
+def set_context(**fields):
+    # Per thread: the asyncio and driver pool engines cart several sizes in one process
+    for name, value in fields.items():
+        setattr(_context, name, value)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.monotonic = time.monotonic()
+        record.worker = _worker
+        record.size = getattr(_context, "size", None)
+        record.phase = getattr(_context, "phase", None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        # QueueHandler has already folded any traceback into the message
+        return json.dumps(
+            {
+                "time": record.created,
+                "monotonic": getattr(record, "monotonic", None),
+                "level": record.levelname,
+                "pid": record.process,
+                "worker": getattr(record, "worker", None),
+                "size": getattr(record, "size", None),
+                "phase": getattr(record, "phase", None),
+                "logger": record.name,
+                "message": record.getMessage(),
+            }
+        )
+
+
+def writer_handlers(log_file, json_file=None, console=True):
+    handlers = [logging.FileHandler(log_file)]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    if json_file:
+        json_handler = logging.FileHandler(json_file)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+    return handlers
+
+
+def run_writer(queue, log_file, json_file, console):
+    # Ctrl+C reaches the whole process group; keep writing until the sentinel arrives
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handlers = writer_handlers(log_file, json_file, console)
+    while True:
+        record = queue.get()
+        if record is None:
+            break
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+    for handler in handlers:
+        handler.close()
+
+
+def install(queue, level=logging.INFO):
+    root = logging.getLogger()
+    previous = root.handlers[:]
+    for handler in previous:
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(queue)
+    handler.addFilter(ContextFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    return previous
+
+
+class LogWriter:
+    def __init__(self, context, log_file="purchase.log", json_file=None, console=True):
+        self.queue = context.Queue()
+        self.process = context.Process(
+            target=run_writer,
+            args=(self.queue, log_file, json_file, console),
+            name="log-writer",
+            daemon=True,
+        )
+        self.previous_handlers = None
+
+    def start(self, install_here=True):
+        self.process.start()
+        if install_here:
+            self.previous_handlers = install(self.queue)
+        LOGGER.info(f"Logging through writer process {self.process.pid}")
+        return self
+
+    def stop(self, timeout=5):
+        if self.previous_handlers is not None:
+            root = logging.getLogger()
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            # Later records, from an interactive session for example, are written directly
+            for handler in self.previous_handlers:
+                root.addHandler(handler)
+            self.previous_handlers = None
+        if not self.process.is_alive():
+            return
+        self.queue.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            LOGGER.warning("Log writer did not finish in time")
+            self.process.terminate()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# pylint: disable=W1201
+
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import instrumentation
+
+"""
+
+Records real runs into fixtures for the mock storefront.
+
+With `"record_dir": "recordings"` in the config, every process of the run (the main
+browser and each cart worker) records:
+
+    pages   the Navigation Timing of the login, product, cart and checkout pages, and a
+            snapshot of their DOM once the bot found what it waits for
+    waits   every wait helper, readiness condition and checkout step, in order: what it
+            waited for, when it started, how long it took and how it ended
+
+and writes them to `recording-<pid>.json.gz` in that directory. DOM snapshots are
+stored once per content, and only the first few per page.
+
+`python mock_server.py --replay recordings` (or `--replay` on any benchmark) serves the
+mock pages with the server and in-page latencies drawn from the recorded ones, so a
+benchmark sees the real timing profile. `python recorder.py summary recordings` prints
+that profile, and `python recorder.py snapshot recordings product` prints a recorded
+page, to compare with the mock pages when they drift.
+
+"""
+
+LOGGER = logging.getLogger()
+
+FORMAT_VERSION = 1
+MAX_SNAPSHOTS = 3  # per page name and process
+WAIT_SPANS = (
+    "wait_for_sizes",
+    "wait_and_click",
+    "wait_until_visible",
+    "wait_until_invisible",
+    "wait_and_switch_iframe",
+    "locate",
+    "transition",
+    "checkout_step",
+)
+# Mock storefront latency: the recorded span that measures it, and the span args to match
+REPLAYED_LATENCIES = {
+    "login_submit": ("transition", {"condition": "login_outcome"}),
+    "size_buttons": ("wait_for_sizes", {}),
+    "add_to_bag": ("transition", {"condition": "added_to_bag"}),
+    "checkout_spinner": ("checkout_step", {"step": "spinner"}),
+    "shipping": ("checkout_step", {"step": "billing"}),
+}
+
+TIMING_SCRIPT = """
+var nav = performance.getEntriesByType("navigation")[0];
+if (!nav) return null;
+return {
+  url: location.pathname,
+  server: nav.responseStart - nav.requestStart,
+  transfer: nav.responseEnd - nav.responseStart,
+  dom_ready: nav.domContentLoadedEventEnd - nav.startTime,
+  load: nav.loadEventEnd - nav.startTime,
+  resources: performance.getEntriesByType("resource").length
+};
+"""
+SNAPSHOT_SCRIPT = "return document.documentElement.outerHTML;"
+
+_recording = None
+_lock = threading.Lock()
+
+
+class Recording:
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        self.pid = os.getpid()
+        self.path = os.path.join(record_dir, f"recording-{self.pid}.json.gz")
+        self.started = time.time()
+        self.origin_ns = time.monotonic_ns()
+        self.pages = []
+        self.doms = {}
+        self.waits = []
+
+    def since_start(self, monotonic_ns):
+        return (monotonic_ns - self.origin_ns) / 1e9
+
+    def add_span(self, item):
+        if item["name"] not in WAIT_SPANS:
+            return
+        args = dict(item["args"])
+        error = args.pop("error", None)
+        with _lock:
+            self.waits.append(
+                {
+                    "name": item["name"],
+                    "at": self.since_start(item["start_ns"]),
+                    "seconds": (item["end_ns"] - item["start_ns"]) / 1e9,
+                    "args": args,
+                    "outcome": error or "met",
+                }
+            )
+
+    def snapshots(self, name):
+        return sum(1 for page in self.pages if page["name"] == name and page["dom"])
+
+    def to_dict(self):
+        with _lock:
+            return {
+                "version": FORMAT_VERSION,
+                "pid": self.pid,
+                "started": self.started,
+                "pages": list(self.pages),
+                "doms": dict(self.doms),
+                "waits": sorted(self.waits, key=lambda wait: wait["at"]),
+            }
+
+
+def enabled():
+    return _recording is not None
+
+
+def record_span(item):
+    if _recording is not None:
+        _recording.add_span(item)
+
+
+def enable(record_dir):
+    global _recording
+    # A forked worker inherits the parent's recording, but records into its own
+    if _recording is not None and (_recording.record_dir, _recording.pid) == (
+        record_dir,
+        os.getpid(),
+    ):
+        return
+    os.makedirs(record_dir, exist_ok=True)
+    _recording = Recording(record_dir)
+    # Wait helpers are already spans; the recording listens to them
+    instrumentation.add_listener(record_span)
+    LOGGER.info("Recording the run into " + _recording.path)
+
+
+def disable():
+    global _recording
+    if _recording is None:
+        return
+    flush()
+    _recording = None
+    instrumentation.remove_listener(record_span)
+
+
+def page(driver, name):
+    if _recording is None:
+        return
+    try:
+        timing = driver.execute_script(TIMING_SCRIPT)
+        dom = None
+        if _recording.snapshots(name) < MAX_SNAPSHOTS:
+            html = driver.execute_script(SNAPSHOT_SCRIPT)
+            dom = hashlib.sha1(html.encode("utf-8")).hexdigest()
+            with _lock:
+                _recording.doms.setdefault(dom, html)
+    except Exception as e:
+        LOGGER.warning(f"Could not record the {name} page: " + str(e))
+        return
+    with _lock:
+        _recording.pages.append(
+            {
+                "name": name,
+                "at": _recording.since_start(time.monotonic_ns()),
+                "timing": timing,
+                "dom": dom,
+            }
+        )
+
+
+def flush():
+    if _recording is None:
+        return None
+    recording = _recording.to_dict()
+    if not recording["pages"] and not recording["waits"]:
+        return None
+    # Rewritten whole: a process keeps its recording in memory until it exits
+    temporary = _recording.path + ".tmp"
+    with gzip.open(temporary, "wt", encoding="utf-8") as f:
+        json.dump(recording, f, default=str)
+    os.replace(temporary, _recording.path)
+    LOGGER.info(
+        f"Recorded {len(recording['pages'])} pages and {len(recording['waits'])} waits "
+        f"to {_recording.path}"
+    )
+    return _recording.path
+
+
+def recording_paths(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, "recording-*.json.gz"))))
+        else:
+            found.append(path)
+    return found
+
+
+def load(paths):
+    recordings = []
+    for path in recording_paths(paths):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            recording = json.load(f)
+        if recording.get("version") != FORMAT_VERSION:
+            raise Exception(f"{path} is not a version {FORMAT_VERSION} recording")
+        recordings.append(recording)
+    if not recordings:
+        raise Exception("No recordings in: " + ", ".join(paths))
+    return recordings
+
+
+def latency_samples(recordings):
+    samples = {"page": []}
+    for recording in recordings:
+        for page_load in recording["pages"]:
+            if page_load["timing"]:
+                samples["page"].append(max(page_load["timing"]["server"], 0) / 1000)
+        for name, (span, match) in REPLAYED_LATENCIES.items():
+            samples.setdefault(name, []).extend(
+                wait["seconds"]
+                for wait in recording["waits"]
+                if wait["name"] == span
+                and wait["outcome"] == "met"
+                and all(wait["args"].get(key) == value for key, value in match.items())
+            )
+    return {name: sorted(values) for name, values in samples.items() if values}
+
+
+def replay_latencies(paths):
+    """
+    Latencies for MockStorefront that draw from the recorded samples. The ones that were
+    not recorded keep their defaults.
+    """
+    samples = latency_samples(load(paths))
+    LOGGER.info(
+        "Replaying recorded latencies: "
+        + ", ".join(f"{name} ({len(values)} samples)" for name, values in samples.items())
+    )
+    return {name: {"samples": values} for name, values in samples.items()}
+
+
+def print_summary(recordings):
+    print(f"{'latency':<20}{'n':>5}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for name, values in latency_samples(recordings).items():
+        p50, p95 = (values[int(pct * (len(values) - 1))] for pct in (0.5, 0.95))
+        print(f"{name:<20}{len(values):>5}{p50:>10.3f}{p95:>10.3f}{values[-1]:>10.3f}")
+    print()
+    print(f"{'page':<20}{'loads':>6}{'snapshots':>11}")
+    pages = {}
+    for recording in recordings:
+        for page_load in recording["pages"]:
+            loads, snapshots = pages.get(page_load["name"], (0, 0))
+            pages[page_load["name"]] = (loads + 1, snapshots + bool(page_load["dom"]))
+    for name, (loads, snapshots) in pages.items():
+        print(f"{name:<20}{loads:>6}{snapshots:>11}")
+
+
+def snapshot(recordings, name):
+    for recording in recordings:
+        for page_load in recording["pages"]:
+            if page_load["name"] == name and page_load["dom"]:
+                return recording["doms"][page_load["dom"]]
+    return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Inspect recordings of real runs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summary_parser = commands.add_parser("summary", help="Latency profile and recorded pages")
+    summary_parser.add_argument("paths", nargs="+", help="Recordings, or directories of them")
+    snapshot_parser = commands.add_parser("snapshot", help="Print the first recorded DOM of a page")
+    snapshot_parser.add_argument("path", help="A recording, or a directory of them")
+    snapshot_parser.add_argument("page", help="login, product, cart or checkout")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        print_summary(load(args.paths))
+    else:
+        html = snapshot(load([args.path]), args.page)
+        if html is None:
+            sys.exit(f"No snapshot of the {args.page} page")
+        print(html)
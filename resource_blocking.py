@@ -0,0 +1,138 @@
+# pylint: disable=W1201
+
+import logging
+
+"""
+
+Resource policy: which page resources the browsers are allowed to download.
+
+Images, media and fonts are never needed to find and click the size, bag and checkout
+buttons, and the tracking scripts on the launch page only delay the load event. The
+policy is set through browser preferences when the driver is created and, on Chrome,
+through the DevTools `Network.setBlockedURLs` command once the session exists.
+
+    "resource_policy": true
+    "resource_policy": {"fonts": false, "blocked_hosts": ["tracker.example"]}
+
+`allowed_hosts` are never host-blocked and keep their images (the checkout iframes).
+Host blocking is Chrome only; Firefox blocks the resource types alone.
+
+"""
+
+LOGGER = logging.getLogger()
+
+DEFAULT_RESOURCE_POLICY = {
+    "images": True,
+    "media": True,
+    "fonts": True,
+    "blocked_hosts": [
+        "doubleclick.net",
+        "google-analytics.com",
+        "googletagmanager.com",
+        "googleadservices.com",
+        "facebook.net",
+        "adobedtm.com",
+        "omtrdc.net",
+        "demdex.net",
+        "everesttech.net",
+        "nr-data.net",
+        "optimizely.com",
+        "qualtrics.com",
+        "pinimg.com",
+        "snapchat.com",
+    ],
+    "allowed_hosts": [
+        "secure-store.nike.com",
+        "paymentcc.nike.com",
+        "api.nike.com",
+        "unite.nike.com",
+    ],
+}
+
+BLOCKED_EXTENSIONS = {
+    "media": ("mp4", "webm", "m4v", "mov", "mp3", "m3u8", "ts"),
+    "fonts": ("woff", "woff2", "ttf", "otf", "eot"),
+}
+
+
+def resolve(policy):
+    if not policy:
+        return None
+    if policy is True:
+        return dict(DEFAULT_RESOURCE_POLICY)
+    unknown = set(policy) - set(DEFAULT_RESOURCE_POLICY)
+    if unknown:
+        raise Exception("Unknown resource policy keys: " + ", ".join(sorted(unknown)))
+    return dict(DEFAULT_RESOURCE_POLICY, **policy)
+
+
+def is_allowed(host, policy):
+    return any(
+        host == allowed or host.endswith("." + allowed) for allowed in policy["allowed_hosts"]
+    )
+
+
+def blocked_url_patterns(policy):
+    patterns = []
+    for kind, extensions in BLOCKED_EXTENSIONS.items():
+        if policy[kind]:
+            for extension in extensions:
+                patterns += [f"*.{extension}", f"*.{extension}?*"]
+    for host in policy["blocked_hosts"]:
+        if not is_allowed(host, policy):
+            patterns += [f"*://{host}/*", f"*://*.{host}/*", f"*://{host}:*", f"*://*.{host}:*"]
+    return patterns
+
+
+def chrome_prefs(policy):
+    prefs = {}
+    if policy["images"]:
+        prefs["profile.default_content_setting_values.images"] = 2
+        prefs["profile.content_settings.exceptions.images"] = {
+            f"[*.]{host},*": {"setting": 1} for host in policy["allowed_hosts"]
+        }
+    return prefs
+
+
+def firefox_prefs(policy):
+    prefs = {}
+    if policy["images"]:
+        prefs["permissions.default.image"] = 2
+    if policy["media"]:
+        prefs["media.autoplay.default"] = 5
+        prefs["media.preload.default"] = 0
+        prefs["media.preload.auto"] = 0
+    if policy["fonts"]:
+        prefs["browser.display.use_document_fonts"] = 0
+        prefs["gfx.downloadable_fonts.enabled"] = False
+    return prefs
+
+
+def configure_options(options, driver_type, policy):
+    if driver_type == "chrome":
+        options.add_experimental_option("prefs", chrome_prefs(policy))
+    elif driver_type == "firefox":
+        for name, value in firefox_prefs(policy).items():
+            options.set_preference(name, value)
+        if policy["blocked_hosts"]:
+            LOGGER.warning("Host blocking needs chrome, blocking resource types only")
+
+
+def apply(driver, policy):
+    # Kept on the driver so new tabs can be given the same rules
+    driver.resource_policy = policy
+    apply_to_current_tab(driver)
+
+
+def apply_to_current_tab(driver):
+    policy = getattr(driver, "resource_policy", None)
+    if policy is None or not hasattr(driver, "execute_cdp_cmd"):
+        return
+    patterns = blocked_url_patterns(policy)
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+    except Exception as e:
+        LOGGER.warning("Failed to block resources through DevTools: " + str(e))
+        return
+    LOGGER.info(f"Blocking {len(patterns)} resource URL patterns")
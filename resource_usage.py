@@ -0,0 +1,140 @@
+# pylint: disable=W1201
+
+import logging
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+"""
+
+Memory and CPU usage of this process and everything it started (drivers, browsers and
+worker processes).
+
+psutil is optional: with it the whole process tree is measured; without it only this
+process's CPU time (plus reaped children) is available and memory is reported as None.
+
+"""
+
+LOGGER = logging.getLogger()
+
+
+def process_tree(pid=None):
+    root = psutil.Process(pid or os.getpid())
+    return [root] + root.children(recursive=True)
+
+
+def snapshot(pid=None):
+    if psutil is None:
+        times = os.times()
+        return {
+            "rss": None,
+            "cpu_seconds": times.user + times.system + times.children_user + times.children_system,
+            "processes": None,
+        }
+
+    rss = 0
+    cpu_seconds = 0.0
+    processes = 0
+    for process in process_tree(pid):
+        try:
+            rss += process.memory_info().rss
+            cpu = process.cpu_times()
+            cpu_seconds += cpu.user + cpu.system
+            processes += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return {"rss": rss, "cpu_seconds": cpu_seconds, "processes": processes}
+
+
+def driver_rss(driver):
+    # The driver service (chromedriver, geckodriver) and the browser it started
+    process = getattr(getattr(driver, "service", None), "process", None)
+    if psutil is None or process is None:
+        return None
+    rss = 0
+    try:
+        for child in process_tree(process.pid):
+            try:
+                rss += child.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+    except psutil.NoSuchProcess:
+        return None
+    return rss
+
+
+def format_bytes(value):
+    if value is None:
+        return "n/a"
+    return f"{value / (1024 * 1024):.1f} MiB"
+
+
+class UsageSampler:
+    def __init__(self, interval=0.5, pid=None):
+        self.interval = interval
+        self.pid = pid
+        self.peak_rss = None
+        self.peak_processes = None
+        self.peak_cpu_seconds = None
+        self.samples = 0
+        self.start_snapshot = None
+        self.started_at = None
+        self.stopped_at = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        current = snapshot(self.pid)
+        self.samples += 1
+        # The CPU time of children that already exited no longer shows up in the tree,
+        # so the busiest sample stands in for the total
+        self.peak_cpu_seconds = max(self.peak_cpu_seconds or 0, current["cpu_seconds"])
+        if current["rss"] is not None:
+            self.peak_rss = max(self.peak_rss or 0, current["rss"])
+            self.peak_processes = max(self.peak_processes or 0, current["processes"])
+        return current
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.start_snapshot = self.sample()
+        self.thread = threading.Thread(target=self.run, name="usage-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.stopped_at = time.monotonic()
+        self.sample()
+        return self.report()
+
+    def report(self):
+        return {
+            "wall_seconds": (self.stopped_at or time.monotonic()) - self.started_at,
+            "cpu_seconds": self.peak_cpu_seconds - self.start_snapshot["cpu_seconds"],
+            "peak_rss": self.peak_rss,
+            "peak_processes": self.peak_processes,
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def log_report(label, report):
+    LOGGER.info(
+        f"{label}: {report['wall_seconds']:.2f}s wall, {report['cpu_seconds']:.2f}s CPU, "
+        f"peak {format_bytes(report['peak_rss'])} RSS across "
+        f"{report['peak_processes'] or 'n/a'} processes"
+    )
@@ -0,0 +1,291 @@
+# pylint: disable=W1201
+
+import logging
+import random
+import threading
+import time
+
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    ElementNotInteractableException,
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
+
+import instrumentation
+import metrics
+
+"""
+
+Retries for the login, add to cart and checkout phases.
+
+Each phase runs its attempts through `run` with a `RetryPolicy`: a number of attempts,
+an optional time budget for the whole phase, and a jittered exponential backoff between
+attempts. A failed attempt is classified by its error:
+
+    soft        the page is fine, an element moved or was covered: click again
+    reload      the page did not get where it should: load it again
+    new_driver  the browser is gone: only a fresh driver helps
+    abort       stopped on purpose, do not retry
+
+A phase only retries the actions in its policy's `retry_on` and re-raises the rest, so
+a dead browser in add to cart reaches the worker, which can start a new one. Besides
+the phase budget, add to cart stops retrying at a global deadline after the release.
+
+Every decision is logged, recorded as a "retry" span, and counted in `STATS`, which
+`log_report` summarizes per phase: attempts, retries per action, and the seconds spent
+in failed attempts, capturing diagnostics and in backoff.
+
+    "retry_policies": {"add_to_cart": {"budget": 20, "backoff": 0.1, "max_backoff": 1}},
+    "release_deadline": 60
+
+"""
+
+LOGGER = logging.getLogger()
+
+SOFT = "soft"
+RELOAD = "reload"
+NEW_DRIVER = "new_driver"
+ABORT = "abort"
+ACTIONS = (SOFT, RELOAD, NEW_DRIVER, ABORT)
+
+# Fields a policy can override in config, and the defaults of each phase
+POLICY_FIELDS = ("attempts", "budget", "backoff", "max_backoff", "jitter")
+DEFAULT_POLICIES = {
+    "login": {"backoff": 1, "max_backoff": 5},
+    "add_to_cart": {"backoff": 0.1, "max_backoff": 1},
+    "checkout": {"backoff": 0.25, "max_backoff": 2},
+    # Only a dead browser is worth a second worker attempt: the phases retried the rest
+    "worker": {"attempts": 2, "retry_on": (NEW_DRIVER,)},
+}
+SESSION_GONE_MESSAGES = ("chrome not reachable", "session deleted", "disconnected", "not connected")
+
+POLICIES = {}
+RELEASE_DEADLINE = None
+STATS = {}
+_lock = threading.Lock()
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        name,
+        attempts,
+        budget=None,
+        backoff=0,
+        max_backoff=None,
+        jitter=0.5,
+        retry_on=(SOFT, RELOAD),
+    ):
+        self.name = name
+        self.attempts = attempts
+        self.budget = budget
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def __repr__(self):
+        return f"RetryPolicy({self.name}, {self.attempts} attempts)"
+
+    def delay(self, attempt):
+        delay = self.backoff * 2 ** (attempt - 1)
+        if self.max_backoff is not None:
+            delay = min(delay, self.max_backoff)
+        # Jitter keeps the workers from retrying in lockstep
+        return delay * (1 - self.jitter * random.random())
+
+
+class Deadline:
+    def __init__(self, at):
+        self.at = at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.monotonic() + seconds)
+
+    @classmethod
+    def at_wall_time(cls, wall_time):
+        return cls.after(wall_time - time.time())
+
+    def remaining(self):
+        return self.at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+def configure(policies=None, release_deadline=None):
+    global POLICIES, RELEASE_DEADLINE
+    POLICIES = dict(policies or {})
+    RELEASE_DEADLINE = release_deadline
+
+
+def validate_policies(policies):
+    errors = []
+    for name, fields in policies.items():
+        if name not in DEFAULT_POLICIES:
+            errors.append(f"retry_policies: unknown phase {name!r}")
+            continue
+        if not isinstance(fields, dict):
+            errors.append(f"retry_policies: {name} must be an object")
+            continue
+        for field, value in fields.items():
+            if field not in POLICY_FIELDS:
+                errors.append(f"retry_policies: {name}: unknown setting {field!r}")
+            elif value is not None and (
+                isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0
+            ):
+                errors.append(f"retry_policies: {name}: {field} must be a non-negative number")
+            elif field == "attempts" and (not isinstance(value, int) or value < 1):
+                errors.append(f"retry_policies: {name}: attempts must be a positive integer")
+    return errors
+
+
+def policy(name, attempts):
+    settings = dict(DEFAULT_POLICIES.get(name, {}))
+    settings.setdefault("attempts", attempts)
+    settings.update(
+        {field: value for field, value in POLICIES.get(name, {}).items() if value is not None}
+    )
+    return RetryPolicy(name, **settings)
+
+
+def release_deadline(release_time):
+    if not release_time or RELEASE_DEADLINE is None:
+        return None
+    return Deadline.at_wall_time(release_time + RELEASE_DEADLINE)
+
+
+def classify(error):
+    from async_engine import CartAttemptCancelled
+
+    if isinstance(error, CartAttemptCancelled):
+        return ABORT
+    if isinstance(
+        error,
+        (
+            StaleElementReferenceException,
+            ElementClickInterceptedException,
+            ElementNotInteractableException,
+        ),
+    ):
+        return SOFT
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException, ConnectionError)):
+        return NEW_DRIVER
+    if isinstance(error, WebDriverException) and not isinstance(error, TimeoutException):
+        message = (error.msg or "").lower()
+        if any(text in message for text in SESSION_GONE_MESSAGES):
+            return NEW_DRIVER
+    return RELOAD
+
+
+def count(phase, **amounts):
+    with _lock:
+        stats = STATS.setdefault(phase, {})
+        for key, amount in amounts.items():
+            stats[key] = stats.get(key, 0) + amount
+
+
+def run(
+    retry_policy,
+    attempt,
+    recover=None,
+    deadline=None,
+    stop_event=None,
+    failure=None,
+    on_failure=None,
+):
+    """
+    Calls `attempt(action)` until it returns, with the action taken after the previous
+    failure (None the first time). `recover(action)` runs before each retry, to reload
+    the page for example. Gives up when the attempts, the phase budget or `deadline`
+    run out, and re-raises errors whose action the policy does not retry.
+    `on_failure(error, action, attempt)` runs after each failure the browser can still
+    answer, and returns the seconds it took, which come off the backoff.
+    """
+    name = retry_policy.name
+    deadlines = [deadline] if deadline is not None else []
+    if retry_policy.budget is not None:
+        deadlines.append(Deadline.after(retry_policy.budget))
+    action = None
+    for number in range(1, retry_policy.attempts + 1):
+        if stop_event is not None and stop_event.is_set():
+            from async_engine import CartAttemptCancelled
+
+            raise CartAttemptCancelled(f"Stopped {name}")
+        start = time.monotonic()
+        try:
+            result = attempt(action)
+            count(name, attempts=1)
+            return result
+        except Exception as e:
+            failed_for = time.monotonic() - start
+            action = classify(e)
+            count(name, attempts=1, failed_seconds=failed_for, **{action: 1})
+            metrics.inc("retries_total", phase=name, action=action)
+            diagnosed_for = 0
+            if on_failure is not None and action not in (NEW_DRIVER, ABORT):
+                diagnosed_for = on_failure(e, action, number) or 0
+                count(name, diagnostics_seconds=diagnosed_for)
+            remaining = min((d.remaining() for d in deadlines), default=None)
+            if action not in retry_policy.retry_on:
+                give_up = f"{action} is not retried"
+            elif number == retry_policy.attempts:
+                give_up = f"no attempts left of {retry_policy.attempts}"
+            elif remaining is not None and remaining <= 0:
+                give_up = "out of time"
+            else:
+                give_up = None
+            with instrumentation.span(
+                "retry", phase=name, attempt=number, error=type(e).__name__, action=action
+            ) as args:
+                if give_up:
+                    LOGGER.warning(
+                        f"{name} attempt {number} failed ({type(e).__name__}: {str(e).strip()}), "
+                        f"giving up: {give_up}"
+                    )
+                    args["gave_up"] = give_up
+                    if action not in retry_policy.retry_on:
+                        raise
+                    raise Exception(failure or f"{name} failed: {give_up}") from e
+                delay = max(retry_policy.delay(number) - diagnosed_for, 0)
+                if remaining is not None:
+                    delay = min(delay, remaining)
+                args["delay"] = delay
+                LOGGER.warning(
+                    f"{name} attempt {number} failed after {failed_for:.2f}s "
+                    f"({type(e).__name__}: {str(e).strip()}), {action} in {delay:.2f}s"
+                )
+                count(name, backoff_seconds=delay)
+                time.sleep(delay)
+                if recover is not None:
+                    recover(action)
+    raise Exception(failure or f"{name} failed")
+
+
+def reset_stats():
+    with _lock:
+        STATS.clear()
+
+
+def log_report():
+    with _lock:
+        stats = {name: dict(values) for name, values in STATS.items()}
+    for name, values in stats.items():
+        retried = ", ".join(f"{values[action]} {action}" for action in ACTIONS if action in values)
+        LOGGER.info(
+            f"Retries in {name}: {values.get('attempts', 0)} attempts"
+            + (f" ({retried})" if retried else "")
+            + f", {values.get('failed_seconds', 0):.2f}s in failed attempts"
+            + (
+                f", {values['diagnostics_seconds']:.2f}s capturing diagnostics"
+                if "diagnostics_seconds" in values
+                else ""
+            )
+            + f", {values.get('backoff_seconds', 0):.2f}s backing off"
+        )
+    return stats
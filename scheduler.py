@@ -0,0 +1,58 @@
+# pylint: disable=W1201
+
+import logging
+import time
+
+import instrumentation
+
+"""
+
+Release-time scheduling.
+
+Times are parsed once into epoch seconds (`parse_time`), which pickle cheaply into the
+worker processes. A `ReleaseClock` maps that instant onto time.monotonic once, sleeps
+coarsely until `spin_window` seconds before the target and then spins on the monotonic
+clock for the last few milliseconds, so the firing skew is independent of wall-clock
+adjustments and of the OS sleep granularity.
+
+"""
+
+LOGGER = logging.getLogger()
+
+
+def parse_time(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    from dateutil import parser as date_parser  # only needed for config strings, not in workers
+
+    return date_parser.parse(value).timestamp()
+
+
+class ReleaseClock:
+    def __init__(self, release_at, spin_window=0.02):
+        self.release_at = parse_time(release_at)
+        self.spin_window = spin_window
+        self.target = time.monotonic() + (self.release_at - time.time())
+
+    def remaining(self, offset=0.0):
+        return self.target + offset - time.monotonic()
+
+    def sleep_until(self, offset=0.0):
+        target = self.target + offset
+        coarse = target - self.spin_window - time.monotonic()
+        if coarse > 0:
+            time.sleep(coarse)
+        while time.monotonic() < target:
+            pass
+        return time.monotonic() - target
+
+
+def wait_until(when, reason, spin_window=0.02):
+    if not when:
+        return None
+    when = parse_time(when)
+    LOGGER.info(f"Waiting until {reason}: " + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)))
+    with instrumentation.span("pause_until", reason=reason) as span_args:
+        skew = ReleaseClock(when, spin_window).sleep_until()
+        span_args["skew_ms"] = skew * 1000
+    return skew
@@ -0,0 +1,49 @@
+# pylint: disable=W1201
+
+import logging
+
+import resource_blocking
+
+"""
+
+Browser tabs for the multi-tab cart mode.
+
+All tabs of a browser share its cookie jar and cache, so one logged-in browser can cart
+several sizes without a browser process (and worker interpreter) per size. A WebDriver
+session only drives one tab at a time: navigations are started with a script so every
+tab loads in parallel, then each tab is switched to in turn.
+
+"""
+
+LOGGER = logging.getLogger()
+
+NAVIGATE_SCRIPT = "window.location.href = arguments[0];"
+
+
+def open_tabs(driver, count):
+    existing = set(driver.window_handles)
+    for _ in range(count):
+        driver.execute_script("window.open('about:blank', '_blank');")
+    handles = [handle for handle in driver.window_handles if handle not in existing]
+    if len(handles) != count:
+        raise Exception(f"Opened {len(handles)} of {count} tabs.")
+    LOGGER.info(f"Opened {count} tabs")
+    return handles
+
+
+def navigate_all(driver, handles, url):
+    # Returns as soon as every tab has started loading, unlike driver.get
+    for handle in handles:
+        driver.switch_to.window(handle)
+        resource_blocking.apply_to_current_tab(driver)  # DevTools rules are per tab
+        driver.execute_script(NAVIGATE_SCRIPT, url)
+
+
+def close_tabs(driver, handles, home_handle):
+    for handle in handles:
+        try:
+            driver.switch_to.window(handle)
+            driver.close()
+        except Exception as e:
+            LOGGER.warning("Failed to close tab: " + str(e))
+    driver.switch_to.window(home_handle)